@@ -0,0 +1,296 @@
+"""
+Resident alert scheduler (python alert_scheduler.py --daemon --token <CRON_TOKEN>).
+
+Keeps active alerts in a min-heap ordered by next-due time and sleeps until
+the earliest one is due, instead of paying interpreter startup and a scan of
+every alert on each cron tick. Each alert is re-checked every
+ALERT_DAEMON_EVAL_INTERVAL_S; its cadence only limits how often it emails,
+so one that has just sent waits out its cadence instead. Alert
+definitions are re-checked every ALERT_DAEMON_RELOAD_S seconds with a
+one-row fingerprint query and applied as a diff. SIGTERM/SIGINT let the
+current batch finish, then exit.
+
+With --listen the daemon also LISTENs for the NOTIFY sent by
+main.insert_results and re-evaluates only the alerts scoped to the
+models that just received results (debounced per probe run), so
+detection latency drops to seconds without polling.
+"""
+
+import os
+import json
+import time
+import heapq
+import signal
+import asyncio
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Set
+
+import asyncpg
+
+from db import init_pool, close_pool, get_pool, RESULTS_CHANNEL
+import alert_state
+from alert_scheduler import CADENCE_MINUTES, get_active_alerts, evaluate_alerts
+
+RELOAD_INTERVAL_S = float(os.environ.get('ALERT_DAEMON_RELOAD_S', '60'))
+# How often each alert's condition is re-checked (its cadence only limits emails)
+EVAL_INTERVAL_S = float(os.environ.get('ALERT_DAEMON_EVAL_INTERVAL_S', '300'))
+# Alerts falling due within this many seconds are evaluated as one batch
+BATCH_WINDOW_S = float(os.environ.get('ALERT_DAEMON_BATCH_S', '5'))
+# Delay before retrying a batch that failed (e.g. database unavailable)
+RETRY_DELAY_S = float(os.environ.get('ALERT_DAEMON_RETRY_S', '60'))
+
+# Quiet period after the last result notification before evaluating
+DEBOUNCE_S = float(os.environ.get('ALERT_DAEMON_DEBOUNCE_S', '3'))
+# Upper bound on how long a steady stream of notifications can defer evaluation
+DEBOUNCE_MAX_S = float(os.environ.get('ALERT_DAEMON_DEBOUNCE_MAX_S', '30'))
+
+# Fields whose change reschedules an alert
+DEFINITION_FIELDS = ('user_id', 'type', 'model', 'threshold', 'window', 'cadence')
+
+
+class AlertDaemon:
+    """Due-time priority queue over active alerts"""
+
+    def __init__(self, listen: bool = False):
+        # Entries are (due_ts, alert_id, version); stale versions are skipped
+        self._heap: List[tuple] = []
+        self._versions: Dict[int, int] = {}
+        self._definitions: Dict[int, tuple] = {}
+        self._fingerprint = None
+        self._stop = asyncio.Event()
+        # Heap batches and notification batches must not evaluate concurrently
+        self._eval_lock = asyncio.Lock()
+        # LISTEN/NOTIFY state
+        self._listen = listen
+        self._listener: Optional[asyncpg.Connection] = None
+        self._pending_models: Set[str] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._last_notify = 0.0
+
+    def stop(self):
+        """Request a graceful shutdown"""
+        if not self._stop.is_set():
+            print(f"[{datetime.now()}] Shutdown requested, finishing current batch...")
+        self._stop.set()
+
+    def _schedule(self, alert_id: int, due_ts: float):
+        version = self._versions.get(alert_id, 0) + 1
+        self._versions[alert_id] = version
+        heapq.heappush(self._heap, (due_ts, alert_id, version))
+
+    def _forget(self, alert_id: int):
+        # Any heap entries for this alert become stale
+        self._versions.pop(alert_id, None)
+        self._definitions.pop(alert_id, None)
+
+    @staticmethod
+    def _first_due(alert: Dict[str, Any], earliest: Optional[float] = None) -> float:
+        """Due at earliest (default now), or once the cadence since the last email has elapsed"""
+        earliest = time.time() if earliest is None else earliest
+        last_sent_at = alert.get('last_sent_at')
+        if last_sent_at is None:
+            return earliest
+        minutes = CADENCE_MINUTES.get(alert['cadence'], 60)
+        return max(earliest, (last_sent_at + timedelta(minutes=minutes)).timestamp())
+
+    async def _fetch_fingerprint(self) -> str:
+        """Digest of every alert definition, to skip reloads when nothing changed"""
+        return await get_pool().fetchval("""
+            SELECT md5(COALESCE(string_agg(
+                       concat_ws('|', a.id, a.user_id, a.type, a.model, a.threshold,
+                                 a.window, a.cadence, a.active),
+                       ',' ORDER BY a.id), ''))
+            FROM alerts a
+        """)
+
+    async def reload(self):
+        """Apply added, changed and removed alert definitions to the heap"""
+        fingerprint = await self._fetch_fingerprint()
+        if fingerprint == self._fingerprint:
+            return
+
+        alerts = await get_active_alerts()
+        current = {alert['id']: tuple(alert[f] for f in DEFINITION_FIELDS) for alert in alerts}
+        added = changed = 0
+
+        for alert in alerts:
+            previous = self._definitions.get(alert['id'])
+            if previous is None:
+                added += 1
+            elif previous != current[alert['id']]:
+                changed += 1
+            else:
+                continue
+            self._schedule(alert['id'], self._first_due(alert))
+
+        removed = [alert_id for alert_id in self._definitions if alert_id not in current]
+        for alert_id in removed:
+            self._forget(alert_id)
+
+        self._definitions = current
+        # Only now: if anything above failed, the next reload must try again
+        self._fingerprint = fingerprint
+        print(f"[{datetime.now()}] Alerts reloaded: {len(current)} active "
+              f"({added} added, {changed} changed, {len(removed)} removed)")
+
+    def _pop_due(self) -> List[int]:
+        horizon = time.time() + BATCH_WINDOW_S
+        due = []
+        while self._heap and self._heap[0][0] <= horizon:
+            _, alert_id, version = heapq.heappop(self._heap)
+            if self._versions.get(alert_id) == version:
+                due.append(alert_id)
+        return due
+
+    async def run_due(self, alert_ids: List[int]):
+        """Evaluate due alerts with fresh cadence/quiet-hours state and reschedule them"""
+        print(f"[{datetime.now()}] {len(alert_ids)} alert(s) due")
+
+        # Re-read just these alerts so last-sent times and quiet hours are current
+        alerts = await get_active_alerts(alert_ids)
+        for alert_id in set(alert_ids) - {alert['id'] for alert in alerts}:
+            self._forget(alert_id)
+
+        async with self._eval_lock:
+            triggered = await evaluate_alerts(alerts)
+
+        # Re-check every EVAL_INTERVAL_S; an alert that just sent cannot send
+        # again before its cadence, so it waits for that instead
+        sent_ids = {alert['id'] for alert, _ in triggered}
+        now = time.time()
+        for alert in alerts:
+            if alert['id'] in sent_ids:
+                alert = {**alert, 'last_sent_at': datetime.now()}
+            self._schedule(alert['id'], self._first_due(alert, now + EVAL_INTERVAL_S))
+
+    def _on_results(self, conn, pid, channel, payload):
+        """NOTIFY callback: collect the model and (re)arm the debounce timer"""
+        try:
+            model = json.loads(payload)['model']
+        except (ValueError, KeyError, TypeError):
+            print(f"Ignoring malformed {channel} payload: {payload!r}")
+            return
+
+        self._pending_models.add(model)
+        self._last_notify = time.monotonic()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_after_debounce())
+
+    async def _flush_after_debounce(self):
+        """
+        Wait for the burst to settle, then evaluate alerts for the pending
+        models; repeat while notifications arrived during the evaluation
+        """
+        while self._pending_models:
+            first = time.monotonic()
+            while True:
+                quiet_for = time.monotonic() - self._last_notify
+                waited = time.monotonic() - first
+                if quiet_for >= DEBOUNCE_S or waited >= DEBOUNCE_MAX_S:
+                    break
+                await asyncio.sleep(min(DEBOUNCE_S - quiet_for, DEBOUNCE_MAX_S - waited))
+
+            # Models notified from here on wait for the next round of this task
+            models, self._pending_models = self._pending_models, set()
+            await self._evaluate_models(models)
+
+    async def _evaluate_models(self, models: Set[str]):
+        """Evaluate the alerts scoped to any of models (or to all models)"""
+        model_index = DEFINITION_FIELDS.index('model')
+        alert_ids = [
+            alert_id for alert_id, definition in self._definitions.items()
+            if definition[model_index] is None or definition[model_index] in models
+        ]
+        if not alert_ids:
+            return
+
+        print(f"[{datetime.now()}] New results for {sorted(models)}: "
+              f"evaluating {len(alert_ids)} alert(s)")
+        try:
+            alerts = await get_active_alerts(alert_ids)
+            async with self._eval_lock:
+                await evaluate_alerts(alerts)
+        except Exception as e:
+            print(f"Error evaluating alerts for new results: {e}")
+
+    async def _ensure_listener(self):
+        """(Re)open the dedicated LISTEN connection if it is missing or dropped"""
+        if self._listener is not None:
+            if not self._listener.is_closed():
+                return
+            print(f"[{datetime.now()}] Listener connection lost, reconnecting")
+            await self._close_listener()
+
+        self._listener = await get_pool().acquire()
+        await self._listener.add_listener(RESULTS_CHANNEL, self._on_results)
+        print(f"[{datetime.now()}] Listening on '{RESULTS_CHANNEL}'")
+
+    async def _close_listener(self):
+        if self._listener is None:
+            return
+        try:
+            if not self._listener.is_closed():
+                await self._listener.remove_listener(RESULTS_CHANNEL, self._on_results)
+            await get_pool().release(self._listener)
+        finally:
+            self._listener = None
+
+    async def run(self):
+        """Run the scheduling loop, then drain notification work and release the listener"""
+        try:
+            await self._run_loop()
+        finally:
+            if self._flush_task is not None:
+                # Let an in-progress notification batch complete
+                await asyncio.gather(self._flush_task, return_exceptions=True)
+            await self._close_listener()
+
+    async def _run_loop(self):
+        """Sleep until the next due alert or reload, whichever is first"""
+        next_reload = 0.0
+
+        while not self._stop.is_set():
+            if time.time() >= next_reload:
+                try:
+                    await self.reload()
+                    if self._listen:
+                        await self._ensure_listener()
+                except Exception as e:
+                    print(f"Error reloading alerts: {e}")
+                next_reload = time.time() + RELOAD_INTERVAL_S
+
+            due = self._pop_due()
+            if due:
+                try:
+                    await self.run_due(due)
+                except Exception as e:
+                    print(f"Error evaluating due alerts: {e}")
+                    for alert_id in due:
+                        if alert_id in self._versions:
+                            self._schedule(alert_id, time.time() + RETRY_DELAY_S)
+                continue
+
+            wake_at = min(next_reload, self._heap[0][0]) if self._heap else next_reload
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=max(0.0, wake_at - time.time()))
+            except asyncio.TimeoutError:
+                pass
+
+
+async def run_daemon(rebuild_state: bool = False, listen: bool = False):
+    """Run the daemon until SIGTERM/SIGINT"""
+    await init_pool()
+    daemon = AlertDaemon(listen=listen)
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, daemon.stop)
+
+    try:
+        if rebuild_state:
+            await alert_state.rebuild()
+        print(f"[{datetime.now()}] Alert daemon started (reload every {RELOAD_INTERVAL_S:.0f}s)")
+        await daemon.run()
+    finally:
+        await close_pool()
+        print(f"[{datetime.now()}] Alert daemon stopped")
@@ -0,0 +1,211 @@
+"""
+Alert evaluation shared by the /api/alerts/test preview and the scheduler.
+
+All metrics an alert type needs are computed by one aggregate query per
+(model, window), so evaluation cost does not depend on how many results
+fall inside the window.
+
+With ALERT_METRIC_SOURCE=summary the aggregates are taken over per-run
+medians from multi-sample runs (run_summaries) instead of raw samples, so
+one noisy request cannot trigger an alert on its own.
+
+Alerts only look at probes of ALERT_PROMPT_ID (the default test prompt),
+so adding large prompts to the probe matrix does not move latency or cost
+alerts.
+"""
+
+import os
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from db import get_pool
+
+# Alert window -> lookback
+WINDOWS = {
+    '24h': timedelta(hours=24),
+    '7d': timedelta(days=7),
+}
+
+# 'samples' (every stored result) or 'summary' (one median per run and model)
+METRIC_SOURCE = os.environ.get('ALERT_METRIC_SOURCE', 'samples').lower()
+# Prompt corpus entry whose probes alerts are evaluated on
+ALERT_PROMPT_ID = os.environ.get('ALERT_PROMPT_ID', 'default')
+
+
+def window_delta(window: Optional[str]) -> timedelta:
+    """Lookback for an alert window ('24h' by default)"""
+    return WINDOWS.get(window or '24h', WINDOWS['24h'])
+
+
+async def fetch_window_aggregates(model: Optional[str], window: Optional[str]) -> Dict[str, Any]:
+    """Aggregate every metric alerts use over one (model, window) in the database"""
+    row = await get_pool().fetchrow("""
+        SELECT count(*) AS data_points,
+               count(DISTINCT model) AS models_tested,
+               max(COALESCE(latency_s, 0)) AS max_latency,
+               avg(tps) AS avg_tps,
+               min(tps) AS min_tps,
+               max(cost_usd / (in_tokens + out_tokens) * 1000000)
+                   FILTER (WHERE cost_usd > 0 AND in_tokens > 0 AND out_tokens > 0) AS max_cost_mtok,
+               count(*) FILTER (WHERE error IS NOT NULL) AS error_count
+        FROM results
+        WHERE ($1::varchar IS NULL OR model = $1)
+          AND ts >= now() - $2::interval
+          AND prompt_id = $3
+    """, model, window_delta(window), ALERT_PROMPT_ID)
+
+    def _float(value) -> Optional[float]:
+        return float(value) if value is not None else None
+
+    return {
+        'data_points': row['data_points'],
+        'models_tested': row['models_tested'],
+        'max_latency': _float(row['max_latency']),
+        'avg_tps': _float(row['avg_tps']),
+        'min_tps': _float(row['min_tps']),
+        'max_cost_mtok': _float(row['max_cost_mtok']),
+        'error_count': row['error_count'],
+    }
+
+
+async def fetch_summary_aggregates(model: Optional[str], window: Optional[str]) -> Dict[str, Any]:
+    """Same shape as fetch_window_aggregates, over run medians in run_summaries"""
+    row = await get_pool().fetchrow("""
+        SELECT count(*) AS data_points,
+               count(DISTINCT model) AS models_tested,
+               max(COALESCE(latency_s_median, 0)) AS max_latency,
+               avg(tps_median) AS avg_tps,
+               min(tps_median) AS min_tps,
+               max(cost_mtok_median) AS max_cost_mtok,
+               COALESCE(sum(errors), 0) AS error_count
+        FROM run_summaries
+        WHERE ($1::varchar IS NULL OR model = $1)
+          AND ts >= now() - $2::interval
+          AND prompt_id = $3
+    """, model, window_delta(window), ALERT_PROMPT_ID)
+
+    def _float(value) -> Optional[float]:
+        return float(value) if value is not None else None
+
+    return {
+        'data_points': row['data_points'],
+        'models_tested': row['models_tested'],
+        'max_latency': _float(row['max_latency']),
+        'avg_tps': _float(row['avg_tps']),
+        'min_tps': _float(row['min_tps']),
+        'max_cost_mtok': _float(row['max_cost_mtok']),
+        'error_count': row['error_count'],
+    }
+
+
+async def fetch_aggregates(model: Optional[str], window: Optional[str]) -> Dict[str, Any]:
+    """Window aggregates from the configured ALERT_METRIC_SOURCE"""
+    if METRIC_SOURCE == 'summary':
+        return await fetch_summary_aggregates(model, window)
+    return await fetch_window_aggregates(model, window)
+
+
+def _threshold(alert_type: str, threshold: Any) -> float:
+    try:
+        return float(threshold)
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid threshold value for {alert_type} alert")
+
+
+def evaluate(alert_type: str, threshold: Any, window: Optional[str], agg: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Evaluate an alert against window aggregates.
+    Returns triggered plus display fields (metric, value, threshold,
+    comparison) and raw details; raises ValueError for a bad threshold.
+    """
+    result = {'triggered': False, 'details': {}}
+    window = window or '24h'
+
+    if not agg['data_points']:
+        return result
+
+    if alert_type == 'latency' and threshold:
+        threshold_val = _threshold(alert_type, threshold)
+        max_latency = agg['max_latency'] or 0
+        result.update({
+            'triggered': max_latency > threshold_val,
+            'metric': 'Latency',
+            'value': f"{max_latency:.3f}s",
+            'threshold': f"{threshold_val}s",
+            'comparison': f"{max_latency:.3f}s > {threshold_val}s",
+            'details': {
+                'max_latency': round(max_latency, 3),
+                'threshold': threshold_val,
+                'comparison': f"{max_latency:.3f}s > {threshold_val}s",
+            },
+        })
+
+    elif alert_type == 'tps_drop' and threshold:
+        threshold_val = _threshold(alert_type, threshold)
+        avg_tps = agg['avg_tps']
+        min_tps = agg['min_tps']
+        if avg_tps is not None:
+            drop_percent = ((avg_tps - min_tps) / avg_tps * 100) if avg_tps > 0 else 0
+            result.update({
+                'triggered': drop_percent > threshold_val,
+                'metric': 'TPS Drop',
+                'value': f"{drop_percent:.2f}%",
+                'threshold': f"{threshold_val}%",
+                'comparison': f"{drop_percent:.2f}% > {threshold_val}%",
+                'details': {
+                    'avg_tps': round(avg_tps, 2),
+                    'min_tps': round(min_tps, 2),
+                    'drop_percent': round(drop_percent, 2),
+                    'threshold': threshold_val,
+                    'comparison': f"{drop_percent:.2f}% > {threshold_val}%",
+                },
+            })
+
+    elif alert_type == 'cost_mtok' and threshold:
+        threshold_val = _threshold(alert_type, threshold)
+        max_cost_mtok = agg['max_cost_mtok']
+        if max_cost_mtok is not None:
+            result.update({
+                'triggered': max_cost_mtok > threshold_val,
+                'metric': 'Cost per Million Tokens',
+                'value': f"${max_cost_mtok:.2f}",
+                'threshold': f"${threshold_val}",
+                'comparison': f"${max_cost_mtok:.2f} > ${threshold_val}",
+                'details': {
+                    'max_cost_per_mtok': round(max_cost_mtok, 2),
+                    'threshold': threshold_val,
+                    'comparison': f"${max_cost_mtok:.2f} > ${threshold_val}",
+                },
+            })
+
+    elif alert_type == 'error':
+        error_count = agg['error_count']
+        result.update({
+            'triggered': error_count > 0,
+            'metric': 'Errors',
+            'value': f"{error_count} error(s)",
+            'threshold': 'Any errors',
+            'comparison': f"{error_count} error(s) detected",
+            'details': {
+                'error_count': error_count,
+                'total_requests': agg['data_points'],
+                'error_rate': round(error_count / agg['data_points'] * 100, 2),
+            },
+        })
+
+    elif alert_type == 'digest':
+        # Digest always triggers (it's a summary)
+        result.update({
+            'triggered': True,
+            'metric': 'Performance Summary',
+            'value': f"{agg['data_points']} data points",
+            'threshold': 'N/A',
+            'comparison': f"{agg['data_points']} tests in {window} window",
+            'details': {
+                'data_points': agg['data_points'],
+                'models_tested': agg['models_tested'],
+                'time_window': window,
+            },
+        })
+
+    return result
@@ -2,19 +2,25 @@
 """
 Alert Scheduler - Evaluates active alerts and sends email notifications
 Run via: python alert_scheduler.py --cron <CRON_TOKEN>
+     or: python alert_scheduler.py --daemon --token <CRON_TOKEN> [--listen]   (long-running, see alert_daemon.py)
 """
 
 import os
 import sys
+import random
+import asyncio
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from string import Template
 from typing import List, Dict, Any, Optional
-import psycopg2
-import psycopg2.extras
-from psycopg2.extras import RealDictCursor
 import sib_api_v3_sdk
 from sib_api_v3_sdk.rest import ApiException
 
+from db import init_pool, close_pool, get_pool
+from alert_evaluator import evaluate, fetch_summary_aggregates, METRIC_SOURCE
+import alert_state
+
 # Cadence to minutes mapping
 CADENCE_MINUTES = {
     '5m': 5,
@@ -25,6 +31,11 @@ CADENCE_MINUTES = {
     '24h': 1440,
 }
 
+# Email dispatch: concurrent Brevo calls, retries with exponential backoff
+EMAIL_CONCURRENCY = int(os.environ.get('ALERT_EMAIL_CONCURRENCY', '8'))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('ALERT_EMAIL_MAX_ATTEMPTS', '3'))
+EMAIL_BACKOFF_S = float(os.environ.get('ALERT_EMAIL_BACKOFF_S', '1.0'))
+
 # Alert type labels
 ALERT_TYPE_LABELS = {
     'latency': 'High Latency',
@@ -35,82 +46,50 @@ ALERT_TYPE_LABELS = {
 }
 
 
-def get_db_connection():
-    """Get database connection using environment variables"""
-    return psycopg2.connect(
-        host=os.environ.get("PGHOST"),
-        database=os.environ.get("PGDATABASE"),
-        user=os.environ.get("PGUSER"),
-        password=os.environ.get("PGPASSWORD"),
-        port=os.environ.get("PGPORT"),
-    )
-
-
-def get_active_alerts() -> List[Dict[str, Any]]:
-    """Fetch all active alerts from the database"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cur.execute("""
+async def get_active_alerts(alert_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+    """
+    Fetch all active alerts (or just alert_ids) in one query, together with
+    each alert's last email time and its owner's quiet hours, so no
+    per-alert lookups are needed.
+    """
+    alerts = await get_pool().fetch("""
         SELECT a.id, a.user_id, a.type, a.model, a.threshold, a.window, a.cadence,
-               u.email as user_email
+               u.email as user_email,
+               s.quiet_hours,
+               last_email.sent_at as last_sent_at
         FROM alerts a
         JOIN users u ON a.user_id = u.id
+        LEFT JOIN user_settings s ON s.user_id = a.user_id
+        LEFT JOIN LATERAL (
+            SELECT max(e.sent_at) as sent_at
+            FROM email_events e
+            WHERE e.user_id = a.user_id
+              AND (e.alert_id = a.id OR e.payload -> 'alert_ids' @> to_jsonb(a.id))
+        ) last_email ON true
         WHERE a.active = true
+          AND ($1::integer[] IS NULL OR a.id = ANY($1))
         ORDER BY a.id
-    """)
-    
-    alerts = cur.fetchall()
-    cur.close()
-    conn.close()
+    """, alert_ids)
     
     return [dict(alert) for alert in alerts]
 
 
-def check_cadence(alert_id: int, user_id: int, cadence: str) -> bool:
+def check_cadence(alert: Dict[str, Any], now: Optional[datetime] = None) -> bool:
     """Check if enough time has passed since last email for this alert"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    last_sent_at = alert.get('last_sent_at')
     
-    minutes = CADENCE_MINUTES.get(cadence, 60)
-    threshold_time = datetime.now() - timedelta(minutes=minutes)
-    
-    cur.execute("""
-        SELECT id, sent_at
-        FROM email_events
-        WHERE user_id = %s AND alert_id = %s AND sent_at >= %s
-        ORDER BY sent_at DESC
-        LIMIT 1
-    """, (user_id, alert_id, threshold_time))
-    
-    result = cur.fetchone()
-    cur.close()
-    conn.close()
+    # If no email was ever sent, cadence check passes
+    if last_sent_at is None:
+        return True
     
-    # If no recent email found, cadence check passes
-    return result is None
+    minutes = CADENCE_MINUTES.get(alert['cadence'], 60)
+    threshold_time = (now or datetime.now()) - timedelta(minutes=minutes)
+    return last_sent_at < threshold_time
 
 
-def is_quiet_hours(user_id: int) -> bool:
-    """Check if current time falls within user's quiet hours"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cur.execute("""
-        SELECT quiet_hours
-        FROM user_settings
-        WHERE user_id = %s
-    """, (user_id,))
-    
-    result = cur.fetchone()
-    cur.close()
-    conn.close()
-    
-    if not result or not result.get('quiet_hours'):
-        return False
-    
-    quiet_hours = result['quiet_hours']
-    if not isinstance(quiet_hours, dict):
+def is_quiet_hours(quiet_hours: Optional[Dict[str, Any]]) -> bool:
+    """Check if current time falls within the user's quiet hours setting"""
+    if not quiet_hours or not isinstance(quiet_hours, dict):
         return False
     
     start = quiet_hours.get('start')
@@ -135,283 +114,317 @@ def is_quiet_hours(user_id: int) -> bool:
         return False
 
 
-def get_recent_metrics(model: Optional[str], window: str) -> List[Dict[str, Any]]:
-    """Get recent metrics for alert evaluation"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    # Calculate time threshold
-    if window == '7d':
-        threshold = datetime.now() - timedelta(days=7)
-    else:  # '24h' or default
-        threshold = datetime.now() - timedelta(hours=24)
-    
-    if model:
-        cur.execute("""
-            SELECT ts, model, latency_s, tps, cost_usd, in_tokens, out_tokens, error
-            FROM results
-            WHERE model = %s AND ts >= %s
-            ORDER BY ts DESC
-            LIMIT 100
-        """, (model, threshold))
-    else:
-        cur.execute("""
-            SELECT ts, model, latency_s, tps, cost_usd, in_tokens, out_tokens, error
-            FROM results
-            WHERE ts >= %s
-            ORDER BY ts DESC
-            LIMIT 100
-        """, (threshold,))
-    
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    
-    return [dict(row) for row in rows]
+# The Brevo SDK is blocking; calls run on this bounded pool
+_email_executor = ThreadPoolExecutor(max_workers=EMAIL_CONCURRENCY, thread_name_prefix='brevo')
+_email_api: Optional[sib_api_v3_sdk.TransactionalEmailsApi] = None
 
 
-def evaluate_alert(alert: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-    """Evaluate if an alert should trigger based on recent metrics"""
-    alert_type = alert['type']
-    model = alert['model']
-    threshold = alert['threshold']
-    window = alert['window'] or '24h'
-    
-    metrics = get_recent_metrics(model, window)
-    
-    if not metrics:
-        return None
-    
-    # Evaluate based on alert type
-    if alert_type == 'latency' and threshold:
-        threshold_val = float(threshold)
-        max_latency = max((m['latency_s'] or 0) for m in metrics)
-        
-        if max_latency > threshold_val:
-            return {
-                'triggered': True,
-                'metric': 'Latency',
-                'value': f"{max_latency:.3f}s",
-                'threshold': f"{threshold_val}s",
-                'comparison': f"{max_latency:.3f}s > {threshold_val}s"
-            }
-    
-    elif alert_type == 'tps_drop' and threshold:
-        threshold_val = float(threshold)
-        valid_tps = [m['tps'] for m in metrics if m['tps'] is not None]
-        
-        if valid_tps:
-            avg_tps = sum(valid_tps) / len(valid_tps)
-            min_tps = min(valid_tps)
-            drop_percent = ((avg_tps - min_tps) / avg_tps * 100) if avg_tps > 0 else 0
-            
-            if drop_percent > threshold_val:
-                return {
-                    'triggered': True,
-                    'metric': 'TPS Drop',
-                    'value': f"{drop_percent:.2f}%",
-                    'threshold': f"{threshold_val}%",
-                    'comparison': f"{drop_percent:.2f}% > {threshold_val}%"
-                }
-    
-    elif alert_type == 'cost_mtok' and threshold:
-        threshold_val = float(threshold)
-        costs = []
-        
-        for m in metrics:
-            if m['cost_usd'] and m['in_tokens'] and m['out_tokens']:
-                total_tokens = m['in_tokens'] + m['out_tokens']
-                if total_tokens > 0:
-                    cost_per_mtok = (m['cost_usd'] / total_tokens) * 1_000_000
-                    costs.append(cost_per_mtok)
-        
-        if costs:
-            max_cost_mtok = max(costs)
-            
-            if max_cost_mtok > threshold_val:
-                return {
-                    'triggered': True,
-                    'metric': 'Cost per Million Tokens',
-                    'value': f"${max_cost_mtok:.2f}",
-                    'threshold': f"${threshold_val}",
-                    'comparison': f"${max_cost_mtok:.2f} > ${threshold_val}"
-                }
-    
-    elif alert_type == 'error':
-        error_count = sum(1 for m in metrics if m['error'] is not None)
-        
-        if error_count > 0:
-            return {
-                'triggered': True,
-                'metric': 'Errors',
-                'value': f"{error_count} error(s)",
-                'threshold': 'Any errors',
-                'comparison': f"{error_count} error(s) detected"
-            }
-    
-    elif alert_type == 'digest':
-        # Digest always triggers (it's a summary)
-        return {
-            'triggered': True,
-            'metric': 'Performance Summary',
-            'value': f"{len(metrics)} data points",
-            'threshold': 'N/A',
-            'comparison': f"{len(metrics)} tests in {window} window"
-        }
-    
-    return None
+def get_email_api() -> sib_api_v3_sdk.TransactionalEmailsApi:
+    """Shared Brevo client (its urllib3 pool is sized for the dispatch concurrency)"""
+    global _email_api
+    
+    if _email_api is None:
+        configuration = sib_api_v3_sdk.Configuration()
+        configuration.api_key['api-key'] = os.environ.get('BREVO_API_KEY')
+        configuration.connection_pool_maxsize = EMAIL_CONCURRENCY
+        _email_api = sib_api_v3_sdk.TransactionalEmailsApi(sib_api_v3_sdk.ApiClient(configuration))
+    return _email_api
 
 
-def send_alert_email(alert: Dict[str, Any], evaluation: Dict[str, Any]):
-    """Send alert email via Brevo"""
-    configuration = sib_api_v3_sdk.Configuration()
-    configuration.api_key['api-key'] = os.environ.get('BREVO_API_KEY')
-    
-    api_instance = sib_api_v3_sdk.TransactionalEmailsApi(sib_api_v3_sdk.ApiClient(configuration))
-    
-    alert_label = ALERT_TYPE_LABELS.get(alert['type'], alert['type'])
-    model_name = alert['model'] or 'All Models'
-    
-    subject = f"⚠️ Alert: {alert_label}"
-    if alert['type'] != 'digest':
-        subject += f" for {model_name}"
-    
-    html_content = f"""
+# Email templates are parsed once; each run only substitutes values
+_EMAIL_TEMPLATE = Template("""
     <!DOCTYPE html>
     <html>
       <head>
         <meta charset="utf-8">
         <style>
-          body {{ font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; line-height: 1.6; color: #333; }}
-          .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-          .alert {{ background-color: #fef2f2; border-left: 4px solid #ef4444; padding: 16px; margin: 20px 0; }}
-          .digest {{ background-color: #f0fdf4; border-left: 4px solid #10b981; padding: 16px; margin: 20px 0; }}
-          .metric {{ background-color: #f9fafb; padding: 12px; border-radius: 6px; margin: 10px 0; }}
-          .button {{ display: inline-block; padding: 12px 24px; background-color: #10b981; color: white; text-decoration: none; border-radius: 6px; font-weight: 500; }}
+          body { font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; line-height: 1.6; color: #333; }
+          .container { max-width: 600px; margin: 0 auto; padding: 20px; }
+          .alert { background-color: #fef2f2; border-left: 4px solid #ef4444; padding: 16px; margin: 20px 0; }
+          .digest { background-color: #f0fdf4; border-left: 4px solid #10b981; padding: 16px; margin: 20px 0; }
+          .metric { background-color: #f9fafb; padding: 12px; border-radius: 6px; margin: 10px 0; }
+          .button { display: inline-block; padding: 12px 24px; background-color: #10b981; color: white; text-decoration: none; border-radius: 6px; font-weight: 500; }
         </style>
       </head>
       <body>
         <div class="container">
-          <h1>{'📊 Performance Digest' if alert['type'] == 'digest' else '🚨 Alert Triggered'}</h1>
-          <div class="{'digest' if alert['type'] == 'digest' else 'alert'}">
-            <strong>{alert_label}</strong> for <strong>{model_name}</strong>
-          </div>
-          <div class="metric">
-            <p><strong>Metric:</strong> {evaluation['metric']}</p>
-            <p><strong>Current Value:</strong> {evaluation['value']}</p>
-            <p><strong>Threshold:</strong> {evaluation['threshold']}</p>
-            <p><strong>Time:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}</p>
-          </div>
+          <h1>$heading</h1>
+$sections
+          <p><strong>Time:</strong> $time</p>
           <p style="margin: 30px 0;">
-            <a href="{os.environ.get('APP_BASE_URL', 'http://localhost:5000')}/dashboard" class="button">View Dashboard</a>
+            <a href="$dashboard_url" class="button">View Dashboard</a>
           </p>
         </div>
       </body>
     </html>
-    """
+    """)
+
+_ALERT_SECTION_TEMPLATE = Template("""
+          <div class="$box_class">
+            <strong>$label</strong> for <strong>$model_name</strong>
+          </div>
+          <div class="metric">
+            <p><strong>Metric:</strong> $metric</p>
+            <p><strong>Current Value:</strong> $value</p>
+            <p><strong>Threshold:</strong> $threshold</p>
+          </div>""")
+
+
+def build_alert_email(user_email: str, items: List[tuple]) -> sib_api_v3_sdk.SendSmtpEmail:
+    """Render one email covering every (alert, evaluation) triggered for a user"""
+    sections = []
+    for alert, evaluation in items:
+        sections.append(_ALERT_SECTION_TEMPLATE.substitute(
+            box_class='digest' if alert['type'] == 'digest' else 'alert',
+            label=ALERT_TYPE_LABELS.get(alert['type'], alert['type']),
+            model_name=alert['model'] or 'All Models',
+            metric=evaluation['metric'],
+            value=evaluation['value'],
+            threshold=evaluation['threshold'],
+        ))
+    
+    only_digests = all(alert['type'] == 'digest' for alert, _ in items)
+    if len(items) == 1:
+        alert = items[0][0]
+        subject = f"⚠️ Alert: {ALERT_TYPE_LABELS.get(alert['type'], alert['type'])}"
+        if alert['type'] != 'digest':
+            subject += f" for {alert['model'] or 'All Models'}"
+        heading = '📊 Performance Digest' if only_digests else '🚨 Alert Triggered'
+    else:
+        subject = f"⚠️ {len(items)} Alerts: " + ", ".join(
+            ALERT_TYPE_LABELS.get(alert['type'], alert['type']) for alert, _ in items
+        )
+        heading = '📊 Performance Digest' if only_digests else f"🚨 {len(items)} Alerts Triggered"
+    
+    html_content = _EMAIL_TEMPLATE.substitute(
+        heading=heading,
+        sections="".join(sections),
+        time=datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC'),
+        dashboard_url=f"{os.environ.get('APP_BASE_URL', 'http://localhost:5000')}/dashboard",
+    )
     
-    send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
-        to=[{"email": alert['user_email']}],
+    return sib_api_v3_sdk.SendSmtpEmail(
+        to=[{"email": user_email}],
         sender={"name": "Optaimi Pulse", "email": "pulse@optaimi.com"},
         subject=subject,
         html_content=html_content
     )
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors and transport failures are worth retrying"""
+    if isinstance(error, ApiException):
+        return not error.status or error.status == 429 or error.status >= 500
+    return True
+
+
+async def send_email(email: sib_api_v3_sdk.SendSmtpEmail, recipient: str) -> bool:
+    """Send one email via Brevo, retrying transient failures with jittered backoff"""
+    loop = asyncio.get_running_loop()
     
-    try:
-        api_response = api_instance.send_transac_email(send_smtp_email)
-        print(f"Alert email sent to {alert['user_email']}: {api_response}")
-        return True
-    except ApiException as e:
-        print(f"Error sending alert email: {e}")
-        return False
+    for attempt in range(1, EMAIL_MAX_ATTEMPTS + 1):
+        try:
+            api_response = await loop.run_in_executor(
+                _email_executor, get_email_api().send_transac_email, email
+            )
+            print(f"Alert email sent to {recipient}: {api_response}")
+            return True
+        except Exception as e:
+            if attempt == EMAIL_MAX_ATTEMPTS or not _is_retryable(e):
+                print(f"Error sending alert email to {recipient}: {e}")
+                return False
+            delay = EMAIL_BACKOFF_S * 2 ** (attempt - 1) * (0.5 + random.random())
+            print(f"Retrying email to {recipient} in {delay:.1f}s (attempt {attempt} failed: {e})")
+            await asyncio.sleep(delay)
+    
+    return False
 
 
-def log_email_event(user_id: int, alert_id: int, status: str, payload: Dict[str, Any]):
-    """Log email event to database"""
-    conn = get_db_connection()
-    cur = conn.cursor()
+async def log_email_events(events: List[Dict[str, Any]]):
+    """Log a batch of email events to the database in one statement"""
+    if not events:
+        return
     
-    cur.execute("""
+    await get_pool().execute("""
         INSERT INTO email_events (user_id, alert_id, status, payload)
-        VALUES (%s, %s, %s, %s)
-    """, (user_id, alert_id, status, psycopg2.extras.Json(payload)))
-    
-    conn.commit()
-    cur.close()
-    conn.close()
+        SELECT * FROM unnest($1::varchar[], $2::integer[], $3::text[], $4::jsonb[])
+    """,
+        [e['user_id'] for e in events],
+        [e['alert_id'] for e in events],
+        [e['status'] for e in events],
+        [e['payload'] for e in events],
+    )
 
 
-def run_scheduler():
-    """Main scheduler logic - evaluate all active alerts"""
-    print(f"[{datetime.now()}] Running alert scheduler...")
-    
-    alerts = get_active_alerts()
-    print(f"Found {len(alerts)} active alert(s)")
+async def dispatch_alerts(triggered: List[tuple]):
+    """
+    Coalesce triggered alerts into one email per user, send those
+    concurrently, then log one email_events row per user in a single batch.
+    """
+    by_user: Dict[str, List[tuple]] = {}
+    for alert, evaluation in triggered:
+        by_user.setdefault(alert['user_id'], []).append((alert, evaluation))
+    
+    outcomes = await asyncio.gather(
+        *(send_email(build_alert_email(items[0][0]['user_email'], items), items[0][0]['user_email'])
+          for items in by_user.values()),
+        return_exceptions=True,
+    )
     
-    for alert in alerts:
-        try:
-            alert_id = alert['id']
-            user_id = alert['user_id']
-            cadence = alert['cadence']
-            
-            # Check cadence - skip if email sent recently
-            if not check_cadence(alert_id, user_id, cadence):
-                print(f"  Alert {alert_id}: Skipping (cadence not met)")
-                continue
-            
-            # Check quiet hours
-            if is_quiet_hours(user_id):
-                print(f"  Alert {alert_id}: Skipping (quiet hours)")
-                continue
-            
-            # Evaluate alert condition
-            evaluation = evaluate_alert(alert)
-            
-            if evaluation and evaluation.get('triggered'):
-                print(f"  Alert {alert_id}: TRIGGERED - {evaluation['comparison']}")
-                
-                # Send email
-                success = send_alert_email(alert, evaluation)
-                
-                # Log event
-                log_email_event(
-                    user_id=user_id,
-                    alert_id=alert_id,
-                    status='sent' if success else 'failed',
-                    payload={
+    events = []
+    for (user_id, items), outcome in zip(by_user.items(), outcomes):
+        success = outcome is True
+        alert_ids = [alert['id'] for alert, _ in items]
+        user_email = items[0][0]['user_email']
+        if isinstance(outcome, Exception):
+            print(f"  Alerts {alert_ids}: Error - {outcome}")
+        elif success:
+            print(f"  Alerts {alert_ids}: Email sent to {user_email}")
+        else:
+            print(f"  Alerts {alert_ids}: Email failed to send")
+        
+        events.append({
+            'user_id': user_id,
+            # Single-alert emails keep the FK; cadence also matches payload alert_ids
+            'alert_id': alert_ids[0] if len(alert_ids) == 1 else None,
+            'status': 'sent' if success else 'failed',
+            'payload': {
+                'alert_ids': alert_ids,
+                'alerts': [
+                    {
+                        'alert_id': alert['id'],
                         'alert_type': alert['type'],
                         'model': alert['model'],
                         'evaluation': evaluation,
-                        'timestamp': datetime.now().isoformat()
                     }
-                )
+                    for alert, evaluation in items
+                ],
+                'timestamp': datetime.now().isoformat()
+            },
+        })
+    
+    await log_email_events(events)
+
+
+async def evaluate_alerts(alerts: List[Dict[str, Any]]) -> List[tuple]:
+    """
+    Check cadence and quiet hours, evaluate the remaining alerts and send
+    emails. Returns the triggered (alert, evaluation) pairs.
+    """
+    # Cadence and quiet hours were loaded with the alerts; filter in memory
+    now = datetime.now()
+    due_alerts = []
+    for alert in alerts:
+        if not check_cadence(alert, now):
+            print(f"  Alert {alert['id']}: Skipping (cadence not met)")
+        elif is_quiet_hours(alert['quiet_hours']):
+            print(f"  Alert {alert['id']}: Skipping (quiet hours)")
+        else:
+            due_alerts.append(alert)
+    
+    if METRIC_SOURCE == 'summary':
+        # Run summaries hold one row per (run, model); aggregate them directly
+        load_aggregates = fetch_summary_aggregates
+    else:
+        # Recompute the unsettled hours of the running aggregates from raw rows
+        previous, current = await alert_state.advance()
+        print(f"Alert state settled up to {current} (previously {previous})")
+        load_aggregates = alert_state.window_aggregates
+    
+    # Aggregate each distinct (model, window) once and share it
+    groups: Dict[tuple, List[Dict[str, Any]]] = {}
+    for alert in due_alerts:
+        groups.setdefault((alert['model'], alert['window'] or '24h'), []).append(alert)
+    
+    group_keys = list(groups)
+    group_aggregates = await asyncio.gather(
+        *(load_aggregates(model, window) for model, window in group_keys),
+        return_exceptions=True,
+    )
+    print(f"Loaded metrics for {len(group_keys)} (model, window) group(s)")
+    
+    triggered = []
+    for key, aggregates in zip(group_keys, group_aggregates):
+        for alert in groups[key]:
+            try:
+                if isinstance(aggregates, Exception):
+                    raise aggregates
                 
-                if success:
-                    print(f"  Alert {alert_id}: Email sent to {alert['user_email']}")
+                # Evaluate alert condition
+                evaluation = evaluate(alert['type'], alert['threshold'], alert['window'], aggregates)
+                if evaluation['triggered']:
+                    print(f"  Alert {alert['id']}: TRIGGERED - {evaluation['comparison']}")
+                    triggered.append((alert, evaluation))
                 else:
-                    print(f"  Alert {alert_id}: Email failed to send")
-            else:
-                print(f"  Alert {alert_id}: Not triggered")
+                    print(f"  Alert {alert['id']}: Not triggered")
                 
-        except Exception as e:
-            print(f"  Alert {alert.get('id', 'unknown')}: Error - {e}")
+            except Exception as e:
+                print(f"  Alert {alert.get('id', 'unknown')}: Error - {e}")
+    
+    # One email per user, sent concurrently (bounded) and logged in one batch
+    if triggered:
+        users = len({alert['user_id'] for alert, _ in triggered})
+        print(f"Dispatching {len(triggered)} triggered alert(s) as {users} email(s) "
+              f"(concurrency {EMAIL_CONCURRENCY})")
+        await dispatch_alerts(triggered)
+    return triggered
+
+
+async def run_scheduler():
+    """Main scheduler logic - evaluate all active alerts"""
+    print(f"[{datetime.now()}] Running alert scheduler...")
+    
+    alerts = await get_active_alerts()
+    print(f"Found {len(alerts)} active alert(s)")
+    
+    await evaluate_alerts(alerts)
     
     print(f"[{datetime.now()}] Scheduler run complete\n")
 
 
+async def main(rebuild_state: bool = False):
+    """Open the shared pool for the duration of one scheduler run"""
+    await init_pool()
+    try:
+        if rebuild_state:
+            await alert_state.rebuild()
+            print("Alert state reset; the next advance refolds the retention window")
+        await run_scheduler()
+    finally:
+        await close_pool()
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Alert Scheduler')
-    parser.add_argument('--cron', help='Cron token for authentication', required=True)
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--cron', help='Cron token for authentication (one-shot run)')
+    mode.add_argument('--daemon', action='store_true',
+                      help='Run continuously, evaluating each alert when it is due')
+    parser.add_argument('--token', help='With --daemon: cron token for authentication')
+    parser.add_argument('--rebuild-state', action='store_true',
+                        help='Reset incremental alert aggregates before running')
+    parser.add_argument('--listen', action='store_true',
+                        help='With --daemon: also evaluate alerts as soon as new results are inserted')
     args = parser.parse_args()
     
-    # Verify CRON_TOKEN
+    if args.listen and not args.daemon:
+        parser.error('--listen requires --daemon')
+    if args.token and not args.daemon:
+        parser.error('--token is only used with --daemon (pass the token to --cron)')
+    
+    # Verify CRON_TOKEN (both modes send email)
     expected_token = os.environ.get('CRON_TOKEN')
     if not expected_token:
         print("Error: CRON_TOKEN environment variable not set")
         sys.exit(1)
     
-    if args.cron != expected_token:
+    if (args.token if args.daemon else args.cron) != expected_token:
         print("Error: Invalid CRON_TOKEN")
         sys.exit(1)
     
-    run_scheduler()
+    if args.daemon:
+        from alert_daemon import run_daemon
+        asyncio.run(run_daemon(rebuild_state=args.rebuild_state, listen=args.listen))
+        sys.exit(0)
+    
+    asyncio.run(main(rebuild_state=args.rebuild_state))
@@ -0,0 +1,155 @@
+"""
+Persisted running aggregates for incremental alert evaluation.
+
+Results rows (of ALERT_PROMPT_ID) are kept as hourly per-model buckets
+(count, error count, max latency, TPS sum/count/min, max cost per MTok);
+buckets that have aged out of the longest alert window are dropped. A
+window's aggregates are the merge of the buckets fully inside it plus a raw
+scan of the single partial hour at its start, so per-run cost scales with
+new data rather than with window size.
+
+Inserts are multi-statement transactions from several processes, so rows
+do not become visible in id order: a lower id can commit after a higher
+one. Instead of an id high-water mark, each run recomputes every bucket
+from the hour of the settled mark onwards from raw rows, then moves the
+mark to now() - ALERT_STATE_SETTLE_LAG_MIN. A results row is stamped with
+its transaction's start time, so anything older than the mark has committed
+unless an insert transaction ran longer than the lag. `python
+alert_scheduler.py --rebuild-state` resets the buckets if they ever drift.
+"""
+
+import os
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+import asyncpg
+
+from db import get_pool
+from alert_evaluator import WINDOWS, ALERT_PROMPT_ID, window_delta
+
+WATERMARK_NAME = 'alert_metric_buckets'
+
+# Keep one extra hour so the partial bucket at the oldest window edge survives
+RETENTION = max(WINDOWS.values()) + timedelta(hours=1)
+
+# Rows stamped earlier than now() minus this are assumed committed (longer than any insert)
+SETTLE_LAG = timedelta(minutes=float(os.environ.get('ALERT_STATE_SETTLE_LAG_MIN', '15')))
+
+
+async def advance(conn: Optional[asyncpg.Connection] = None) -> tuple:
+    """
+    Recompute the buckets from the settled mark's hour onwards and expire old
+    buckets. Returns the (previous, new) settled mark.
+    """
+    if conn is None:
+        async with get_pool().acquire() as conn:
+            return await advance(conn)
+
+    async with conn.transaction():
+        # Serialise concurrent scheduler runs
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", WATERMARK_NAME)
+
+        settled = await conn.fetchval("""
+            SELECT settled_until FROM alert_watermarks WHERE name = $1
+        """, WATERMARK_NAME)
+        # First run, or idle for longer than the retention: start at the retention edge
+        from_ts = await conn.fetchval("""
+            SELECT date_trunc('hour', GREATEST($1::timestamptz, now() - $2::interval))
+        """, settled, RETENTION)
+
+        await conn.execute("""
+            DELETE FROM alert_metric_buckets WHERE bucket_ts >= $1
+        """, from_ts)
+        await conn.execute("""
+            INSERT INTO alert_metric_buckets
+                (model, bucket_ts, count, error_count, latency_max,
+                 tps_sum, tps_count, tps_min, cost_mtok_max)
+            SELECT model,
+                   date_trunc('hour', ts),
+                   count(*),
+                   count(*) FILTER (WHERE error IS NOT NULL),
+                   max(COALESCE(latency_s, 0)),
+                   sum(tps),
+                   count(tps),
+                   min(tps),
+                   max(cost_usd / (in_tokens + out_tokens) * 1000000)
+                       FILTER (WHERE cost_usd > 0 AND in_tokens > 0 AND out_tokens > 0)
+            FROM results
+            WHERE ts >= $1
+              AND prompt_id = $2
+            GROUP BY model, date_trunc('hour', ts)
+        """, from_ts, ALERT_PROMPT_ID)
+
+        new_settled = await conn.fetchval("""
+            INSERT INTO alert_watermarks (name, settled_until, updated_at)
+            VALUES ($1, now() - $2::interval, now())
+            ON CONFLICT (name) DO UPDATE SET
+                settled_until = EXCLUDED.settled_until,
+                updated_at = EXCLUDED.updated_at
+            RETURNING settled_until
+        """, WATERMARK_NAME, SETTLE_LAG)
+
+        # Expire buckets that no window can reach any more
+        await conn.execute("""
+            DELETE FROM alert_metric_buckets WHERE bucket_ts < now() - $1::interval
+        """, RETENTION)
+
+    return settled, new_settled
+
+
+async def window_aggregates(model: Optional[str], window: Optional[str]) -> Dict[str, Any]:
+    """Same shape as alert_evaluator.fetch_window_aggregates, built from the buckets"""
+    row = await get_pool().fetchrow("""
+        WITH edge AS (
+            SELECT now() - $2::interval AS start_ts,
+                   date_trunc('hour', now() - $2::interval) + interval '1 hour' AS end_ts
+        ),
+        parts AS (
+            -- Whole hours inside the window
+            SELECT b.model, b.count, b.error_count, b.latency_max,
+                   b.tps_sum, b.tps_count, b.tps_min, b.cost_mtok_max
+            FROM alert_metric_buckets b, edge
+            WHERE ($1::varchar IS NULL OR b.model = $1)
+              AND b.bucket_ts >= edge.end_ts
+            UNION ALL
+            -- The partial hour at the start of the window, from raw rows
+            SELECT r.model, 1, (r.error IS NOT NULL)::int, COALESCE(r.latency_s, 0),
+                   r.tps, (r.tps IS NOT NULL)::int, r.tps,
+                   CASE WHEN r.cost_usd > 0 AND r.in_tokens > 0 AND r.out_tokens > 0
+                        THEN r.cost_usd / (r.in_tokens + r.out_tokens) * 1000000 END
+            FROM results r, edge
+            WHERE ($1::varchar IS NULL OR r.model = $1)
+              AND r.ts >= edge.start_ts AND r.ts < edge.end_ts
+              AND r.prompt_id = $3
+        )
+        SELECT COALESCE(sum(count), 0)::bigint AS data_points,
+               count(DISTINCT model) FILTER (WHERE count > 0) AS models_tested,
+               max(latency_max) AS max_latency,
+               sum(tps_sum) / NULLIF(sum(tps_count), 0) AS avg_tps,
+               min(tps_min) AS min_tps,
+               max(cost_mtok_max) AS max_cost_mtok,
+               COALESCE(sum(error_count), 0)::bigint AS error_count
+        FROM parts
+    """, model, window_delta(window), ALERT_PROMPT_ID)
+
+    def _float(value) -> Optional[float]:
+        return float(value) if value is not None else None
+
+    return {
+        'data_points': row['data_points'],
+        'models_tested': row['models_tested'],
+        'max_latency': _float(row['max_latency']),
+        'avg_tps': _float(row['avg_tps']),
+        'min_tps': _float(row['min_tps']),
+        'max_cost_mtok': _float(row['max_cost_mtok']),
+        'error_count': row['error_count'],
+    }
+
+
+async def rebuild() -> None:
+    """Drop all running state so the next advance() refolds the retention window"""
+    async with get_pool().acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", WATERMARK_NAME)
+            await conn.execute("DELETE FROM alert_metric_buckets")
+            await conn.execute("DELETE FROM alert_watermarks WHERE name = $1", WATERMARK_NAME)
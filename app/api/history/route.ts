@@ -5,6 +5,11 @@ export async function GET(request: Request) {
     const { searchParams } = new URL(request.url);
     const model = searchParams.get('model');
     const range = searchParams.get('range') || '24h';
+    const bucket = searchParams.get('bucket');
+    const maxPoints = searchParams.get('max_points');
+    const metric = searchParams.get('metric');
+    const view = searchParams.get('view');
+    const promptId = searchParams.get('prompt_id');
 
     const replitDomain = process.env.REPLIT_DEV_DOMAIN;
     const backendUrl = replitDomain 
@@ -14,6 +19,11 @@ export async function GET(request: Request) {
     const queryParams = new URLSearchParams();
     if (model) queryParams.set('model', model);
     queryParams.set('range', range);
+    if (bucket) queryParams.set('bucket', bucket);
+    if (maxPoints) queryParams.set('max_points', maxPoints);
+    if (metric) queryParams.set('metric', metric);
+    if (view) queryParams.set('view', view);
+    if (promptId) queryParams.set('prompt_id', promptId);
 
     const response = await fetch(`${backendUrl}/api/history?${queryParams}`, {
       method: 'GET',
@@ -0,0 +1,43 @@
+import { NextResponse, NextRequest } from 'next/server';
+
+export const dynamic = 'force-dynamic';
+
+export async function GET(
+  request: NextRequest,
+  { params }: { params: Promise<{ id: string }> }
+) {
+  try {
+    const { id } = await params;
+    const replitDomain = process.env.REPLIT_DEV_DOMAIN;
+    const backendUrl = replitDomain 
+      ? `https://${replitDomain}:8000`
+      : 'http://localhost:8000';
+    
+    const response = await fetch(`${backendUrl}/api/jobs/${encodeURIComponent(id)}/events`, {
+      method: 'GET',
+      headers: {
+        'Accept': 'text/event-stream',
+      },
+      cache: 'no-store',
+    });
+
+    if (!response.ok || !response.body) {
+      throw new Error(`Backend returned ${response.status}`);
+    }
+
+    // Pass the event stream through unbuffered so results arrive as each model completes
+    return new Response(response.body, {
+      headers: {
+        'Content-Type': response.headers.get('Content-Type') ?? 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+      },
+    });
+  } catch (error) {
+    console.error('Error proxying to backend:', error);
+    return NextResponse.json(
+      { error: 'Failed to stream job events' },
+      { status: 500 }
+    );
+  }
+}
@@ -0,0 +1,46 @@
+import { NextResponse, NextRequest } from 'next/server';
+
+export const dynamic = 'force-dynamic';
+
+export async function POST(request: NextRequest) {
+  try {
+    const replitDomain = process.env.REPLIT_DEV_DOMAIN;
+    const backendUrl = replitDomain 
+      ? `https://${replitDomain}:8000`
+      : 'http://localhost:8000';
+    
+    // Get the request body
+    const body = await request.json();
+    
+    const response = await fetch(`${backendUrl}/api/run-test/stream`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Accept': 'text/event-stream',
+      },
+      body: JSON.stringify(body),
+      cache: 'no-store',
+    });
+
+    if (!response.body) {
+      throw new Error(`Backend returned ${response.status}`);
+    }
+
+    // Pass the event stream through unbuffered so results arrive as each model completes.
+    // Validation errors come back as JSON, so keep the backend's status and type
+    return new Response(response.body, {
+      status: response.status,
+      headers: {
+        'Content-Type': response.headers.get('Content-Type') ?? 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+      },
+    });
+  } catch (error) {
+    console.error('Error proxying to backend:', error);
+    return NextResponse.json(
+      { error: 'Failed to stream test results' },
+      { status: 500 }
+    );
+  }
+}
@@ -0,0 +1,39 @@
+import { NextResponse } from 'next/server';
+
+export async function GET(request: Request) {
+  try {
+    const { searchParams } = new URL(request.url);
+
+    const replitDomain = process.env.REPLIT_DEV_DOMAIN;
+    const backendUrl = replitDomain 
+      ? `https://${replitDomain}:8000`
+      : 'http://localhost:8000';
+    
+    const queryParams = new URLSearchParams();
+    for (const key of ['model', 'range', 'start_ms', 'end_ms', 'prompt_id']) {
+      const value = searchParams.get(key);
+      if (value) queryParams.set(key, value);
+    }
+
+    const response = await fetch(`${backendUrl}/api/stats?${queryParams}`, {
+      method: 'GET',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      cache: 'no-store',
+    });
+
+    if (!response.ok) {
+      throw new Error(`Backend returned ${response.status}`);
+    }
+
+    const data = await response.json();
+    return NextResponse.json(data);
+  } catch (error) {
+    console.error('Error proxying stats to backend:', error);
+    return NextResponse.json(
+      { error: 'Failed to fetch stats' },
+      { status: 500 }
+    );
+  }
+}
@@ -0,0 +1,153 @@
+"""
+In-process response cache with TTL, LRU eviction and request coalescing.
+
+Concurrent misses for the same key share one in-flight load, and
+invalidate() drops entries (and discards loads that started before it) so
+readers never see data older than the last write in this process.
+
+With a shared-state backend (see shared_state.py) the cache also spans
+worker processes: loaded values are published to the backend, where other
+workers find them on a local miss, and invalidate() deletes them there and
+bumps the namespace generation. A local entry stored under an older
+generation is treated as a miss.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from shared_state import StateBackend
+
+
+class TTLCache:
+    """Async LRU cache whose entries expire after ttl_s seconds"""
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 256,
+        ttl_s: float = 60.0,
+        backend: Optional[StateBackend] = None,
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._backend = backend
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        # Bumped on invalidation so loads started earlier are not stored
+        self._generation = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _get_fresh(self, key: Hashable, shared_generation: Optional[int]) -> Optional[tuple]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic() or entry[2] != shared_generation:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key: Hashable, value: Any, shared_generation: Optional[int]) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_s, value, shared_generation)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value for key, loading it once on a miss"""
+        shared_generation = await self._backend.generation(self.name) if self._backend else None
+        entry = self._get_fresh(key, shared_generation)
+        if entry is not None:
+            self.hits += 1
+            return entry[1]
+
+        if self._backend is not None:
+            value = await self._backend.get(self.name, key)
+            if value is not None:
+                self.shared_hits += 1
+                self._store(key, value, shared_generation)
+                return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        generation = self._generation
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unobserved failure is not logged as a warning
+            future.exception()
+            raise
+        else:
+            # Not stored if an invalidation (here or in another process) happened meanwhile
+            stored = generation == self._generation and (
+                self._backend is None
+                or await self._backend.set(self.name, key, value, self.ttl_s, shared_generation)
+            )
+            # ... including one during the shared write
+            if stored and generation == self._generation:
+                self._store(key, value, shared_generation)
+            future.set_result(value)
+            return value
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    async def invalidate(self, predicate: Optional[Callable[[Hashable], bool]] = None) -> int:
+        """Drop matching entries (all when predicate is None); returns the count"""
+        self._generation += 1
+        self.invalidations += 1
+        # In-flight loads may predate the write; stop new callers joining them
+        self._inflight.clear()
+
+        if predicate is None:
+            dropped = len(self._entries)
+            self._entries.clear()
+        else:
+            stale = [key for key in self._entries if predicate(key)]
+            for key in stale:
+                del self._entries[key]
+            dropped = len(stale)
+
+        if self._backend is not None:
+            # Bump first so loads that started earlier elsewhere can no longer store;
+            # other processes drop their local copies on their next lookup
+            await self._backend.bump_generation(self.name)
+            await self._backend.delete_where(self.name, predicate)
+        return dropped
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for observability"""
+        lookups = self.hits + self.shared_hits + self.misses + self.coalesced
+        return {
+            "name": self.name,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl_s,
+            "backend": self._backend.name if self._backend else None,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": round((self.hits + self.shared_hits + self.coalesced) / lookups, 4) if lookups else None,
+        }
@@ -0,0 +1,141 @@
+"""
+Long-lived provider clients shared by every probe and the FX fetcher.
+
+One pooled httpx.AsyncClient backs an SDK client per registry provider
+(OpenAI-compatible or Anthropic adapters) and the plain HTTP calls (Gemini
+REST API, exchange rates), so TLS handshakes happen once per host instead
+of inside each measured request. Created at startup, optionally warmed up,
+and closed on shutdown.
+"""
+
+import asyncio
+import os
+from typing import Any, Dict, Optional
+
+import httpx
+from openai import AsyncOpenAI
+from anthropic import AsyncAnthropic
+
+from providers import get_registry
+
+# HTTP/2 needs the optional h2 package (pip install "httpx[http2]")
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+HTTP2_ENABLED = os.environ.get("PULSE_HTTP2", "false").lower() in ("1", "true", "yes")
+WARMUP_ENABLED = os.environ.get("PULSE_WARMUP", "true").lower() in ("1", "true", "yes")
+
+MAX_CONNECTIONS = int(os.environ.get("PULSE_HTTP_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("PULSE_HTTP_MAX_KEEPALIVE", "20"))
+KEEPALIVE_EXPIRY_S = float(os.environ.get("PULSE_HTTP_KEEPALIVE_EXPIRY_S", "300"))
+HTTP_TIMEOUT_S = float(os.environ.get("PULSE_HTTP_TIMEOUT_S", "60"))
+# SDK-level retries (429/5xx); load tests set 0 to observe raw rate limiting
+SDK_MAX_RETRIES = int(os.environ.get("PULSE_SDK_MAX_RETRIES", "2"))
+
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
+EXCHANGERATE_BASE_URL = "https://v6.exchangerate-api.com"
+
+
+class ProviderClients:
+    """Registry of shared provider clients for one process"""
+
+    def __init__(self):
+        use_http2 = HTTP2_ENABLED and HTTP2_AVAILABLE
+        if HTTP2_ENABLED and not HTTP2_AVAILABLE:
+            print("Warning: PULSE_HTTP2 set but h2 is not installed, using HTTP/1.1")
+
+        self.http = httpx.AsyncClient(
+            http2=use_http2,
+            timeout=HTTP_TIMEOUT_S,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY_S,
+            ),
+        )
+        # SDK client per provider key ('gemini' providers use self.http directly)
+        self.sdk: Dict[str, Any] = {}
+        registry = get_registry()
+        for key, provider in registry.providers.items():
+            if provider["adapter"] == "openai":
+                self.sdk[key] = AsyncOpenAI(
+                    api_key=registry.api_key(key),
+                    base_url=provider["base_url"],
+                    max_retries=SDK_MAX_RETRIES,
+                    http_client=self.http,
+                )
+            elif provider["adapter"] == "anthropic":
+                self.sdk[key] = AsyncAnthropic(
+                    api_key=registry.api_key(key),
+                    base_url=provider["base_url"],
+                    max_retries=SDK_MAX_RETRIES,
+                    http_client=self.http,
+                )
+
+    def gemini_base_url(self, provider_key: str) -> str:
+        return get_registry().providers[provider_key]["base_url"] or GEMINI_BASE_URL
+
+    def gemini_headers(self, provider_key: str) -> Dict[str, str]:
+        return {"x-goog-api-key": get_registry().api_key(provider_key) or ""}
+
+    async def warm_up(self) -> None:
+        """
+        Open a connection to every provider with a free metadata call so the
+        first measured probe does not pay DNS, TCP and TLS setup.
+        """
+        checks = {}
+        for key, provider in get_registry().providers.items():
+            if provider["adapter"] == "openai":
+                checks[provider["name"]] = self.sdk[key].models.list()
+            elif provider["adapter"] == "anthropic":
+                checks[provider["name"]] = self.sdk[key].models.list(limit=1)
+            else:
+                checks[provider["name"]] = self.http.get(
+                    f"{self.gemini_base_url(key)}/models",
+                    params={"pageSize": 1},
+                    headers=self.gemini_headers(key),
+                )
+        checks["ExchangeRate-API"] = self.http.head(EXCHANGERATE_BASE_URL)
+        outcomes = await asyncio.gather(*checks.values(), return_exceptions=True)
+
+        for provider, outcome in zip(checks, outcomes):
+            if isinstance(outcome, Exception):
+                print(f"Warm-up for {provider} failed: {outcome}")
+        print(f"Provider clients warmed up ({len(checks)} hosts)")
+
+    async def close(self) -> None:
+        """Close pooled connections (the SDK clients share self.http)"""
+        await self.http.aclose()
+
+
+_clients: Optional[ProviderClients] = None
+
+
+async def init_clients(warm_up: bool = WARMUP_ENABLED) -> ProviderClients:
+    """Create the process-wide client registry (idempotent)"""
+    global _clients
+
+    if _clients is None:
+        _clients = ProviderClients()
+        if warm_up:
+            await _clients.warm_up()
+    return _clients
+
+
+def get_clients() -> ProviderClients:
+    """Return the registry created by init_clients()"""
+    if _clients is None:
+        raise RuntimeError("Provider clients not initialised; call init_clients() first")
+    return _clients
+
+
+async def close_clients() -> None:
+    """Close the registry's connections (on shutdown)"""
+    global _clients
+
+    if _clients is not None:
+        await _clients.close()
+        _clients = None
@@ -0,0 +1,90 @@
+"""
+Shared asyncpg connection pool used by the API server and the schedulers.
+
+The pool is created once per process (FastAPI lifespan, or the top of a CLI
+run) and every query borrows a connection from it instead of opening a new
+Postgres connection.
+"""
+
+import json
+import os
+from typing import Optional
+
+import asyncpg
+
+# Pool sizing and connection hygiene (override via environment)
+POOL_MIN_SIZE = int(os.environ.get("PG_POOL_MIN_SIZE", "2"))
+POOL_MAX_SIZE = int(os.environ.get("PG_POOL_MAX_SIZE", "10"))
+STATEMENT_CACHE_SIZE = int(os.environ.get("PG_STATEMENT_CACHE_SIZE", "256"))
+# Idle connections older than this are closed and re-established on demand,
+# so connections dropped by the server or a proxy are not handed out
+MAX_INACTIVE_LIFETIME_S = float(os.environ.get("PG_POOL_MAX_INACTIVE_S", "300"))
+COMMAND_TIMEOUT_S = float(os.environ.get("PG_COMMAND_TIMEOUT_S", "30"))
+
+# NOTIFY channel announcing newly inserted results ({"model", "max_id"} JSON)
+RESULTS_CHANNEL = "results_inserted"
+
+_pool: Optional[asyncpg.Pool] = None
+
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    """Decode json/jsonb columns to Python objects like psycopg2 did"""
+    for type_name in ("json", "jsonb"):
+        await conn.set_type_codec(
+            type_name,
+            encoder=json.dumps,
+            decoder=json.loads,
+            schema="pg_catalog",
+        )
+
+
+async def init_pool() -> asyncpg.Pool:
+    """Create the process-wide pool (idempotent) and verify it with a ping"""
+    global _pool
+
+    if _pool is not None:
+        return _pool
+
+    _pool = await asyncpg.create_pool(
+        host=os.environ.get("PGHOST"),
+        database=os.environ.get("PGDATABASE"),
+        user=os.environ.get("PGUSER"),
+        password=os.environ.get("PGPASSWORD"),
+        port=os.environ.get("PGPORT"),
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+        statement_cache_size=STATEMENT_CACHE_SIZE,
+        max_inactive_connection_lifetime=MAX_INACTIVE_LIFETIME_S,
+        command_timeout=COMMAND_TIMEOUT_S,
+        init=_init_connection,
+    )
+
+    # Health check: fail fast at startup if the database is unreachable
+    await _pool.fetchval("SELECT 1")
+    print(f"Database pool ready (min={POOL_MIN_SIZE}, max={POOL_MAX_SIZE})")
+    return _pool
+
+
+def get_pool() -> asyncpg.Pool:
+    """Return the pool created by init_pool()"""
+    if _pool is None:
+        raise RuntimeError("Database pool not initialised; call init_pool() first")
+    return _pool
+
+
+async def check_pool() -> bool:
+    """Health check: borrow a connection and run a trivial query"""
+    try:
+        return await get_pool().fetchval("SELECT 1") == 1
+    except Exception as e:
+        print(f"Database health check failed: {e}")
+        return False
+
+
+async def close_pool() -> None:
+    """Close all pooled connections (on shutdown)"""
+    global _pool
+
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
@@ -0,0 +1,74 @@
+"""
+Shape-preserving downsampling for chart series.
+
+Largest-Triangle-Three-Buckets (LTTB) keeps the first and last points and,
+for each bucket in between, the point forming the largest triangle with
+its neighbours, so spikes and dips survive while the point count is
+bounded.
+"""
+
+from typing import Any, Dict, List
+
+
+def lttb(points: List[Dict[str, Any]], max_points: int, x_key: str = "ts_ms", y_key: str = "latency_s") -> List[Dict[str, Any]]:
+    """Downsample points (sorted by x ascending) to at most max_points"""
+    n = len(points)
+    if max_points >= n or n <= 2:
+        return list(points)
+    if max_points < 3:
+        return [points[0], points[-1]][:max(max_points, 1)]
+
+    def x(i: int) -> float:
+        return float(points[i][x_key] or 0)
+
+    def y(i: int) -> float:
+        return float(points[i][y_key] or 0)
+
+    sampled = [points[0]]
+    bucket_size = (n - 2) / (max_points - 2)
+    a = 0  # index of the previously selected point
+
+    for i in range(max_points - 2):
+        # Current bucket
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+
+        # Average of the next bucket (the last point for the final bucket)
+        next_start = end
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        if next_start >= next_end:
+            avg_x, avg_y = x(n - 1), y(n - 1)
+        else:
+            span = next_end - next_start
+            avg_x = sum(x(j) for j in range(next_start, next_end)) / span
+            avg_y = sum(y(j) for j in range(next_start, next_end)) / span
+
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((x(a) - avg_x) * (y(j) - y(a)) - (x(a) - x(j)) * (avg_y - y(a)))
+            if area > best_area:
+                best, best_area = j, area
+
+        sampled.append(points[best])
+        a = best
+
+    sampled.append(points[-1])
+    return sampled
+
+
+def downsample_history(history: List[Dict[str, Any]], max_points: int, y_key: str = "latency_s") -> List[Dict[str, Any]]:
+    """
+    Apply LTTB to each (model, prompt) series independently.
+    Input and output are ordered newest first, like /api/history.
+    """
+    series: Dict[tuple, List[Dict[str, Any]]] = {}
+    for row in history:
+        series.setdefault((row["model"], row.get("prompt_id")), []).append(row)
+
+    result = []
+    for rows in series.values():
+        rows.sort(key=lambda r: r["ts_ms"] or 0)
+        result.extend(lttb(rows, max_points, y_key=y_key))
+
+    result.sort(key=lambda r: r["ts_ms"] or 0, reverse=True)
+    return result
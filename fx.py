@@ -0,0 +1,194 @@
+"""
+Shared, persistent FX rates for converting USD costs.
+
+Rates against USD for every currency ExchangeRate-API publishes are kept
+in the fx_rates table, so all API workers and scheduler processes share
+one copy and a cold start reads the table instead of the network. Each
+process also keeps the rates in memory.
+
+- Fresh (younger than FX_CACHE_TTL_HOURS): served from memory.
+- Stale (up to FX_MAX_STALE_HOURS more): served while a background refresh
+  runs (stale-while-revalidate).
+- Older, or missing: the caller waits for the refresh.
+
+Refreshes are single-flight: one task per process, and across processes a
+Postgres advisory lock plus a re-check of the table, so only one process
+calls the API per expiry. Without a key or a reachable API, the last known
+rates are used, then FALLBACK_RATES.
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from clients import get_clients, EXCHANGERATE_BASE_URL
+from db import get_pool
+
+FX_BASE = "USD"
+FX_CACHE_TTL = timedelta(hours=float(os.environ.get("FX_CACHE_TTL_HOURS", "24")))
+FX_MAX_STALE = timedelta(hours=float(os.environ.get("FX_MAX_STALE_HOURS", "168")))
+# Cost columns added to every run-test result (cost_gbp is always included)
+FX_CURRENCIES = [
+    c.strip().upper() for c in os.environ.get("FX_CURRENCIES", "GBP").split(",") if c.strip()
+]
+# Used only when no rates have ever been fetched
+FALLBACK_RATES = {"USD": 1.0, "GBP": 0.79}
+# After a failed refresh, serve what we have for this long before trying again
+FX_RETRY_S = float(os.environ.get("FX_RETRY_S", "300"))
+
+_rates: Dict[str, float] = {}
+_fetched_at: Optional[datetime] = None
+_loaded = False
+_refresh_task: Optional[asyncio.Task] = None
+_retry_at = 0.0
+
+
+def _age() -> Optional[timedelta]:
+    return datetime.now(timezone.utc) - _fetched_at if _fetched_at else None
+
+
+def _set_rates(rates: Dict[str, float], fetched_at: datetime) -> None:
+    global _rates, _fetched_at
+
+    _rates = {**rates, FX_BASE: 1.0}
+    _fetched_at = fetched_at
+
+
+async def _read_table(conn=None) -> bool:
+    """Load the shared table into memory; returns whether it had any rows"""
+    rows = await (conn or get_pool()).fetch("""
+        SELECT currency, rate, fetched_at FROM fx_rates WHERE base = $1
+    """, FX_BASE)
+    if not rows:
+        return False
+    _set_rates(
+        {row["currency"]: float(row["rate"]) for row in rows},
+        min(row["fetched_at"] for row in rows),
+    )
+    return True
+
+
+async def load_rates() -> None:
+    """Populate memory from the shared table (once per process; no network)"""
+    global _loaded
+
+    if _loaded:
+        return
+    _loaded = True
+    try:
+        await _read_table()
+    except Exception as e:
+        print(f"Could not load FX rates from the database: {e}")
+
+
+async def _fetch_latest() -> Optional[Dict[str, float]]:
+    api_key = os.environ.get("EXCHANGERATE_API_KEY")
+    if not api_key:
+        print("Warning: EXCHANGERATE_API_KEY not set, using cached or fallback FX rates")
+        return None
+
+    url = f"{EXCHANGERATE_BASE_URL}/v6/{api_key}/latest/{FX_BASE}"
+    response = await get_clients().http.get(url, timeout=10.0)
+    data = response.json()
+    if data.get("result") != "success":
+        print(f"ExchangeRate-API error: {data.get('error-type', 'unknown')}")
+        return None
+    return {currency: float(rate) for currency, rate in data["conversion_rates"].items()}
+
+
+async def _refresh() -> None:
+    """Fetch new rates unless another process has just done so"""
+    global _retry_at
+
+    # Pushed back on every attempt; a success makes the rates fresh, so it no longer matters
+    _retry_at = time.monotonic() + FX_RETRY_S
+    try:
+        async with get_pool().acquire() as conn:
+            async with conn.transaction():
+                # Other processes wait here instead of calling the API too
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext('fx_rates'))")
+                if await _read_table(conn) and _age() < FX_CACHE_TTL:
+                    return
+
+                rates = await _fetch_latest()
+                if not rates:
+                    return
+                fetched_at = datetime.now(timezone.utc)
+                await conn.execute("""
+                    INSERT INTO fx_rates (base, currency, rate, fetched_at)
+                    SELECT $1, currency, rate, $4
+                    FROM unnest($2::varchar[], $3::numeric[]) AS r(currency, rate)
+                    ON CONFLICT (base, currency) DO UPDATE SET
+                        rate = EXCLUDED.rate,
+                        fetched_at = EXCLUDED.fetched_at
+                """, FX_BASE, list(rates), list(rates.values()), fetched_at)
+
+        _set_rates(rates, fetched_at)
+        print(f"Fetched fresh FX rates for {len(rates)} currencies (USD/GBP {rates.get('GBP')})")
+    except Exception as e:
+        print(f"Error refreshing FX rates: {e}")
+
+
+def _start_refresh() -> asyncio.Task:
+    """The in-flight refresh task, started if there is none"""
+    global _refresh_task
+
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.get_running_loop().create_task(_refresh())
+    return _refresh_task
+
+
+async def get_rates() -> Dict[str, float]:
+    """USD -> currency rates, refreshed per the policy in the module docstring"""
+    await load_rates()
+
+    age = _age()
+    if age is not None and age < FX_CACHE_TTL:
+        return _rates
+    if time.monotonic() < _retry_at:
+        return _rates or FALLBACK_RATES
+    if age is not None and age < FX_CACHE_TTL + FX_MAX_STALE:
+        _start_refresh()
+        return _rates
+
+    await asyncio.shield(_start_refresh())
+    return _rates or FALLBACK_RATES
+
+
+def rates_status() -> Dict[str, Any]:
+    """Cached rates and their age, for observability"""
+    age = _age()
+    return {
+        "base": FX_BASE,
+        "fetched_at": _fetched_at.isoformat() if _fetched_at else None,
+        "age_s": round(age.total_seconds()) if age is not None else None,
+        "stale": age is None or age >= FX_CACHE_TTL,
+        "refreshing": _refresh_task is not None and not _refresh_task.done(),
+        "rates": _rates or FALLBACK_RATES,
+    }
+
+
+def convert(amounts_usd: Iterable[Optional[float]], currency: str, rates: Dict[str, float]) -> List[Optional[float]]:
+    """Convert a batch of USD amounts with one rate lookup (None stays None)"""
+    rate = rates.get(currency.upper())
+    return [
+        round(amount * rate, 6) if amount is not None and rate is not None else None
+        for amount in amounts_usd
+    ]
+
+
+async def add_costs(results: List[Dict[str, Any]], currencies: Iterable[str] = ()) -> List[Dict[str, Any]]:
+    """
+    Set cost_<currency> on every result from its cost_usd, for GBP,
+    FX_CURRENCIES and any extra currencies, with one rate lookup per batch
+    """
+    rates = await get_rates()
+    costs = [r.get("cost_usd") for r in results]
+    for currency in dict.fromkeys(["GBP", *FX_CURRENCIES, *(c.upper() for c in currencies)]):
+        if currency == FX_BASE:
+            continue
+        for result, converted in zip(results, convert(costs, currency, rates)):
+            result[f"cost_{currency.lower()}"] = converted
+    return results
@@ -0,0 +1,414 @@
+"""
+Background job queue for on-demand test runs.
+
+Submitting a run returns a job id instead of fanning out paid API calls
+straight away. A bounded pool of RUN_JOB_WORKERS workers takes jobs from a
+queue holding at most RUN_JOB_QUEUE_MAX, so simultaneous clicks cannot
+multiply spend or skew provider latency with self-inflicted concurrency.
+Submissions are single-flight: one identical to a queued or running job
+(same model set, prompt matrix and streaming mode) joins that job instead
+of starting another.
+
+Each job keeps its event log (queued, start, result..., done or failed),
+so pollers read the job's current state and streamers replay the log and
+then follow it live, whenever they attach. Finished jobs stay available
+for RUN_JOB_RETENTION_S.
+
+A job runs in the worker process that accepted it. Its status and its
+single-flight claim are mirrored to the shared-state backend (see
+shared_state.py), and each result is stored there once as it arrives, so
+mirroring costs the same per event however many results the job has.
+Other API workers can therefore join, poll, stream and wait on it; they
+follow a remote job by polling its status every RUN_JOB_POLL_S and reading
+only the results they have not seen. The owning worker refreshes the
+status of its unfinished jobs every RUN_JOB_HEARTBEAT_S; a job whose
+status has not been refreshed for RUN_JOB_STALE_S (its worker died) is
+reported as failed, and an identical submission takes over its claim. A
+job's status is published before its claim, so a claim whose job has no
+status is only taken over once the claim itself is RUN_JOB_STALE_S old.
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from shared_state import StateBackend, get_state_backend
+
+JOB_WORKERS = max(1, int(os.environ.get("RUN_JOB_WORKERS", "2")))
+JOB_QUEUE_MAX = max(1, int(os.environ.get("RUN_JOB_QUEUE_MAX", "16")))
+JOB_RETENTION_S = float(os.environ.get("RUN_JOB_RETENTION_S", "900"))
+JOB_POLL_S = float(os.environ.get("RUN_JOB_POLL_S", "0.5"))
+JOB_HEARTBEAT_S = float(os.environ.get("RUN_JOB_HEARTBEAT_S", "5"))
+JOB_STALE_S = float(os.environ.get("RUN_JOB_STALE_S", "30"))
+
+# Shared-state namespaces: job_id -> status (without results), (job_id, index) -> result,
+# and single-flight key -> claim ({"job_id", "claimed_at"})
+_SNAPSHOTS = "job_snapshots"
+_RESULTS = "job_results"
+_CLAIMS = "job_claims"
+
+TERMINAL_STATUSES = ("completed", "failed")
+TERMINAL_EVENTS = ("done", "failed")
+
+
+class QueueFull(Exception):
+    """Raised by submit() when no more jobs can be queued"""
+
+
+class Job:
+    """One queued test run: its parameters, status and event log"""
+
+    def __init__(
+        self,
+        key: Hashable,
+        params: Dict[str, Any],
+        runner: Callable[["Job"], Awaitable[Dict[str, Any]]],
+    ):
+        self.job_id = uuid.uuid4().hex
+        self.key = key
+        self.params = params
+        self.runner = runner
+        self.status = "queued"
+        self.submitters = 1
+        self.submitted_at = datetime.now()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.error: Optional[str] = None
+        self.summary: Optional[Dict[str, Any]] = None
+        self.results: List[Dict[str, Any]] = []
+        # The single-flight claim this job holds in shared state
+        self.claim: Optional[Dict[str, Any]] = None
+        self.events: List[Tuple[str, Dict[str, Any]]] = []
+        self._finished_mono: Optional[float] = None
+        self._changed = asyncio.Condition()
+        # Awaited with each event (the queue mirrors it to shared state)
+        self.on_change: Optional[Callable[["Job", str, Dict[str, Any]], Awaitable[None]]] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    async def publish(self, event: str, data: Dict[str, Any]) -> None:
+        """Append an event to the log and wake every follower"""
+        if event == "result":
+            self.results.append(data)
+        self.events.append((event, data))
+        async with self._changed:
+            self._changed.notify_all()
+        if self.on_change is not None:
+            await self.on_change(self, event, data)
+
+    async def follow(self) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Every event so far, then new ones as they happen, up to the done/failed event"""
+        seen = 0
+        while True:
+            while seen < len(self.events):
+                event = self.events[seen]
+                seen += 1
+                yield event
+                # Not self.done: the status turns terminal before the final event is published
+                if event[0] in TERMINAL_EVENTS:
+                    return
+            async with self._changed:
+                await self._changed.wait_for(lambda: seen < len(self.events))
+
+    async def wait(self) -> None:
+        """Block until the job has completed or failed"""
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.done)
+
+    def to_dict(self, include_results: bool = False) -> Dict[str, Any]:
+        status = {
+            "job_id": self.job_id,
+            "status": self.status,
+            "submitters": self.submitters,
+            **self.params,
+            "submitted_at": self.submitted_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "completed_probes": len(self.results),
+            "summary": self.summary,
+            "error": self.error,
+        }
+        if include_results:
+            status["results"] = self.results
+        return status
+
+
+def _abandoned(snapshot: Dict[str, Any]) -> bool:
+    """Whether a remote job's worker stopped refreshing it before it finished"""
+    return (
+        snapshot["status"] not in TERMINAL_STATUSES
+        and time.time() - snapshot.get("heartbeat_at", 0) > JOB_STALE_S
+    )
+
+
+class JobQueue:
+    """Bounded worker pool per process running jobs in submission order, deduplicated by key"""
+
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        max_queued: int = JOB_QUEUE_MAX,
+        backend: Optional[StateBackend] = None,
+    ):
+        self.workers = workers
+        self.max_queued = max_queued
+        self._backend = backend or get_state_backend()
+        self._jobs: Dict[str, Job] = {}
+        # Queued or running job per key (single-flight)
+        self._inflight: Dict[Hashable, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        # Serialises submissions: claiming a key awaits the backend
+        self._submit_lock = asyncio.Lock()
+
+    def _start(self) -> None:
+        """Create the queue and workers on the running loop (on first submit)"""
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(self.max_queued)
+        loop = asyncio.get_running_loop()
+        self._worker_tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        self._heartbeat_task = loop.create_task(self._heartbeat())
+
+    async def stop(self) -> None:
+        """Cancel the workers (running jobs end as failed)"""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+            self._heartbeat_task = None
+        self._queue = None
+
+    async def submit(
+        self,
+        key: Hashable,
+        params: Dict[str, Any],
+        runner: Callable[[Job], Awaitable[Dict[str, Any]]],
+    ) -> Tuple[str, bool]:
+        """
+        Queue runner(job) for execution, or join the identical job already
+        queued or running in any worker. Returns (job_id, joined). Raises QueueFull.
+        """
+        async with self._submit_lock:
+            return await self._submit(key, params, runner)
+
+    async def _submit(self, key, params, runner) -> Tuple[str, bool]:
+        self._start()
+        self._prune()
+
+        job = self._inflight.get(key)
+        if job is not None:
+            job.submitters += 1
+            await self._mirror(job)
+            return job.job_id, True
+
+        job = Job(key, params, runner)
+        # Nobody can be following a job that was just created, so no wake-up needed
+        job.events.append(("queued", job.to_dict()))
+        # Status first: other workers must never find our claim without it
+        await self._mirror(job)
+        job.claim = {"job_id": job.job_id, "claimed_at": time.time()}
+        while True:
+            owner = await self._backend.add(_CLAIMS, key, job.claim, JOB_RETENTION_S)
+            if owner["job_id"] == job.job_id:
+                break
+            if await self._claim_live(owner):
+                await self._backend.delete(_SNAPSHOTS, job.job_id)
+                return owner["job_id"], True
+            # Left behind by a job whose worker is gone: release it (unless another
+            # worker already has) and race for it again
+            await self._backend.delete(_CLAIMS, key, owner)
+
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            await self._backend.delete(_CLAIMS, key, job.claim)
+            await self._backend.delete(_SNAPSHOTS, job.job_id)
+            raise QueueFull(f"Run queue is full ({self.max_queued} jobs waiting)")
+
+        self._jobs[job.job_id] = job
+        self._inflight[key] = job
+        job.on_change = self._on_event
+        return job.job_id, False
+
+    async def _claim_live(self, claim: Dict[str, Any]) -> bool:
+        """Whether another worker's claim belongs to a job that can still finish"""
+        snapshot = await self._backend.get(_SNAPSHOTS, claim["job_id"])
+        if snapshot is None:
+            return time.time() - claim["claimed_at"] <= JOB_STALE_S
+        return snapshot["status"] not in TERMINAL_STATUSES and not _abandoned(snapshot)
+
+    async def _mirror(self, job: Job) -> None:
+        """Publish the job's status for other workers"""
+        status = {**job.to_dict(), "heartbeat_at": time.time()}
+        await self._backend.set(_SNAPSHOTS, job.job_id, status, JOB_RETENTION_S)
+
+    async def _heartbeat(self) -> None:
+        """Keep this worker's unfinished jobs from looking abandoned"""
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_S)
+            for job in list(self._inflight.values()):
+                try:
+                    await self._mirror(job)
+                except Exception as e:
+                    print(f"Job {job.job_id}: heartbeat failed: {e}")
+
+    async def _remote_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Status of a job run by another worker, marked failed if that worker is gone"""
+        snapshot = await self._backend.get(_SNAPSHOTS, job_id)
+        if snapshot is not None and _abandoned(snapshot):
+            snapshot.update(status="failed", error="The worker running this job stopped responding")
+        return snapshot
+
+    async def _on_event(self, job: Job, event: str, data: Dict[str, Any]) -> None:
+        # The result goes first, so completed_probes never counts one that is not stored yet
+        if event == "result":
+            await self._backend.set(_RESULTS, (job.job_id, len(job.results) - 1), data, JOB_RETENTION_S)
+        await self._mirror(job)
+
+    async def _remote_results(self, job_id: str, start: int, stop: int) -> List[Dict[str, Any]]:
+        """Results start..stop-1 of a job run by another worker"""
+        results = []
+        for index in range(start, stop):
+            result = await self._backend.get(_RESULTS, (job_id, index))
+            if result is None:
+                break
+            results.append(result)
+        return results
+
+    async def snapshot(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Status and results of a job run by any worker, or None if unknown"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict(include_results=True)
+        snapshot = await self._remote_status(job_id)
+        if snapshot is not None:
+            snapshot["results"] = await self._remote_results(job_id, 0, snapshot["completed_probes"])
+        return snapshot
+
+    async def follow(self, job_id: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """A job's events from the start, then live (see Job.follow)"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            async for event in job.follow():
+                yield event
+            return
+
+        # Run by another worker: rebuild the events from its status and results
+        seen = 0
+        announced = None
+        while True:
+            snapshot = await self._remote_status(job_id)
+            if snapshot is None:
+                yield "failed", {"job_id": job_id, "status": "failed", "error": "Job is no longer available"}
+                return
+
+            status = snapshot["status"]
+            if announced is None and status == "queued":
+                announced = "queued"
+                yield "queued", snapshot
+            if announced != "start" and status != "queued":
+                announced = "start"
+                yield "start", {**snapshot, "status": "running"}
+            for result in await self._remote_results(job_id, seen, snapshot["completed_probes"]):
+                yield "result", result
+                seen += 1
+
+            if status in TERMINAL_STATUSES:
+                yield "done" if status == "completed" else "failed", snapshot
+                return
+            await asyncio.sleep(JOB_POLL_S)
+
+    async def wait(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Block until the job has completed or failed; returns its final snapshot"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            await job.wait()
+            return job.to_dict(include_results=True)
+
+        while True:
+            snapshot = await self._remote_status(job_id)
+            if snapshot is None or snapshot["status"] in TERMINAL_STATUSES:
+                return await self.snapshot(job_id)
+            await asyncio.sleep(JOB_POLL_S)
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for observability"""
+        statuses = [job.status for job in self._jobs.values()]
+        return {
+            "backend": self._backend.name,
+            "workers": self.workers,
+            "max_queued": self.max_queued,
+            "queued": statuses.count("queued"),
+            "running": statuses.count("running"),
+            "completed": statuses.count("completed"),
+            "failed": statuses.count("failed"),
+        }
+
+    def _prune(self) -> None:
+        """Forget finished jobs older than JOB_RETENTION_S"""
+        cutoff = time.monotonic() - JOB_RETENTION_S
+        for job_id, job in list(self._jobs.items()):
+            if job._finished_mono is not None and job._finished_mono < cutoff:
+                del self._jobs[job_id]
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job) -> None:
+        job.status = "running"
+        job.started_at = datetime.now()
+        await job.publish("start", job.to_dict())
+        print(f"[{job.started_at}] Job {job.job_id}: running for {job.submitters} submitter(s)")
+
+        try:
+            job.summary = await job.runner(job)
+            job.status = "completed"
+        except asyncio.CancelledError:
+            job.error = "Cancelled at shutdown"
+            job.status = "failed"
+            raise
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+            print(f"Job {job.job_id} failed: {e}")
+        finally:
+            job.finished_at = datetime.now()
+            job._finished_mono = time.monotonic()
+            # Later identical submissions start a fresh run
+            owned = self._inflight.get(job.key) is job
+            if owned:
+                del self._inflight[job.key]
+            await job.publish("done" if job.status == "completed" else "failed", job.to_dict())
+            if owned:
+                try:
+                    # Only if it is still ours, not taken over by an identical submission
+                    await self._backend.delete(_CLAIMS, job.key, job.claim)
+                except Exception as e:
+                    print(f"Job {job.job_id}: could not release its claim: {e}")
+
+
+_job_queue: Optional[JobQueue] = None
+
+
+def get_job_queue() -> JobQueue:
+    """The process-wide job queue"""
+    global _job_queue
+
+    if _job_queue is None:
+        _job_queue = JobQueue()
+    return _job_queue
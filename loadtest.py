@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Concurrency-sweep load tests: how latency and aggregate throughput of each
+provider degrade as parallel requests increase.
+
+For every model the sweep ramps through concurrency levels (default
+LOADTEST_LEVELS). At each level, `concurrency` workers send
+concurrency * LOADTEST_REQUESTS_PER_WORKER probes back to back. One row per
+(model, level) is stored in load_test_results with requests/s, output
+tokens/s, latency percentiles, and error and HTTP 429 counts, which
+together form the saturation curve. The ramp for a model stops early once
+its error rate reaches LOADTEST_STOP_ERROR_RATE.
+
+Load-test probes are not written to results, so history and alerts are
+unaffected. The SDK clients retry 429s by default (PULSE_SDK_MAX_RETRIES),
+so set it to 0 to measure raw rate limiting.
+
+Run via: python loadtest.py [--models M ...] [--levels 1,2,4,8] [--requests-per-worker N] [--stream]
+     or: POST /api/loadtest (X-Loadtest-Token: $LOADTEST_TOKEN), then poll
+         GET /api/loadtest/{sweep_id}
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from db import get_pool
+from stats import percentile
+
+DEFAULT_LEVELS = [
+    int(level) for level in os.environ.get("LOADTEST_LEVELS", "1,2,4,8,16").split(",") if level.strip()
+]
+REQUESTS_PER_WORKER = int(os.environ.get("LOADTEST_REQUESTS_PER_WORKER", "4"))
+MAX_CONCURRENCY = int(os.environ.get("LOADTEST_MAX_CONCURRENCY", "64"))
+# Caps on what POST /api/loadtest may ask for (every probe is a paid API call)
+MAX_REQUESTS_PER_WORKER = int(os.environ.get("LOADTEST_MAX_REQUESTS_PER_WORKER", "16"))
+MAX_TOTAL_REQUESTS = int(os.environ.get("LOADTEST_MAX_TOTAL_REQUESTS", "2000"))
+# POST /api/loadtest requires this in the X-Loadtest-Token header; disabled when unset
+LOADTEST_TOKEN = os.environ.get("LOADTEST_TOKEN")
+# Finished sweeps' in-process status is kept this long (their curves stay in the table)
+SWEEP_RETENTION_S = float(os.environ.get("LOADTEST_SWEEP_RETENTION_S", "3600"))
+# Stop ramping a model once this fraction of a level's requests fail
+STOP_ERROR_RATE = float(os.environ.get("LOADTEST_STOP_ERROR_RATE", "0.5"))
+
+Probe = Callable[[], Awaitable[Dict[str, Any]]]
+
+# In-process sweep status for the API, keyed by sweep_id
+_sweeps: Dict[str, Dict[str, Any]] = {}
+# Background sweep tasks (held so they are not garbage collected mid-run)
+_tasks: Dict[str, asyncio.Task] = {}
+# sweep_id -> time.monotonic() when it finished, for pruning
+_finished: Dict[str, float] = {}
+
+
+def _round(value: Optional[float], digits: int = 3) -> Optional[float]:
+    return round(value, digits) if value is not None else None
+
+
+def parse_levels(levels: Optional[List[int]]) -> List[int]:
+    """Sorted, de-duplicated concurrency levels within 1..LOADTEST_MAX_CONCURRENCY"""
+    levels = levels or DEFAULT_LEVELS
+    return sorted({min(max(int(level), 1), MAX_CONCURRENCY) for level in levels})
+
+
+def total_requests(models: int, levels: List[int], requests_per_worker: int) -> int:
+    """Probes a sweep sends if no model stops early"""
+    return models * sum(levels) * requests_per_worker
+
+
+async def run_level(probe: Probe, concurrency: int, total: int) -> Dict[str, Any]:
+    """Send `total` probes with `concurrency` in flight and summarise the level"""
+    remaining = total
+    results: List[Dict[str, Any]] = []
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            results.append(await probe())
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - start
+
+    ok = [r for r in results if not r.get("error")]
+    latencies = [r["latency_s"] for r in ok if r.get("latency_s") is not None]
+    ttfts = [r["ttft_s"] for r in ok if r.get("ttft_s") is not None]
+    out_tokens = sum(r.get("out_tokens") or 0 for r in ok)
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "successes": len(ok),
+        "errors": len(results) - len(ok),
+        "rate_limited": sum(1 for r in results if r.get("status_code") == 429),
+        "duration_s": round(duration, 3),
+        "rps": round(len(ok) / duration, 3) if duration > 0 else None,
+        "tokens_per_s": round(out_tokens / duration, 2) if duration > 0 else None,
+        "latency_p50_s": _round(percentile(latencies, 50)),
+        "latency_p95_s": _round(percentile(latencies, 95)),
+        "latency_p99_s": _round(percentile(latencies, 99)),
+        "ttft_p50_s": _round(percentile(ttfts, 50)),
+    }
+
+
+async def sweep_model(
+    sweep_id: str,
+    model: str,
+    provider: str,
+    probe: Probe,
+    levels: List[int],
+    requests_per_worker: int = REQUESTS_PER_WORKER,
+    streamed: bool = False,
+) -> List[Dict[str, Any]]:
+    """Ramp one model through the levels, storing each level as it completes"""
+    curve = []
+    for concurrency in levels:
+        level = await run_level(probe, concurrency, concurrency * requests_per_worker)
+        level.update({"sweep_id": sweep_id, "model": model, "provider": provider, "streamed": streamed})
+        await insert_level(level)
+        curve.append(level)
+
+        print(f"  {model} x{concurrency}: {level['rps']} req/s, {level['tokens_per_s']} tok/s, "
+              f"p50 {level['latency_p50_s']}s, p95 {level['latency_p95_s']}s, "
+              f"{level['errors']}/{level['requests']} errors ({level['rate_limited']} rate limited)")
+
+        if level["errors"] / level["requests"] >= STOP_ERROR_RATE:
+            print(f"  {model}: saturated at concurrency {concurrency}, stopping ramp")
+            break
+
+    return curve
+
+
+async def insert_level(level: Dict[str, Any]) -> None:
+    """Store one (model, concurrency) point of a saturation curve"""
+    await get_pool().execute("""
+        INSERT INTO load_test_results
+            (sweep_id, model, provider, streamed, concurrency, requests, successes,
+             errors, rate_limited, duration_s, rps, tokens_per_s,
+             latency_p50_s, latency_p95_s, latency_p99_s, ttft_p50_s)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16)
+    """,
+        level["sweep_id"], level["model"], level["provider"], level["streamed"],
+        level["concurrency"], level["requests"], level["successes"], level["errors"],
+        level["rate_limited"], level["duration_s"], level["rps"], level["tokens_per_s"],
+        level["latency_p50_s"], level["latency_p95_s"], level["latency_p99_s"], level["ttft_p50_s"],
+    )
+
+
+async def run_sweep(
+    sweep_id: str,
+    probes: Dict[str, tuple],
+    levels: List[int],
+    requests_per_worker: int = REQUESTS_PER_WORKER,
+    streamed: bool = False,
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Sweep every model in probes ({model: (provider, probe)}). Models are
+    swept one after another so their load does not overlap.
+    """
+    status = _sweeps.setdefault(sweep_id, {})
+    status.update({
+        "sweep_id": sweep_id,
+        "status": "running",
+        "models": list(probes),
+        "levels": levels,
+        "started_at": datetime.now().isoformat(),
+        "finished_at": None,
+        "error": None,
+    })
+    print(f"[{datetime.now()}] Load test {sweep_id}: {len(probes)} model(s), levels {levels}")
+
+    curves = {}
+    try:
+        for model, (provider, probe) in probes.items():
+            status["current_model"] = model
+            curves[model] = await sweep_model(
+                sweep_id, model, provider, probe, levels, requests_per_worker, streamed
+            )
+        status["status"] = "completed"
+    except Exception as e:
+        status.update({"status": "failed", "error": str(e)})
+        print(f"Load test {sweep_id} failed: {e}")
+    finally:
+        status["current_model"] = None
+        status["finished_at"] = datetime.now().isoformat()
+        _finished[sweep_id] = time.monotonic()
+
+    return curves
+
+
+def new_sweep_id() -> str:
+    return uuid.uuid4().hex
+
+
+def start_sweep(
+    probes: Dict[str, tuple],
+    levels: List[int],
+    requests_per_worker: int = REQUESTS_PER_WORKER,
+    streamed: bool = False,
+) -> str:
+    """Run a sweep as a background task on the running loop; returns its sweep_id"""
+    _prune()
+    sweep_id = new_sweep_id()
+    # Registered before the task starts so running_sweep() sees it immediately
+    _sweeps[sweep_id] = {"sweep_id": sweep_id, "status": "running"}
+    task = asyncio.get_running_loop().create_task(
+        run_sweep(sweep_id, probes, levels, requests_per_worker, streamed)
+    )
+    _tasks[sweep_id] = task
+    task.add_done_callback(lambda _: _tasks.pop(sweep_id, None))
+    return sweep_id
+
+
+def running_sweep() -> Optional[str]:
+    """Id of the sweep currently running in this process, if any"""
+    for sweep_id, status in _sweeps.items():
+        if status.get("status") == "running":
+            return sweep_id
+    return None
+
+
+def sweep_status(sweep_id: str) -> Optional[Dict[str, Any]]:
+    _prune()
+    return _sweeps.get(sweep_id)
+
+
+def _prune() -> None:
+    """Forget the status of sweeps that finished more than SWEEP_RETENTION_S ago"""
+    cutoff = time.monotonic() - SWEEP_RETENTION_S
+    for sweep_id, finished in list(_finished.items()):
+        if finished < cutoff:
+            del _finished[sweep_id]
+            _sweeps.pop(sweep_id, None)
+
+
+async def fetch_sweep(sweep_id: str) -> List[Dict[str, Any]]:
+    """Stored curve points of one sweep, per model in concurrency order"""
+    rows = await get_pool().fetch("""
+        SELECT ts, model, provider, streamed, concurrency, requests, successes, errors,
+               rate_limited, duration_s, rps, tokens_per_s,
+               latency_p50_s, latency_p95_s, latency_p99_s, ttft_p50_s
+        FROM load_test_results
+        WHERE sweep_id = $1
+        ORDER BY model, concurrency
+    """, sweep_id)
+
+    def _float(value) -> Optional[float]:
+        return float(value) if value is not None else None
+
+    return [
+        {
+            "ts_ms": int(row["ts"].timestamp() * 1000),
+            "model": row["model"],
+            "provider": row["provider"],
+            "streamed": row["streamed"],
+            "concurrency": row["concurrency"],
+            "requests": row["requests"],
+            "successes": row["successes"],
+            "errors": row["errors"],
+            "rate_limited": row["rate_limited"],
+            "error_rate": round(row["errors"] / row["requests"], 4) if row["requests"] else None,
+            "rate_limit_rate": round(row["rate_limited"] / row["requests"], 4) if row["requests"] else None,
+            "duration_s": _float(row["duration_s"]),
+            "rps": _float(row["rps"]),
+            "tokens_per_s": _float(row["tokens_per_s"]),
+            "latency_p50_s": _float(row["latency_p50_s"]),
+            "latency_p95_s": _float(row["latency_p95_s"]),
+            "latency_p99_s": _float(row["latency_p99_s"]),
+            "ttft_p50_s": _float(row["ttft_p50_s"]),
+        }
+        for row in rows
+    ]
+
+
+async def _main(args) -> bool:
+    from db import init_pool, close_pool
+    from clients import init_clients, close_clients
+    from main import load_test_probes
+
+    try:
+        await init_pool()
+        await init_clients()
+        probes = load_test_probes(args.models, args.stream)
+        if not probes:
+            print("No known models selected")
+            return False
+
+        sweep_id = new_sweep_id()
+        await run_sweep(sweep_id, probes, parse_levels(args.levels), args.requests_per_worker, args.stream)
+        return _sweeps[sweep_id]["status"] == "completed"
+    finally:
+        await close_clients()
+        await close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Concurrency-sweep load test')
+    parser.add_argument('--models', nargs='+', help='Models to sweep (default: all)')
+    parser.add_argument('--levels', type=lambda s: [int(v) for v in s.split(',')],
+                        help='Comma-separated concurrency levels (default: LOADTEST_LEVELS)')
+    parser.add_argument('--requests-per-worker', type=int, default=REQUESTS_PER_WORKER,
+                        help='Requests per concurrent worker at each level')
+    parser.add_argument('--stream', action='store_true', help='Use streaming probes (records TTFT)')
+    args = parser.parse_args()
+
+    success = asyncio.run(_main(args))
+    sys.exit(0 if success else 1)
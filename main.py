@@ -1,25 +1,61 @@
 import asyncio
+import base64
+import hmac
+import json
 import os
 import time
-from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict, Any, List
-import psycopg2
-from psycopg2.extras import RealDictCursor
 
 from fastapi import FastAPI, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 import uvicorn
 
 from openai import AsyncOpenAI
-from anthropic import AsyncAnthropic
-import google.generativeai as genai
-import httpx
 
-app = FastAPI()
+from db import init_pool, close_pool, get_pool, check_pool, RESULTS_CHANNEL
+from clients import init_clients, close_clients, get_clients
+from providers import get_registry
+from rollups import BUCKETS, update_rollups, pick_bucket, fetch_rollups
+from downsample import downsample_history
+from stats import percentile, percentile_summary
+from cache import TTLCache
+from shared_state import get_state_backend, reset_state_file, STATE_PATH
+from serialization import dumps, dumps_bytes, HAS_ORJSON
+from alert_evaluator import fetch_aggregates, evaluate as evaluate_alert
+from sampling import insert_run_summaries, fetch_run_summaries
+from prompts import TEMPERATURE, DEFAULT_PROMPT_ID, prompt_text, output_cap, parse_matrix
+from fx import load_rates, get_rates, rates_status, convert, add_costs
+from jobs import Job, QueueFull, get_job_queue
+import loadtest
 
-# Currency conversion cache (24 hour TTL)
-_fx_cache = {"rate": None, "timestamp": None}
-FX_CACHE_TTL_HOURS = 24
+
+class FastJSONResponse(JSONResponse):
+    """JSON responses encoded with orjson when it is installed"""
+    
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content) if HAS_ORJSON else super().render(content)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create shared resources on startup and release them on shutdown"""
+    await init_pool()
+    await init_clients()
+    # Last shared FX rates from the database, so the first request does not wait on the API
+    await load_rates()
+    listener = asyncio.create_task(_listen_for_results())
+    yield
+    listener.cancel()
+    await asyncio.gather(listener, return_exceptions=True)
+    await get_job_queue().stop()
+    await close_clients()
+    await close_pool()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -29,43 +65,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize API clients
-openai_client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-anthropic_client = AsyncAnthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
-genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
-
-# Pricing table: cost per 1M tokens (input, output)
-# Source: provider pricing pages as of Oct 2025
+# Pricing table (cost per 1M tokens) and display names, derived from the
+# model registry config (models.json, see providers.py)
 PRICING = {
-    "gpt-4o-mini": {"input": 0.15, "output": 0.60, "provider": "OpenAI"},
-    "claude-3-5-haiku-20241022": {"input": 0.80, "output": 4.00, "provider": "Anthropic"},
-    "gemini-2.0-flash-exp": {"input": 0.00, "output": 0.00, "provider": "Google"},  # Free during preview
-    "deepseek-chat": {"input": 0.14, "output": 0.28, "provider": "DeepSeek"},
+    model_id: {
+        "input": entry["input"],
+        "output": entry["output"],
+        "provider": get_registry().provider_for(model_id)["name"],
+    }
+    for model_id, entry in get_registry().models.items()
 }
-
-# Model display names
 MODEL_DISPLAY_NAMES = {
-    "gpt-4o-mini": "GPT-4o Mini",
-    "claude-3-5-haiku-20241022": "Claude 3.5 Haiku",
-    "gemini-2.0-flash-exp": "Gemini 2.0 Flash",
-    "deepseek-chat": "DeepSeek Chat",
+    model_id: entry["display_name"] for model_id, entry in get_registry().models.items()
 }
 
-# Standard test prompt (short to minimize costs)
-TEST_PROMPT = "Explain quantum computing in exactly 50 words."
-TEMPERATURE = 0.2
-MAX_TOKENS = 100
+# Time ranges accepted by the history and stats endpoints
+RANGE_WINDOWS = {
+    "24h": timedelta(hours=24),
+    "7d": timedelta(days=7),
+    "30d": timedelta(days=30),
+}
 
+# Rows per server-side cursor fetch / NDJSON chunk for history exports
+EXPORT_BATCH_SIZE = 500
 
-def get_db_connection():
-    """Get database connection using environment variables"""
-    return psycopg2.connect(
-        host=os.environ.get("PGHOST"),
-        database=os.environ.get("PGDATABASE"),
-        user=os.environ.get("PGUSER"),
-        password=os.environ.get("PGPASSWORD"),
-        port=os.environ.get("PGPORT"),
-    )
+# /api/history response cache, invalidated whenever results are inserted
+# (shared by all workers when the state backend is shared)
+history_cache = TTLCache(
+    "history",
+    max_entries=int(os.environ.get("HISTORY_CACHE_MAX_ENTRIES", "256")),
+    ttl_s=float(os.environ.get("HISTORY_CACHE_TTL_S", "60")),
+    backend=get_state_backend(),
+)
+# How often the results LISTEN connection is checked (and retried after a failure)
+RESULTS_LISTEN_CHECK_S = float(os.environ.get("RESULTS_LISTEN_CHECK_S", "5"))
+
+# Streaming probes record TTFT, decode throughput and inter-token latency.
+# Default for scheduled runs; /api/run-test can override per request.
+STREAM_PROBES = os.environ.get("PULSE_STREAM_PROBES", "false").lower() in ("1", "true", "yes")
+
+# Deadlines for interactive runs: per probe (from when it gets its limiter slot),
+# and for a whole streamed run (including time queued for the limiter)
+RUN_TEST_MODEL_TIMEOUT_S = float(os.environ.get("RUN_TEST_MODEL_TIMEOUT_S", "45"))
+RUN_TEST_TOTAL_TIMEOUT_S = float(os.environ.get("RUN_TEST_TOTAL_TIMEOUT_S", "90"))
 
 
 def calc_cost(model: str, in_tokens: int, out_tokens: int) -> float:
@@ -79,399 +121,1050 @@ def calc_cost(model: str, in_tokens: int, out_tokens: int) -> float:
     return input_cost + output_cost
 
 
-async def get_usd_to_gbp_rate() -> float:
+def _stream_metrics(start: float, token_times: List[float], end: float, out_tokens: int) -> Dict[str, Any]:
     """
-    Get USD to GBP exchange rate from ExchangeRate-API.
-    Caches result for 24 hours to stay within free tier limits.
+    Derive streaming metrics from content-chunk arrival times.
+    TTFT is time to the first content chunk; decode TPS only counts the tokens
+    generated after it, so queueing and prefill are excluded. Inter-token
+    latency is measured between consecutive chunks.
     """
-    global _fx_cache
+    if not token_times:
+        return {
+            "ttft_s": None,
+            "decode_tps": None,
+            "itl_p50_s": None,
+            "itl_p95_s": None,
+            "itl_p99_s": None,
+        }
     
-    # Check cache validity
-    if _fx_cache["rate"] and _fx_cache["timestamp"]:
-        age = datetime.now() - _fx_cache["timestamp"]
-        if age < timedelta(hours=FX_CACHE_TTL_HOURS):
-            return _fx_cache["rate"]
+    ttft = token_times[0] - start
+    decode_time = end - token_times[0]
+    decode_tps = (out_tokens - 1) / decode_time if decode_time > 0 and out_tokens > 1 else 0
+    gaps = [b - a for a, b in zip(token_times, token_times[1:])]
     
-    # Fetch fresh rate
-    api_key = os.environ.get("EXCHANGERATE_API_KEY")
-    if not api_key:
-        print("Warning: EXCHANGERATE_API_KEY not set, using fallback rate 0.79")
-        return 0.79  # Fallback rate
+    def _round(value: Optional[float]) -> Optional[float]:
+        return round(value, 4) if value is not None else None
     
-    try:
-        url = f"https://v6.exchangerate-api.com/v6/{api_key}/pair/USD/GBP"
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, timeout=10.0)
-            data = response.json()
-            
-            if data.get("result") == "success":
-                rate = data.get("conversion_rate")
-                # Update cache
-                _fx_cache["rate"] = rate
-                _fx_cache["timestamp"] = datetime.now()
-                print(f"Fetched fresh USD/GBP rate: {rate}")
-                return rate
-            else:
-                print(f"ExchangeRate-API error: {data.get('error-type', 'unknown')}")
-                return 0.79  # Fallback
-    except Exception as e:
-        print(f"Error fetching exchange rate: {e}")
-        return 0.79  # Fallback
+    return {
+        "ttft_s": round(ttft, 3),
+        "decode_tps": round(decode_tps, 2),
+        "itl_p50_s": _round(percentile(gaps, 50)),
+        "itl_p95_s": _round(percentile(gaps, 95)),
+        "itl_p99_s": _round(percentile(gaps, 99)),
+    }
 
 
-async def convert_currency(amount_usd: float, target_currency: str) -> float:
-    """Convert USD amount to target currency (GBP or USD)"""
-    if target_currency == "USD":
-        return amount_usd
-    elif target_currency == "GBP":
-        rate = await get_usd_to_gbp_rate()
-        return amount_usd * rate
-    else:
-        return amount_usd  # Default to USD
+def _success_result(
+    model: str,
+    latency: float,
+    in_tokens: int,
+    out_tokens: int,
+    stream_stats: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Build the result dict for a completed probe"""
+    tps = out_tokens / latency if latency > 0 and out_tokens else 0
+    cost = calc_cost(model, in_tokens, out_tokens)
+    
+    return {
+        "model": model,
+        "provider": PRICING[model]["provider"],
+        "display_name": MODEL_DISPLAY_NAMES[model],
+        "latency_s": round(latency, 3),
+        "tps": round(tps, 2),
+        "cost_usd": round(cost, 6),
+        "in_tokens": in_tokens,
+        "out_tokens": out_tokens,
+        "streamed": stream_stats is not None,
+        **(stream_stats or _stream_metrics(0, [], 0, 0)),
+        "error": None,
+    }
 
 
-async def test_openai(model: str = "gpt-4o-mini") -> Dict[str, Any]:
-    """Test OpenAI model (GPT-4o Mini)"""
-    try:
-        start = time.time()
-        
-        # the newest OpenAI model is "gpt-5" which was released August 7, 2025.
-        # However for cost testing we use gpt-4o-mini as specified
-        response = await openai_client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": TEST_PROMPT}],
+def _error_status(error: Exception) -> Optional[int]:
+    """HTTP status of a provider error (SDK APIStatusError or httpx), if any"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def _error_result(model: str, error: Exception, streamed: bool = False) -> Dict[str, Any]:
+    """Build the result dict for a failed probe"""
+    return {
+        "model": model,
+        "provider": PRICING[model]["provider"],
+        "display_name": MODEL_DISPLAY_NAMES[model],
+        "latency_s": None,
+        "tps": None,
+        "cost_usd": None,
+        "in_tokens": None,
+        "out_tokens": None,
+        "streamed": streamed,
+        **_stream_metrics(0, [], 0, 0),
+        "error": str(error),
+        "status_code": _error_status(error),
+    }
+
+
+def _with_prompt(result: Dict[str, Any], prompt_id: str, max_tokens: int) -> Dict[str, Any]:
+    """Record which corpus prompt and output cap a probe used"""
+    result["prompt_id"] = prompt_id
+    result["max_tokens"] = max_tokens
+    return result
+
+
+async def _probe_openai_compatible(
+    provider_key: str, model: str, api_model: str, stream: bool, prompt: str, max_tokens: int
+) -> Dict[str, Any]:
+    """Probe for OpenAI and any OpenAI-compatible chat completion API"""
+    client: AsyncOpenAI = get_clients().sdk[provider_key]
+    start = time.perf_counter()
+    
+    if not stream:
+        response = await client.chat.completions.create(
+            model=api_model,
+            messages=[{"role": "user", "content": prompt}],
             temperature=TEMPERATURE,
-            max_tokens=MAX_TOKENS,
+            max_tokens=max_tokens,
         )
-        
-        latency = time.time() - start
-        
-        in_tokens = response.usage.prompt_tokens
-        out_tokens = response.usage.completion_tokens
-        total_tokens = response.usage.total_tokens
-        
-        tps = out_tokens / latency if latency > 0 else 0
-        cost = calc_cost(model, in_tokens, out_tokens)
-        
-        return {
-            "model": model,
-            "provider": PRICING[model]["provider"],
-            "display_name": MODEL_DISPLAY_NAMES[model],
-            "latency_s": round(latency, 3),
-            "tps": round(tps, 2),
-            "cost_usd": round(cost, 6),
-            "in_tokens": in_tokens,
-            "out_tokens": out_tokens,
-            "error": None,
-        }
-    except Exception as e:
-        return {
-            "model": model,
-            "provider": PRICING[model]["provider"],
-            "display_name": MODEL_DISPLAY_NAMES[model],
-            "latency_s": None,
-            "tps": None,
-            "cost_usd": None,
-            "in_tokens": None,
-            "out_tokens": None,
-            "error": str(e),
-        }
+        latency = time.perf_counter() - start
+        return _success_result(
+            model, latency, response.usage.prompt_tokens, response.usage.completion_tokens
+        )
+    
+    token_times = []
+    usage = None
+    response = await client.chat.completions.create(
+        model=api_model,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=TEMPERATURE,
+        max_tokens=max_tokens,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    async for chunk in response:
+        if chunk.choices and chunk.choices[0].delta.content:
+            token_times.append(time.perf_counter())
+        if chunk.usage:
+            usage = chunk.usage
+    end = time.perf_counter()
+    
+    in_tokens = usage.prompt_tokens if usage else 0
+    out_tokens = usage.completion_tokens if usage else len(token_times)
+    return _success_result(
+        model, end - start, in_tokens, out_tokens,
+        _stream_metrics(start, token_times, end, out_tokens),
+    )
 
 
-async def test_anthropic(model: str = "claude-3-5-haiku-20241022") -> Dict[str, Any]:
-    """Test Anthropic model (Claude 3.5 Haiku)"""
-    try:
-        start = time.time()
-        
-        # The newest Anthropic model is "claude-sonnet-4-20250514"
-        # However for cost testing we use claude-3-5-haiku-20241022 as specified
-        response = await anthropic_client.messages.create(
-            model=model,
-            max_tokens=MAX_TOKENS,
+async def _probe_anthropic(
+    provider_key: str, model: str, api_model: str, stream: bool, prompt: str, max_tokens: int
+) -> Dict[str, Any]:
+    """Probe the Anthropic Messages API"""
+    client = get_clients().sdk[provider_key]
+    start = time.perf_counter()
+    
+    if not stream:
+        response = await client.messages.create(
+            model=api_model,
+            max_tokens=max_tokens,
             temperature=TEMPERATURE,
-            messages=[{"role": "user", "content": TEST_PROMPT}],
+            messages=[{"role": "user", "content": prompt}],
         )
-        
-        latency = time.time() - start
-        
-        in_tokens = response.usage.input_tokens
-        out_tokens = response.usage.output_tokens
-        
-        tps = out_tokens / latency if latency > 0 else 0
-        cost = calc_cost(model, in_tokens, out_tokens)
-        
-        return {
-            "model": model,
-            "provider": PRICING[model]["provider"],
-            "display_name": MODEL_DISPLAY_NAMES[model],
-            "latency_s": round(latency, 3),
-            "tps": round(tps, 2),
-            "cost_usd": round(cost, 6),
-            "in_tokens": in_tokens,
-            "out_tokens": out_tokens,
-            "error": None,
-        }
-    except Exception as e:
-        return {
-            "model": model,
-            "provider": PRICING[model]["provider"],
-            "display_name": MODEL_DISPLAY_NAMES[model],
-            "latency_s": None,
-            "tps": None,
-            "cost_usd": None,
-            "in_tokens": None,
-            "out_tokens": None,
-            "error": str(e),
-        }
+        latency = time.perf_counter() - start
+        return _success_result(
+            model, latency, response.usage.input_tokens, response.usage.output_tokens
+        )
+    
+    token_times = []
+    async with client.messages.stream(
+        model=api_model,
+        max_tokens=max_tokens,
+        temperature=TEMPERATURE,
+        messages=[{"role": "user", "content": prompt}],
+    ) as response:
+        async for text in response.text_stream:
+            if text:
+                token_times.append(time.perf_counter())
+        message = await response.get_final_message()
+    end = time.perf_counter()
+    
+    out_tokens = message.usage.output_tokens
+    return _success_result(
+        model, end - start, message.usage.input_tokens, out_tokens,
+        _stream_metrics(start, token_times, end, out_tokens),
+    )
 
 
-async def test_gemini(model: str = "gemini-2.0-flash-exp") -> Dict[str, Any]:
-    """Test Google Gemini model (Gemini 2.0 Flash)"""
-    try:
-        start = time.time()
-        
-        # Create model instance
-        gemini_model = genai.GenerativeModel(model)
-        
-        # Generate content with specified parameters
-        response = await asyncio.to_thread(
-            gemini_model.generate_content,
-            TEST_PROMPT,
-            generation_config=genai.types.GenerationConfig(
-                temperature=TEMPERATURE,
-                max_output_tokens=MAX_TOKENS,
-            )
+def _gemini_token_counts(usage_metadata: Optional[Dict[str, Any]]) -> tuple:
+    """Extract (input, output) token counts from Gemini REST usageMetadata"""
+    if not usage_metadata:
+        return 0, 0
+    
+    return usage_metadata.get("promptTokenCount", 0), usage_metadata.get("candidatesTokenCount", 0)
+
+
+def _gemini_has_content(chunk: Dict[str, Any]) -> bool:
+    """True if a streamed Gemini chunk carries generated text"""
+    for candidate in chunk.get("candidates") or []:
+        for part in (candidate.get("content") or {}).get("parts") or []:
+            if part.get("text"):
+                return True
+    return False
+
+
+async def _probe_gemini(
+    provider_key: str, model: str, api_model: str, stream: bool, prompt: str, max_tokens: int
+) -> Dict[str, Any]:
+    """Probe Gemini over its REST API on the shared connection pool"""
+    clients = get_clients()
+    base_url = clients.gemini_base_url(provider_key)
+    headers = clients.gemini_headers(provider_key)
+    payload = {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "generationConfig": {
+            "temperature": TEMPERATURE,
+            "maxOutputTokens": max_tokens,
+        },
+    }
+    
+    start = time.perf_counter()
+    
+    if not stream:
+        response = await clients.http.post(
+            f"{base_url}/models/{api_model}:generateContent",
+            json=payload,
+            headers=headers,
         )
-        
-        latency = time.time() - start
-        
-        # Extract token counts from usage metadata
-        in_tokens = response.usage_metadata.prompt_token_count if response.usage_metadata else 0
-        
-        # candidates_token_count can be a list or int, handle both cases
-        candidates_count = response.usage_metadata.candidates_token_count if response.usage_metadata else 0
-        out_tokens = candidates_count[0] if isinstance(candidates_count, list) and len(candidates_count) > 0 else (candidates_count if isinstance(candidates_count, int) else 0)
-        
-        tps = out_tokens / latency if latency > 0 and out_tokens else 0
-        cost = calc_cost(model, in_tokens, out_tokens)
-        
-        return {
-            "model": model,
-            "provider": PRICING[model]["provider"],
-            "display_name": MODEL_DISPLAY_NAMES[model],
-            "latency_s": round(latency, 3),
-            "tps": round(tps, 2),
-            "cost_usd": round(cost, 6),
-            "in_tokens": in_tokens,
-            "out_tokens": out_tokens,
-            "error": None,
-        }
-    except Exception as e:
-        return {
-            "model": model,
-            "provider": PRICING[model]["provider"],
-            "display_name": MODEL_DISPLAY_NAMES[model],
-            "latency_s": None,
-            "tps": None,
-            "cost_usd": None,
-            "in_tokens": None,
-            "out_tokens": None,
-            "error": str(e),
-        }
+        response.raise_for_status()
+        latency = time.perf_counter() - start
+        in_tokens, out_tokens = _gemini_token_counts(response.json().get("usageMetadata"))
+        return _success_result(model, latency, in_tokens, out_tokens)
+    
+    token_times = []
+    usage_metadata = None
+    async with clients.http.stream(
+        "POST",
+        f"{base_url}/models/{api_model}:streamGenerateContent",
+        params={"alt": "sse"},
+        json=payload,
+        headers=headers,
+    ) as response:
+        if response.is_error:
+            await response.aread()
+            response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            chunk = json.loads(line[len("data:"):])
+            if _gemini_has_content(chunk):
+                token_times.append(time.perf_counter())
+            # Usage totals are cumulative; the last chunk has the final counts
+            usage_metadata = chunk.get("usageMetadata") or usage_metadata
+    end = time.perf_counter()
+    
+    in_tokens, out_tokens = _gemini_token_counts(usage_metadata)
+    return _success_result(
+        model, end - start, in_tokens, out_tokens,
+        _stream_metrics(start, token_times, end, out_tokens),
+    )
+
+
+# Registry adapter name -> probe implementation
+PROBE_ADAPTERS = {
+    "openai": _probe_openai_compatible,
+    "anthropic": _probe_anthropic,
+    "gemini": _probe_gemini,
+}
 
 
-async def test_deepseek(model: str = "deepseek-chat") -> Dict[str, Any]:
-    """Test DeepSeek model (OpenAI-compatible API)"""
+async def probe_model(
+    model: str,
+    stream: bool = False,
+    prompt_id: str = DEFAULT_PROMPT_ID,
+    max_tokens: Optional[int] = None,
+    limited: bool = True,
+    timeout_s: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Probe one registry model through its provider's adapter. With limited
+    (the default) the request first waits for a slot from the provider's
+    rate limiter and concurrency cap; the latency clock starts afterwards.
+    timeout_s likewise bounds only the request itself: a probe that runs
+    past it becomes a timeout result, one that was merely queued does not.
+    """
+    registry = get_registry()
+    entry = registry.models[model]
+    provider = registry.provider_for(model)
+    probe = PROBE_ADAPTERS[provider["adapter"]]
+    max_tokens = output_cap(prompt_id, max_tokens)
+    
+    async def request():
+        try:
+            return await asyncio.wait_for(
+                probe(provider["key"], model, entry["api_model"], stream, prompt, max_tokens), timeout_s
+            )
+        except asyncio.TimeoutError:
+            if timeout_s is None:
+                raise
+            return _timeout_result(model, stream, prompt_id, max_tokens, f"Timed out after {timeout_s:g}s")
+    
     try:
-        start = time.time()
-        
-        # DeepSeek uses OpenAI-compatible API
-        deepseek_client = AsyncOpenAI(
-            api_key=os.environ.get("DEEPSEEK_API_KEY"),
-            base_url="https://api.deepseek.com",
-        )
-        
-        response = await deepseek_client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": TEST_PROMPT}],
-            temperature=TEMPERATURE,
-            max_tokens=MAX_TOKENS,
-        )
-        
-        latency = time.time() - start
-        
-        in_tokens = response.usage.prompt_tokens
-        out_tokens = response.usage.completion_tokens
-        
-        tps = out_tokens / latency if latency > 0 else 0
-        cost = calc_cost(model, in_tokens, out_tokens)
-        
-        return {
-            "model": model,
-            "provider": PRICING[model]["provider"],
-            "display_name": MODEL_DISPLAY_NAMES[model],
-            "latency_s": round(latency, 3),
-            "tps": round(tps, 2),
-            "cost_usd": round(cost, 6),
-            "in_tokens": in_tokens,
-            "out_tokens": out_tokens,
-            "error": None,
-        }
+        prompt = prompt_text(prompt_id)
+        if limited:
+            async with registry.limiter(provider["key"]).slot():
+                result = await request()
+        else:
+            result = await request()
     except Exception as e:
-        return {
-            "model": model,
-            "provider": PRICING[model]["provider"],
-            "display_name": MODEL_DISPLAY_NAMES[model],
-            "latency_s": None,
-            "tps": None,
-            "cost_usd": None,
-            "in_tokens": None,
-            "out_tokens": None,
-            "error": str(e),
-        }
+        result = _error_result(model, e, stream)
+    return _with_prompt(result, prompt_id, max_tokens)
+
 
+def select_models(models: Optional[List[str]]) -> List[str]:
+    """Requested models that exist in the registry (all enabled models if none given)"""
+    known = get_registry().models
+    return [m for m in models if m in known] if models else list(known)
 
-def insert_result(result: Dict[str, Any]) -> None:
-    """Insert test result into database"""
+
+def load_test_probes(models: Optional[List[str]], stream: bool) -> Dict[str, tuple]:
+    """
+    {model: (provider, probe)} for a load-test sweep (all models by default).
+    Probes bypass the provider limiters: the sweep sets the concurrency.
+    """
+    return {
+        model: (PRICING[model]["provider"], lambda model=model: probe_model(model, stream, limited=False))
+        for model in select_models(models)
+    }
+
+
+async def insert_results(
+    results: List[Dict[str, Any]],
+    summaries: Optional[List[Dict[str, Any]]] = None,
+) -> List[int]:
+    """
+    Insert a whole run's results in one multi-row INSERT and one transaction,
+    together with the run's per-model summaries for multi-sample runs.
+    Returns the new row ids in input order and sets result["id"] on each dict.
+    """
+    if not results:
+        return []
+    
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
+        pool = get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                # Allocate the ids up front so each one is paired with its result by
+                # construction (RETURNING order is not guaranteed for INSERT ... SELECT)
+                ids = sorted(await conn.fetchval("""
+                    SELECT array_agg(nextval('results_id_seq')) FROM generate_series(1, $1)
+                """, len(results)))
+                await conn.execute("""
+                    INSERT INTO results 
+                    (id, provider, model, latency_s, tps, cost_usd, in_tokens, out_tokens, error,
+                     streamed, ttft_s, decode_tps, itl_p50_s, itl_p95_s, itl_p99_s,
+                     run_id, sample_index, prompt_id, max_tokens)
+                    SELECT * FROM unnest(
+                        $1::integer[], $2::varchar[], $3::varchar[], $4::numeric[],
+                        $5::numeric[], $6::numeric[], $7::integer[], $8::integer[],
+                        $9::text[], $10::boolean[], $11::numeric[], $12::numeric[],
+                        $13::numeric[], $14::numeric[], $15::numeric[], $16::varchar[],
+                        $17::integer[], $18::varchar[], $19::integer[]
+                    )
+                """,
+                    ids,
+                    [r["provider"] for r in results],
+                    [r["model"] for r in results],
+                    [r["latency_s"] for r in results],
+                    [r["tps"] for r in results],
+                    [r["cost_usd"] for r in results],
+                    [r["in_tokens"] for r in results],
+                    [r["out_tokens"] for r in results],
+                    [r["error"] for r in results],
+                    [r.get("streamed", False) for r in results],
+                    [r.get("ttft_s") for r in results],
+                    [r.get("decode_tps") for r in results],
+                    [r.get("itl_p50_s") for r in results],
+                    [r.get("itl_p95_s") for r in results],
+                    [r.get("itl_p99_s") for r in results],
+                    [r.get("run_id") for r in results],
+                    [r.get("sample_index") for r in results],
+                    [r.get("prompt_id", DEFAULT_PROMPT_ID) for r in results],
+                    [r.get("max_tokens") for r in results],
+                )
+                # Keep the time-series rollups in step with the raw rows
+                await update_rollups(conn, ids)
+                await insert_run_summaries(conn, summaries or [])
+                
+                # Announce the new rows per model (delivered on commit). Only the
+                # highest id is sent: NOTIFY payloads are capped at 8000 bytes and
+                # listeners query the rows they need
+                max_ids: Dict[str, int] = {}
+                for result, row_id in zip(results, ids):
+                    max_ids[result["model"]] = max(row_id, max_ids.get(result["model"], 0))
+                for model, max_id in max_ids.items():
+                    await conn.execute(
+                        "SELECT pg_notify($1, $2)",
+                        RESULTS_CHANNEL,
+                        json.dumps({"model": model, "max_id": max_id}),
+                    )
         
-        cur.execute("""
-            INSERT INTO results 
-            (provider, model, latency_s, tps, cost_usd, in_tokens, out_tokens, error)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            result["provider"],
-            result["model"],
-            result["latency_s"],
-            result["tps"],
-            result["cost_usd"],
-            result["in_tokens"],
-            result["out_tokens"],
-            result["error"],
-        ))
+        for result, row_id in zip(results, ids):
+            result["id"] = row_id
         
-        conn.commit()
-        cur.close()
-        conn.close()
+        # Drop cached history for these models (and the unfiltered views)
+        models = {r["model"] for r in results}
+        await history_cache.invalidate(lambda key: key[0] is None or key[0] in models)
+        return ids
     except Exception as e:
-        print(f"Error inserting result: {e}")
+        print(f"Error inserting results: {e}")
+        return []
 
 
-@app.post("/api/run-test")
-@app.get("/api/run-test")  # Keep GET for backwards compatibility
-async def run_test(request: Request = None):
-    """Run concurrent tests on selected LLM models with currency conversion"""
-    # Parse request body for POST requests
+async def _on_results_inserted(conn, pid, channel, payload) -> None:
+    """NOTIFY callback: drop cached history for the model another process inserted"""
+    try:
+        model = json.loads(payload)["model"]
+    except (ValueError, KeyError, TypeError):
+        await history_cache.invalidate()
+        return
+    await history_cache.invalidate(lambda key: key[0] is None or key[0] == model)
+
+
+async def _listen_for_results() -> None:
+    """
+    Hold a LISTEN connection on RESULTS_CHANNEL for the life of the API, so
+    inserts by the scheduler and other workers invalidate this process's
+    history cache too. Reconnects if the connection drops.
+    """
+    while True:
+        conn = None
+        try:
+            conn = await get_pool().acquire()
+            await conn.add_listener(RESULTS_CHANNEL, _on_results_inserted)
+            # Inserts made while we were not listening went unannounced
+            await history_cache.invalidate()
+            while not conn.is_closed():
+                await asyncio.sleep(RESULTS_LISTEN_CHECK_S)
+            print(f"[{datetime.now()}] Results listener connection lost, reconnecting")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Results listener error: {e}")
+        finally:
+            if conn is not None:
+                try:
+                    if not conn.is_closed():
+                        await conn.remove_listener(RESULTS_CHANNEL, _on_results_inserted)
+                    await get_pool().release(conn)
+                except Exception:
+                    pass
+        await asyncio.sleep(RESULTS_LISTEN_CHECK_S)
+
+
+def _timeout_result(
+    model: str, stream: bool, prompt_id: str, max_tokens: Optional[int], message: str
+) -> Dict[str, Any]:
+    """Error result for a probe abandoned at a deadline"""
+    result = _error_result(model, asyncio.TimeoutError(message), stream)
+    result["timed_out"] = True
+    return _with_prompt(result, prompt_id, output_cap(prompt_id, max_tokens))
+
+
+async def _parse_run_request(request: Optional[Request]) -> tuple:
+    """(models, currency, stream, prompts) from a run-test request body"""
     selected_models = None
     currency = "GBP"  # Default to GBP
+    stream = STREAM_PROBES
+    prompts = None
     
     if request and request.method == "POST":
         try:
             body = await request.json()
             selected_models = body.get("models")
-            currency = body.get("currency", "GBP")
+            currency = str(body.get("currency", "GBP")).upper()
+            stream = bool(body.get("stream", STREAM_PROBES))
+            prompts = body.get("prompts")
         except:
             pass  # Use defaults if body parsing fails
     
-    # Model test function mapping (don't call yet!)
-    model_test_funcs = {
-        "gpt-4o-mini": lambda: test_openai("gpt-4o-mini"),
-        "claude-3-5-haiku-20241022": lambda: test_anthropic("claude-3-5-haiku-20241022"),
-        "gemini-2.0-flash-exp": lambda: test_gemini("gemini-2.0-flash-exp"),
-        "deepseek-chat": lambda: test_deepseek("deepseek-chat"),
+    return selected_models, currency, stream, prompts
+
+
+async def _run_as_completed(plan: List[tuple], stream: bool):
+    """
+    Probe every (model, prompt_id, max_tokens) in plan concurrently, yielding
+    currency-tagged results as each finishes. Probes still running at
+    RUN_TEST_TOTAL_TIMEOUT_S are cancelled and yielded as timeout results.
+    """
+    deadline = time.monotonic() + RUN_TEST_TOTAL_TIMEOUT_S
+    tasks = {
+        asyncio.create_task(
+            probe_model(m, stream, prompt_id, max_tokens, timeout_s=RUN_TEST_MODEL_TIMEOUT_S)
+        ): (m, prompt_id, max_tokens)
+        for m, prompt_id, max_tokens in plan
+    }
+    pending = set(tasks)
+    
+    try:
+        # As-completed: hand over each result the moment its probe finishes
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(
+                pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+            )
+            # One rate lookup for everything that finished together
+            for result in await add_costs([task.result() for task in done]):
+                yield result
+        
+        # Overall deadline reached: give up on stragglers explicitly
+        stragglers, pending = pending, set()
+        for task in stragglers:
+            task.cancel()
+        timeouts = [
+            _timeout_result(
+                model, stream, prompt_id, max_tokens,
+                f"Timed out at the {RUN_TEST_TOTAL_TIMEOUT_S:g}s run deadline",
+            )
+            for model, prompt_id, max_tokens in (tasks[task] for task in stragglers)
+        ]
+        for result in await add_costs(timeouts):
+            yield result
+    finally:
+        # Consumer went away: do not leave probes running
+        for task in pending:
+            task.cancel()
+
+
+async def _run_job(job: Job) -> Dict[str, Any]:
+    """Job runner for a test run: publish results as they arrive, then persist the run"""
+    plan = [
+        (m, prompt_id, max_tokens)
+        for m in job.params["models"]
+        for prompt_id, max_tokens in job.params["prompts"]
+    ]
+    async for result in _run_as_completed(plan, job.params["stream"]):
+        await job.publish("result", result)
+    
+    # Persist the whole run in a single transaction (sets result["id"])
+    ids = await insert_results(job.results)
+    return {
+        "count": len(job.results),
+        "errors": sum(1 for r in job.results if r.get("error")),
+        "timed_out": sum(1 for r in job.results if r.get("timed_out")),
+        "ids": ids,
     }
+
+
+async def _submit_run(request: Optional[Request]) -> Dict[str, Any]:
+    """
+    Queue a test run from a run-test request body, or join the identical
+    run already in flight. Returns {"job_id", "joined", "currency"}, or
+    {"error", "currency"} if the request is invalid or the queue is full.
+    """
+    selected_models, currency, stream, prompts = await _parse_run_request(request)
     
-    # If specific models selected, only test those
-    if selected_models:
-        tests_to_run = [model_test_funcs[m]() for m in selected_models if m in model_test_funcs]
+    # Prompt matrix, e.g. ["default", "in_8k", "in_32k:50"] (default prompt only if omitted)
+    try:
+        matrix = parse_matrix(prompts)
+    except ValueError as e:
+        return {"error": str(e), "currency": currency}
+    
+    if currency not in await get_rates():
+        return {"error": f"Unsupported currency: {currency}", "currency": currency}
+    
+    models = select_models(selected_models)
+    if not models:
+        return {"error": "No known models selected", "currency": currency}
+    
+    # Same model set, prompts and mode -> same job (currency only affects the response)
+    key = (tuple(sorted(models)), tuple(sorted(matrix)), stream)
+    params = {"models": models, "prompts": [list(pair) for pair in matrix], "stream": stream}
+    try:
+        job_id, joined = await get_job_queue().submit(key, params, _run_job)
+    except QueueFull as e:
+        return {"error": str(e), "currency": currency}
+    
+    return {"job_id": job_id, "joined": joined, "currency": currency}
+
+
+@app.post("/api/run-test")
+@app.get("/api/run-test")  # Keep GET for backwards compatibility
+async def run_test(request: Request = None):
+    """
+    Run concurrent tests on selected LLM models with currency conversion.
+    Goes through the job queue and waits for the job, so identical
+    concurrent requests share one run.
+    """
+    submitted = await _submit_run(request)
+    if "error" in submitted:
+        return {"error": submitted["error"], "results": [], "currency": submitted["currency"]}
+    
+    job = await get_job_queue().wait(submitted["job_id"])
+    if job is None:
+        return {"error": "Job is no longer available", "results": [], "currency": submitted["currency"]}
+    
+    # cost_<currency> for the requested currency, converted for the whole run at once.
+    # Results are shared with the job's other submitters, so convert copies
+    results = await add_costs([dict(r) for r in job["results"]], [submitted["currency"]])
+    response = {
+        "results": results,
+        "currency": submitted["currency"],
+        "job_id": job["job_id"],
+        "joined": submitted["joined"],
+    }
+    if job["error"]:
+        response["error"] = job["error"]
+    return response
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {dumps(data)}\n\n"
+
+
+def _job_event_stream(job_id: str, currency: str = "GBP") -> StreamingResponse:
+    """
+    A job's event log as Server-Sent Events, replayed from the start and then
+    live, with cost_<currency> on each result
+    """
+    cost_key = f"cost_{currency.lower()}"
+    
+    async def generate():
+        rates = await get_rates()
+        async for event, data in get_job_queue().follow(job_id):
+            # Results are shared by every follower, so tag a copy
+            if event == "result" and cost_key not in data:
+                data = {**data, cost_key: convert([data.get("cost_usd")], currency, rates)[0]}
+            yield _sse(event, data)
+    
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/api/run-test/stream")
+async def run_test_stream(request: Request):
+    """
+    Same body as /api/run-test, answered as Server-Sent Events: 'queued' and
+    'start' with the job, one 'result' per probe as soon as it completes
+    (fastest first), then 'done' (or 'failed') once the run is stored.
+    Probes that exceed RUN_TEST_MODEL_TIMEOUT_S, or are still running at
+    RUN_TEST_TOTAL_TIMEOUT_S, are reported as timeout results.
+    """
+    submitted = await _submit_run(request)
+    if "error" in submitted:
+        return {"error": submitted["error"], "results": [], "currency": submitted["currency"]}
+    
+    return _job_event_stream(submitted["job_id"], submitted["currency"])
+
+
+@app.post("/api/jobs")
+async def submit_job(request: Request):
+    """
+    Queue a test run (same body as /api/run-test) and return its job_id
+    without waiting. Poll GET /api/jobs/{job_id} or stream
+    GET /api/jobs/{job_id}/events.
+    """
+    submitted = await _submit_run(request)
+    if "error" in submitted:
+        return {"error": submitted["error"]}
+    
+    job = await get_job_queue().snapshot(submitted["job_id"])
+    return {"job_id": submitted["job_id"], "joined": submitted["joined"],
+            "status": job["status"] if job else "unknown"}
+
+
+@app.get("/api/jobs")
+async def get_jobs():
+    """Job queue counters"""
+    return get_job_queue().stats()
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, currency: str = Query("GBP")):
+    """Status of a job and the results completed so far"""
+    job = await get_job_queue().snapshot(job_id)
+    if job is None:
+        return {"error": "Unknown job_id", "results": []}
+    
+    # Results are shared with the running job and its other readers
+    job["results"] = await add_costs([dict(r) for r in job["results"]], [currency])
+    return job
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def get_job_events(job_id: str, currency: str = Query("GBP")):
+    """A job's events as Server-Sent Events (see /api/run-test/stream)"""
+    if await get_job_queue().snapshot(job_id) is None:
+        return {"error": "Unknown job_id"}
+    return _job_event_stream(job_id, currency.upper())
+
+
+def _downsample_key(metric: str) -> str:
+    """Restrict the downsampling metric to known numeric series"""
+    return metric if metric in ("latency_s", "tps", "cost_usd") else "latency_s"
+
+
+def _history_row(row) -> Dict[str, Any]:
+    """Format a raw results row for the history API"""
+    # Convert timestamp to epoch milliseconds for charts
+    ts_ms = int(row["ts"].timestamp() * 1000) if row["ts"] else None
+    
+    return {
+        "ts_ms": ts_ms,
+        "provider": row["provider"],
+        "model": row["model"],
+        "prompt_id": row["prompt_id"],
+        "max_tokens": row["max_tokens"],
+        "latency_s": float(row["latency_s"]) if row["latency_s"] else None,
+        "tps": float(row["tps"]) if row["tps"] else None,
+        "cost_usd": float(row["cost_usd"]) if row["cost_usd"] else None,
+        "in_tokens": row["in_tokens"],
+        "out_tokens": row["out_tokens"],
+        "streamed": row["streamed"],
+        "ttft_s": float(row["ttft_s"]) if row["ttft_s"] is not None else None,
+        "decode_tps": float(row["decode_tps"]) if row["decode_tps"] is not None else None,
+        "itl_p50_s": float(row["itl_p50_s"]) if row["itl_p50_s"] is not None else None,
+        "itl_p95_s": float(row["itl_p95_s"]) if row["itl_p95_s"] is not None else None,
+        "itl_p99_s": float(row["itl_p99_s"]) if row["itl_p99_s"] is not None else None,
+    }
+
+
+def _encode_cursor(row) -> str:
+    """Opaque keyset cursor for the (ts, id) position of a row"""
+    raw = f"{row['ts'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    """Inverse of _encode_cursor; raises ValueError on malformed input"""
+    try:
+        ts, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(ts), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+async def _load_history_page(
+    model: Optional[str],
+    range: str,
+    limit: int,
+    cursor: Optional[str],
+    prompt_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """One keyset page of raw history, newest first"""
+    window = RANGE_WINDOWS.get(range, RANGE_WINDOWS["24h"])
+    after_ts, after_id = _decode_cursor(cursor) if cursor else (None, None)
+    
+    rows = await get_pool().fetch("""
+        SELECT id, ts, provider, model, prompt_id, max_tokens, latency_s, tps, cost_usd,
+               in_tokens, out_tokens, error, streamed, ttft_s,
+               decode_tps, itl_p50_s, itl_p95_s, itl_p99_s
+        FROM results
+        WHERE ($1::varchar IS NULL OR model = $1)
+          AND ts >= now() - $2::interval
+          AND error IS NULL
+          AND ($3::timestamptz IS NULL OR (ts, id) < ($3, $4::integer))
+          AND ($6::varchar IS NULL OR prompt_id = $6)
+        ORDER BY ts DESC, id DESC
+        LIMIT $5
+    """, model, window, after_ts, after_id, limit + 1, prompt_id)
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    return {
+        "history": [_history_row(row) for row in rows],
+        "range": range,
+        "model": model,
+        "prompt_id": prompt_id,
+        "bucket": "raw",
+        "next_cursor": _encode_cursor(rows[-1]) if has_more else None,
+    }
+
+
+async def _load_history(
+    model: Optional[str],
+    range: str,
+    bucket: str,
+    max_points: Optional[int],
+    metric: str,
+    prompt_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Query history for one (model, range, bucket, max_points, metric, prompt_id) key"""
+    # Calculate time window (evaluated against the database clock)
+    window = RANGE_WINDOWS.get(range, RANGE_WINDOWS["24h"])  # default to 24h
+    
+    if bucket == "summary":
+        history = await fetch_run_summaries(model, window, prompt_id)
+        if max_points:
+            history = downsample_history(history, max_points, metric)
+        return {"history": history, "range": range, "model": model,
+                "prompt_id": prompt_id, "bucket": bucket}
+    
+    if bucket != "raw":
+        history = await fetch_rollups(model, bucket, window, prompt_id)
+        if max_points:
+            history = downsample_history(history, max_points, metric)
+        return {"history": history, "range": range, "model": model,
+                "prompt_id": prompt_id, "bucket": bucket}
+    
+    pool = get_pool()
+    
+    if model:
+        rows = await pool.fetch("""
+            SELECT ts, provider, model, prompt_id, max_tokens, latency_s, tps, cost_usd, 
+                   in_tokens, out_tokens, error, streamed, ttft_s,
+                   decode_tps, itl_p50_s, itl_p95_s, itl_p99_s
+            FROM results
+            WHERE model = $1 AND ts >= now() - $2::interval AND error IS NULL
+              AND ($3::varchar IS NULL OR prompt_id = $3)
+            ORDER BY ts DESC
+        """, model, window, prompt_id)
     else:
-        tests_to_run = [func() for func in model_test_funcs.values()]
+        rows = await pool.fetch("""
+            SELECT ts, provider, model, prompt_id, max_tokens, latency_s, tps, cost_usd, 
+                   in_tokens, out_tokens, error, streamed, ttft_s,
+                   decode_tps, itl_p50_s, itl_p95_s, itl_p99_s
+            FROM results
+            WHERE ts >= now() - $1::interval AND error IS NULL
+              AND ($2::varchar IS NULL OR prompt_id = $2)
+            ORDER BY ts DESC
+        """, window, prompt_id)
     
-    # Execute tests concurrently
-    results = await asyncio.gather(*tests_to_run, return_exceptions=True)
+    # Convert to list of dicts with proper formatting
+    history = [_history_row(row) for row in rows]
     
-    # Filter out exceptions, add currency conversion, and insert into database
-    valid_results = []
-    for result in results:
-        if isinstance(result, dict):
-            # Add cost_gbp field
-            if result.get("cost_usd") is not None:
-                result["cost_gbp"] = round(await convert_currency(result["cost_usd"], "GBP"), 6)
-            else:
-                result["cost_gbp"] = None
-            
-            valid_results.append(result)
-            # Insert into database asynchronously
-            await asyncio.to_thread(insert_result, result)
+    if max_points:
+        history = downsample_history(history, max_points, metric)
     
-    return {"results": valid_results, "currency": currency}
+    return {"history": history, "range": range, "model": model,
+            "prompt_id": prompt_id, "bucket": bucket}
 
 
 @app.get("/api/history")
 async def get_history(
     model: Optional[str] = Query(None, description="Filter by model name"),
-    range: str = Query("24h", description="Time range: 24h, 7d, or 30d")
+    range: str = Query("24h", description="Time range: 24h, 7d, or 30d"),
+    bucket: Optional[str] = Query(None, description="raw, 1m, 1h or 1d (default: coarsest suitable rollup)"),
+    max_points: Optional[int] = Query(None, ge=3, description="Downsample each model's series to at most this many points"),
+    metric: str = Query("latency_s", description="Series shape to preserve when downsampling: latency_s, tps or cost_usd"),
+    limit: Optional[int] = Query(None, ge=1, le=10000, description="Page size; enables keyset pagination over raw rows"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    view: str = Query("samples", description="samples, or summary for one robust point (run median) per multi-sample run"),
+    prompt_id: Optional[str] = Query(None, description="Filter by prompt corpus id (default: all prompts, one series each)"),
 ):
-    """Get historical test results with optional filtering"""
+    """
+    Get historical test results with optional filtering.
+    Long ranges are served from pre-aggregated rollups; bucket=raw returns
+    individual results. Responses are cached until new results are inserted.
+    Passing limit (and then cursor) pages through raw rows instead.
+    view=summary returns per-run medians with IQR and trimmed mean.
+    """
     try:
-        # Calculate time threshold
-        now = datetime.now()
-        if range == "24h":
-            threshold = now - timedelta(hours=24)
-        elif range == "7d":
-            threshold = now - timedelta(days=7)
-        elif range == "30d":
-            threshold = now - timedelta(days=30)
-        else:
-            threshold = now - timedelta(hours=24)  # default to 24h
+        if view == "summary":
+            bucket = "summary"
+        elif limit or cursor:
+            return await _load_history_page(model, range, limit or 1000, cursor, prompt_id)
+        elif bucket not in BUCKETS and bucket != "raw":
+            bucket = pick_bucket(RANGE_WINDOWS.get(range, RANGE_WINDOWS["24h"]))
+        metric = _downsample_key(metric)
         
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
+        # Model first: insert_results invalidates by model
+        key = (model, range, bucket, max_points, metric, prompt_id)
+        return await history_cache.get_or_load(
+            key, lambda: _load_history(model, range, bucket, max_points, metric, prompt_id)
+        )
         
-        if model:
-            cur.execute("""
-                SELECT ts, provider, model, latency_s, tps, cost_usd, 
-                       in_tokens, out_tokens, error
-                FROM results
-                WHERE model = %s AND ts >= %s AND error IS NULL
-                ORDER BY ts DESC
-            """, (model, threshold))
-        else:
-            cur.execute("""
-                SELECT ts, provider, model, latency_s, tps, cost_usd, 
-                       in_tokens, out_tokens, error
-                FROM results
-                WHERE ts >= %s AND error IS NULL
-                ORDER BY ts DESC
-            """, (threshold,))
+    except Exception as e:
+        return {"error": str(e), "history": []}
+
+
+@app.get("/api/history/export")
+async def export_history(
+    model: Optional[str] = Query(None, description="Filter by model name"),
+    range: str = Query("24h", description="Time range: 24h, 7d, or 30d"),
+    prompt_id: Optional[str] = Query(None, description="Filter by prompt corpus id"),
+):
+    """
+    Stream raw history as NDJSON (one result per line, newest first).
+    Rows are read through a server-side cursor in batches, so memory use
+    stays constant regardless of the range.
+    """
+    window = RANGE_WINDOWS.get(range, RANGE_WINDOWS["24h"])
+    
+    async def generate():
+        async with get_pool().acquire() as conn:
+            # Server-side cursors only live inside a transaction
+            async with conn.transaction(readonly=True):
+                batch = []
+                async for row in conn.cursor("""
+                    SELECT ts, provider, model, prompt_id, max_tokens, latency_s, tps, cost_usd,
+                           in_tokens, out_tokens, error, streamed, ttft_s,
+                           decode_tps, itl_p50_s, itl_p95_s, itl_p99_s
+                    FROM results
+                    WHERE ($1::varchar IS NULL OR model = $1)
+                      AND ts >= now() - $2::interval
+                      AND error IS NULL
+                      AND ($3::varchar IS NULL OR prompt_id = $3)
+                    ORDER BY ts DESC, id DESC
+                """, model, window, prompt_id, prefetch=EXPORT_BATCH_SIZE):
+                    batch.append(dumps(_history_row(row)))
+                    if len(batch) >= EXPORT_BATCH_SIZE:
+                        yield "\n".join(batch) + "\n"
+                        batch = []
+                if batch:
+                    yield "\n".join(batch) + "\n"
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@app.post("/api/loadtest")
+async def start_load_test(request: Request):
+    """
+    Start a concurrency sweep in the background and return its sweep_id.
+    Body: {"models": [...], "levels": [1, 2, 4, 8], "requests_per_worker": 4, "stream": false}
+    Requires the X-Loadtest-Token header to match LOADTEST_TOKEN. Levels and
+    requests_per_worker are clamped, and sweeps over LOADTEST_MAX_TOTAL_REQUESTS
+    probes are refused. Only one sweep runs per process at a time.
+    """
+    expected_token = loadtest.LOADTEST_TOKEN
+    if not expected_token:
+        return FastJSONResponse({"error": "Load tests are disabled (LOADTEST_TOKEN not set)"}, status_code=403)
+    if not hmac.compare_digest(request.headers.get("X-Loadtest-Token", ""), expected_token):
+        return FastJSONResponse({"error": "Invalid load test token"}, status_code=401)
+    
+    try:
+        body = await request.json()
+    except Exception:
+        body = {}
+    
+    running = loadtest.running_sweep()
+    if running:
+        return {"error": "A load test is already running", "sweep_id": running}
+    
+    stream = bool(body.get("stream", False))
+    probes = load_test_probes(body.get("models"), stream)
+    if not probes:
+        return {"error": "No known models selected"}
+    
+    try:
+        levels = loadtest.parse_levels(body.get("levels"))
+        requests_per_worker = min(
+            max(1, int(body.get("requests_per_worker", loadtest.REQUESTS_PER_WORKER))),
+            loadtest.MAX_REQUESTS_PER_WORKER,
+        )
+    except (ValueError, TypeError):
+        return {"error": "levels and requests_per_worker must be integers"}
+    
+    total = loadtest.total_requests(len(probes), levels, requests_per_worker)
+    if total > loadtest.MAX_TOTAL_REQUESTS:
+        return FastJSONResponse(
+            {"error": f"Sweep would send {total} requests (limit {loadtest.MAX_TOTAL_REQUESTS})"},
+            status_code=400,
+        )
+    
+    sweep_id = loadtest.start_sweep(probes, levels, requests_per_worker, stream)
+    return {"sweep_id": sweep_id, "models": list(probes), "levels": levels,
+            "requests_per_worker": requests_per_worker, "status": "running"}
+
+
+@app.get("/api/loadtest/{sweep_id}")
+async def get_load_test(sweep_id: str):
+    """Status of a sweep and its saturation curve points stored so far"""
+    try:
+        curve = await loadtest.fetch_sweep(sweep_id)
+        status = loadtest.sweep_status(sweep_id)
+        if status is None and not curve:
+            return {"error": "Unknown sweep_id", "curve": []}
         
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
+        return {
+            "sweep_id": sweep_id,
+            # Sweeps started by another process or before a restart have no live status
+            "status": status["status"] if status else "unknown",
+            "progress": status,
+            "curve": curve,
+        }
+        
+    except Exception as e:
+        return {"error": str(e), "curve": []}
+
+
+@app.get("/api/models")
+async def get_models():
+    """Configured models (pricing per 1M tokens) and live provider limiter counters"""
+    registry = get_registry()
+    return {
+        "models": [
+            {
+                "id": model_id,
+                "display_name": entry["display_name"],
+                "provider": registry.provider_for(model_id)["name"],
+                "pricing": {"input": entry["input"], "output": entry["output"]},
+            }
+            for model_id, entry in registry.models.items()
+        ],
+        "limiters": registry.limiter_stats(),
+    }
+
+
+@app.get("/api/fx")
+async def get_fx():
+    """Cached USD exchange rates, their age and whether a refresh is running"""
+    await get_rates()
+    return rates_status()
+
+
+@app.get("/api/cache")
+async def get_cache_stats():
+    """Hit/miss counters for the in-process response caches"""
+    return {"caches": [history_cache.stats()]}
+
+
+def _cost_split(model: str, in_tokens: Optional[float], out_tokens: Optional[float]) -> Dict[str, Optional[float]]:
+    """Mean per-request cost attributable to prefill (input) and decode (output) tokens"""
+    pricing = PRICING.get(model)
+    if pricing is None or in_tokens is None or out_tokens is None:
+        return {"prefill_usd": None, "decode_usd": None}
+    
+    return {
+        "prefill_usd": round(in_tokens / 1_000_000 * pricing["input"], 8),
+        "decode_usd": round(out_tokens / 1_000_000 * pricing["output"], 8),
+    }
+
+
+@app.get("/api/stats")
+async def get_stats(
+    model: Optional[str] = Query(None, description="Filter by model name"),
+    range: str = Query("24h", description="Time range: 24h, 7d, or 30d"),
+    start_ms: Optional[int] = Query(None, description="Window start (epoch ms), overrides range"),
+    end_ms: Optional[int] = Query(None, description="Window end (epoch ms), defaults to now"),
+    prompt_id: Optional[str] = Query(None, description="Filter by prompt corpus id (default: one entry per prompt)"),
+):
+    """
+    Percentile summary (p50/p90/p95/p99) of latency, TPS, cost, TTFT and
+    decode TPS per model and prompt, with the mean cost split into prefill
+    and decode.
+    """
+    try:
+        window = RANGE_WINDOWS.get(range, RANGE_WINDOWS["24h"])
+        start = datetime.fromtimestamp(start_ms / 1000, tz=timezone.utc) if start_ms is not None else None
+        end = datetime.fromtimestamp(end_ms / 1000, tz=timezone.utc) if end_ms is not None else None
         
-        # Convert to list of dicts with proper formatting
-        history = []
-        for row in rows:
-            # Convert timestamp to epoch milliseconds for charts
-            ts_ms = int(row["ts"].timestamp() * 1000) if row["ts"] else None
-            
-            history.append({
-                "ts_ms": ts_ms,
-                "provider": row["provider"],
-                "model": row["model"],
-                "latency_s": float(row["latency_s"]) if row["latency_s"] else None,
-                "tps": float(row["tps"]) if row["tps"] else None,
-                "cost_usd": float(row["cost_usd"]) if row["cost_usd"] else None,
-                "in_tokens": row["in_tokens"],
-                "out_tokens": row["out_tokens"],
-            })
+        stats = await percentile_summary(model, window, start, end, prompt_id)
+        for entry in stats:
+            entry["cost_split"] = _cost_split(entry["model"], entry["in_tokens_avg"], entry["out_tokens_avg"])
         
-        return {"history": history, "range": range, "model": model}
+        return {"stats": stats, "range": range, "model": model, "prompt_id": prompt_id,
+                "start_ms": start_ms, "end_ms": end_ms}
         
     except Exception as e:
-        return {"error": str(e), "history": []}
+        return {"error": str(e), "stats": []}
 
 
 @app.post("/api/alerts/test")
@@ -491,41 +1184,11 @@ async def test_alert(request: Request):
         if not alert_type:
             return {"error": "Alert type is required", "would_trigger": False}
         
-        # Calculate time threshold
-        now = datetime.now()
-        if window == "24h":
-            time_threshold = now - timedelta(hours=24)
-        elif window == "7d":
-            time_threshold = now - timedelta(days=7)
-        else:
-            time_threshold = now - timedelta(hours=24)
-        
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Query recent metrics based on alert configuration
-        if model:
-            cur.execute("""
-                SELECT ts, model, latency_s, tps, cost_usd, in_tokens, out_tokens, error
-                FROM results
-                WHERE model = %s AND ts >= %s
-                ORDER BY ts DESC
-                LIMIT 100
-            """, (model, time_threshold))
-        else:
-            cur.execute("""
-                SELECT ts, model, latency_s, tps, cost_usd, in_tokens, out_tokens, error
-                FROM results
-                WHERE ts >= %s
-                ORDER BY ts DESC
-                LIMIT 100
-            """, (time_threshold,))
-        
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
+        # Aggregate the window in the database (one row regardless of volume),
+        # from raw samples or run summaries per ALERT_METRIC_SOURCE
+        aggregates = await fetch_aggregates(model, window)
         
-        if not rows:
+        if not aggregates["data_points"]:
             return {
                 "would_trigger": False,
                 "reason": "No recent data available for evaluation",
@@ -533,95 +1196,78 @@ async def test_alert(request: Request):
             }
         
         # Evaluate alert condition based on type
-        would_trigger = False
-        trigger_details = {}
-        
-        if alert_type == "latency" and threshold:
-            try:
-                threshold_val = float(threshold)
-            except (ValueError, TypeError):
-                return {"error": "Invalid threshold value for latency alert", "would_trigger": False}
-            max_latency = max((r["latency_s"] or 0) for r in rows)
-            would_trigger = max_latency > threshold_val
-            trigger_details = {
-                "max_latency": round(max_latency, 3),
-                "threshold": threshold_val,
-                "comparison": f"{max_latency:.3f}s > {threshold_val}s"
-            }
-        
-        elif alert_type == "tps_drop" and threshold:
-            try:
-                threshold_val = float(threshold)
-            except (ValueError, TypeError):
-                return {"error": "Invalid threshold value for tps_drop alert", "would_trigger": False}
-            # Calculate average TPS and check for drops
-            valid_tps = [r["tps"] for r in rows if r["tps"] is not None]
-            if valid_tps:
-                avg_tps = sum(valid_tps) / len(valid_tps)
-                min_tps = min(valid_tps)
-                drop_percent = ((avg_tps - min_tps) / avg_tps * 100) if avg_tps > 0 else 0
-                would_trigger = drop_percent > threshold_val
-                trigger_details = {
-                    "avg_tps": round(avg_tps, 2),
-                    "min_tps": round(min_tps, 2),
-                    "drop_percent": round(drop_percent, 2),
-                    "threshold": threshold_val,
-                    "comparison": f"{drop_percent:.2f}% > {threshold_val}%"
-                }
-        
-        elif alert_type == "cost_mtok" and threshold:
-            try:
-                threshold_val = float(threshold)
-            except (ValueError, TypeError):
-                return {"error": "Invalid threshold value for cost_mtok alert", "would_trigger": False}
-            # Calculate cost per million tokens
-            costs = []
-            for r in rows:
-                if r["cost_usd"] and r["in_tokens"] and r["out_tokens"]:
-                    total_tokens = r["in_tokens"] + r["out_tokens"]
-                    if total_tokens > 0:
-                        cost_per_mtok = (r["cost_usd"] / total_tokens) * 1_000_000
-                        costs.append(cost_per_mtok)
-            
-            if costs:
-                max_cost_mtok = max(costs)
-                would_trigger = max_cost_mtok > threshold_val
-                trigger_details = {
-                    "max_cost_per_mtok": round(max_cost_mtok, 2),
-                    "threshold": threshold_val,
-                    "comparison": f"${max_cost_mtok:.2f} > ${threshold_val}"
-                }
-        
-        elif alert_type == "error":
-            # Check if there are any errors in the window
-            error_count = sum(1 for r in rows if r["error"] is not None)
-            would_trigger = error_count > 0
-            trigger_details = {
-                "error_count": error_count,
-                "total_requests": len(rows),
-                "error_rate": round((error_count / len(rows) * 100), 2) if rows else 0
-            }
-        
-        elif alert_type == "digest":
-            # Digest always triggers (it's a summary)
-            would_trigger = True
-            trigger_details = {
-                "data_points": len(rows),
-                "models_tested": len(set(r["model"] for r in rows)),
-                "time_window": window
-            }
+        try:
+            evaluation = evaluate_alert(alert_type, threshold, window, aggregates)
+        except ValueError as e:
+            return {"error": str(e), "would_trigger": False}
         
         return {
-            "would_trigger": would_trigger,
+            "would_trigger": evaluation["triggered"],
             "alert_type": alert_type,
-            "data_points": len(rows),
+            "data_points": aggregates["data_points"],
             "window": window,
-            "details": trigger_details,
+            "details": evaluation["details"],
         }
         
     except Exception as e:
         return {"error": str(e), "would_trigger": False}
 
 
+@app.get("/api/health")
+async def health():
+    """Liveness check including a database round-trip"""
+    db_ok = await check_pool()
+    return {"status": "ok" if db_ok else "degraded", "database": db_ok}
+
+
+def serve() -> None:
+    """
+    Run the API under uvicorn.
+    
+    PULSE_WORKERS (default 1, "auto" for one per CPU) sets the number of
+    worker processes behind one port. Each worker has its own database pool
+    (up to PG_POOL_MAX_SIZE connections), provider limiters and job workers;
+    the provider limits in models.json are divided between the workers
+    (PULSE_PROVIDER_LIMIT_SHARES, see providers.py).
+    With more than one worker the shared-state backend defaults to SQLite,
+    so the caches and the job queue stay coherent across workers. The state
+    file is reset at startup unless another server is using it. uvloop, httptools and orjson are used when
+    installed.
+    """
+    workers_env = os.environ.get("PULSE_WORKERS", "1")
+    workers = (os.cpu_count() or 1) if workers_env == "auto" else max(1, int(workers_env))
+    
+    # Inherited by the worker processes, which import main afresh
+    os.environ.setdefault("PULSE_PROVIDER_LIMIT_SHARES", str(workers))
+    if workers > 1:
+        os.environ.setdefault("PULSE_STATE_BACKEND", "sqlite")
+    if os.environ.get("PULSE_STATE_BACKEND") == "sqlite":
+        reset_state_file(STATE_PATH)
+    
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        loop = "asyncio"
+    try:
+        import httptools  # noqa: F401
+        http = "httptools"
+    except ImportError:
+        http = "h11"
+    
+    print(f"Serving with {workers} worker(s), loop={loop}, http={http}, "
+          f"json={'orjson' if HAS_ORJSON else 'json'}, "
+          f"state={os.environ.get('PULSE_STATE_BACKEND', 'memory')}")
+    uvicorn.run(
+        # Multiple workers need an import string so each process can load the app
+        "main:app" if workers > 1 else app,
+        host=os.environ.get("PULSE_HOST", "0.0.0.0"),
+        port=int(os.environ.get("PULSE_PORT", "8000")),
+        workers=workers,
+        loop=loop,
+        http=http,
+    )
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    serve()
@@ -0,0 +1,110 @@
+"""
+Prompt corpus for probes: several input sizes and output caps.
+
+Latency and cost scale with input length (prefill) and output length
+(decode), so a run can probe a matrix of prompts instead of the single
+short test prompt. A matrix spec is a comma-separated list of prompt ids,
+each optionally followed by ":<max_tokens>" to override the prompt's
+output cap, e.g. "default,in_1k,in_8k,in_32k:50" (PROBE_PROMPTS env, or
+"prompts" in the /api/run-test body).
+
+Sized prompts start with a random nonce so provider-side prefix caching
+cannot turn a prefill measurement into a cache hit.
+"""
+
+import os
+import uuid
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+# Standard test prompt (short to minimize costs)
+TEST_PROMPT = "Explain quantum computing in exactly 50 words."
+TEMPERATURE = 0.2
+MAX_TOKENS = 100
+
+DEFAULT_PROMPT_ID = "default"
+# Matrix probed by scheduled runs (see parse_matrix)
+PROBE_PROMPTS = os.environ.get("PROBE_PROMPTS", DEFAULT_PROMPT_ID)
+# Upper bound for a per-matrix output cap override
+MAX_OUTPUT_CAP = int(os.environ.get("PROBE_MAX_OUTPUT_CAP", "4096"))
+
+# Roughly 100 tokens of neutral filler; sized prompts repeat it as numbered sections
+_PASSAGE = (
+    "The operations log records routine maintenance across the regional data "
+    "centres. Cooling units were inspected, filters replaced and firmware "
+    "updated on the storage controllers. Network engineers rebalanced traffic "
+    "between the two upstream carriers after a brief packet-loss event, and the "
+    "on-call team verified that replication lag stayed under one second for "
+    "every primary database. No customer-facing incidents were opened during "
+    "the period, and the next review is scheduled for the end of the quarter."
+)
+_SUMMARY_INSTRUCTION = "Summarise the operations log above in exactly 50 words."
+
+# Prompt id -> approximate input size, passage repeats and default output cap
+PROMPTS: Dict[str, Dict[str, Any]] = {
+    DEFAULT_PROMPT_ID: {"approx_in_tokens": 10, "sections": 0, "max_tokens": MAX_TOKENS},
+    "in_100": {"approx_in_tokens": 100, "sections": 1, "max_tokens": MAX_TOKENS},
+    "in_1k": {"approx_in_tokens": 1_000, "sections": 10, "max_tokens": MAX_TOKENS},
+    "in_8k": {"approx_in_tokens": 8_000, "sections": 80, "max_tokens": MAX_TOKENS},
+    "in_32k": {"approx_in_tokens": 32_000, "sections": 320, "max_tokens": MAX_TOKENS},
+    # Short input, long output: isolates decode throughput and output cost
+    "out_1k": {"approx_in_tokens": 20, "sections": 0, "max_tokens": 1_024},
+}
+
+_OUT_1K_PROMPT = (
+    "Write a detailed, 700-word technical overview of how quantum computers "
+    "differ from classical computers."
+)
+
+
+@lru_cache(maxsize=None)
+def _body(prompt_id: str) -> str:
+    if prompt_id == DEFAULT_PROMPT_ID:
+        return TEST_PROMPT
+    if prompt_id == "out_1k":
+        return _OUT_1K_PROMPT
+
+    sections = "\n\n".join(
+        f"Section {i + 1}. {_PASSAGE}" for i in range(PROMPTS[prompt_id]["sections"])
+    )
+    return f"{sections}\n\n{_SUMMARY_INSTRUCTION}"
+
+
+def prompt_text(prompt_id: str) -> str:
+    """Prompt to send for one probe (sized prompts get a fresh cache-busting nonce)"""
+    if prompt_id not in PROMPTS:
+        raise ValueError(f"Unknown prompt id: {prompt_id}")
+    if prompt_id == DEFAULT_PROMPT_ID:
+        return TEST_PROMPT
+    return f"[probe {uuid.uuid4().hex[:12]}]\n\n{_body(prompt_id)}"
+
+
+def output_cap(prompt_id: str, max_tokens: Optional[int] = None) -> int:
+    """Output cap for a probe: the override if given, else the prompt's default"""
+    if max_tokens is None:
+        return PROMPTS[prompt_id]["max_tokens"]
+    return min(max(int(max_tokens), 1), MAX_OUTPUT_CAP)
+
+
+def parse_matrix(spec: Any) -> List[Tuple[str, int]]:
+    """
+    (prompt_id, max_tokens) pairs from a spec string ("in_1k,in_8k:50") or a
+    list of such entries. Raises ValueError for unknown ids or bad caps.
+    """
+    if not spec:
+        return [(DEFAULT_PROMPT_ID, output_cap(DEFAULT_PROMPT_ID))]
+
+    entries = spec.split(",") if isinstance(spec, str) else spec
+    matrix = []
+    for entry in entries:
+        prompt_id, _, cap = str(entry).strip().partition(":")
+        if prompt_id not in PROMPTS:
+            raise ValueError(f"Unknown prompt id: {prompt_id}")
+        try:
+            pair = (prompt_id, output_cap(prompt_id, int(cap) if cap else None))
+        except ValueError:
+            raise ValueError(f"Invalid max_tokens for prompt {prompt_id}: {cap}")
+        if pair not in matrix:
+            matrix.append(pair)
+    return matrix
+
@@ -0,0 +1,204 @@
+"""
+Data-driven model registry: providers, models, pricing and limits.
+
+Loaded once per process from a JSON config (PULSE_MODELS_CONFIG, default
+models.json next to this file). Each provider names an adapter ('openai'
+for any OpenAI-compatible API, 'anthropic' or 'gemini'), where to reach it
+and its limits. Each model names its provider, display name and pricing
+per 1M tokens, and optionally the model name sent to the API when it
+differs from the id.
+
+Every probe runs inside its provider's limiter. A token bucket caps the
+request rate and a semaphore caps requests in flight, so large fan-outs
+queue instead of tripping 429s. Probes start their clock only after they
+get a slot, so time spent queueing is not counted as latency.
+
+Limiters live in each process, so configured limits are split across
+PULSE_PROVIDER_LIMIT_SHARES processes (serve() sets it to PULSE_WORKERS):
+each worker gets rate_per_s / shares and burst and max_concurrency divided
+by shares, never below 1. With more workers than a limit allows, the
+floor of 1 per worker can still exceed the configured total.
+"""
+
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+ADAPTERS = ("openai", "anthropic", "gemini")
+
+CONFIG_PATH = os.environ.get(
+    "PULSE_MODELS_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models.json")
+)
+
+# Limits for providers that do not set their own
+DEFAULT_RATE_PER_S = float(os.environ.get("PULSE_PROVIDER_RATE_PER_S", "2"))
+DEFAULT_BURST = int(os.environ.get("PULSE_PROVIDER_BURST", "4"))
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get("PULSE_PROVIDER_MAX_CONCURRENCY", "4"))
+# Number of processes sharing each provider's limits (see the module docstring)
+LIMIT_SHARES = max(1, int(os.environ.get("PULSE_PROVIDER_LIMIT_SHARES", "1")))
+
+
+class TokenBucket:
+    """Async token bucket: `rate_per_s` sustained, up to `burst` at once"""
+
+    def __init__(self, rate_per_s: float, burst: int):
+        self.rate_per_s = rate_per_s
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        # Waiters take tokens in arrival order
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate_per_s)
+        self._updated = now
+
+    async def acquire(self) -> float:
+        """Take one token, sleeping until one is available; returns seconds waited"""
+        start = time.monotonic()
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate_per_s)
+                self._refill()
+            self._tokens -= 1
+        return time.monotonic() - start
+
+
+class ProviderLimiter:
+    """Concurrency cap plus optional rate limit for one provider"""
+
+    def __init__(self, rate_per_s: Optional[float], burst: int, max_concurrency: int):
+        self.max_concurrency = max(1, max_concurrency)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        # rate_per_s of 0/None disables rate limiting (concurrency cap only)
+        self._bucket = TokenBucket(rate_per_s, burst) if rate_per_s else None
+        self.in_flight = 0
+        self.waiting = 0
+        self.acquired = 0
+        self.wait_s_total = 0.0
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold one concurrency slot and one rate token for the duration of a request"""
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            if self._bucket is not None:
+                await self._bucket.acquire()
+            self.acquired += 1
+            self.wait_s_total += time.monotonic() - start
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+        finally:
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for observability"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "rate_per_s": self._bucket.rate_per_s if self._bucket else None,
+            "burst": self._bucket.burst if self._bucket else None,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "acquired": self.acquired,
+            "avg_wait_s": round(self.wait_s_total / self.acquired, 4) if self.acquired else None,
+        }
+
+
+class ModelRegistry:
+    """Providers and models from one config, with a limiter per provider"""
+
+    def __init__(self, config: Dict[str, Any]):
+        self.providers: Dict[str, Dict[str, Any]] = {}
+        self.models: Dict[str, Dict[str, Any]] = {}
+        self._limiters: Dict[str, ProviderLimiter] = {}
+
+        for key, provider in (config.get("providers") or {}).items():
+            if provider.get("adapter") not in ADAPTERS:
+                raise ValueError(f"Provider {key}: adapter must be one of {', '.join(ADAPTERS)}")
+            self.providers[key] = {
+                "key": key,
+                "name": provider.get("name", key),
+                "adapter": provider["adapter"],
+                "base_url": provider.get("base_url"),
+                "api_key_env": provider.get("api_key_env"),
+                "rate_per_s": provider.get("rate_per_s", DEFAULT_RATE_PER_S),
+                "burst": provider.get("burst", DEFAULT_BURST),
+                "max_concurrency": provider.get("max_concurrency", DEFAULT_MAX_CONCURRENCY),
+            }
+
+        for model in config.get("models") or []:
+            model_id = model.get("id")
+            if not model_id or model_id in self.models:
+                raise ValueError(f"Model ids must be present and unique: {model_id!r}")
+            if model.get("provider") not in self.providers:
+                raise ValueError(f"Model {model_id}: unknown provider {model.get('provider')!r}")
+            if not model.get("enabled", True):
+                continue
+
+            pricing = model.get("pricing") or {}
+            self.models[model_id] = {
+                "id": model_id,
+                "provider": model["provider"],
+                "api_model": model.get("api_model", model_id),
+                "display_name": model.get("display_name", model_id),
+                "input": float(pricing.get("input", 0)),
+                "output": float(pricing.get("output", 0)),
+            }
+
+    @classmethod
+    def load(cls, path: str = CONFIG_PATH) -> "ModelRegistry":
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def model_ids(self) -> List[str]:
+        """Enabled model ids in config order"""
+        return list(self.models)
+
+    def provider_for(self, model_id: str) -> Dict[str, Any]:
+        return self.providers[self.models[model_id]["provider"]]
+
+    def api_key(self, provider_key: str) -> Optional[str]:
+        env = self.providers[provider_key]["api_key_env"]
+        return os.environ.get(env) if env else None
+
+    def limiter(self, provider_key: str) -> ProviderLimiter:
+        """This process's share of the provider's limits (created on first use, inside the running loop)"""
+        limiter = self._limiters.get(provider_key)
+        if limiter is None:
+            provider = self.providers[provider_key]
+            rate_per_s = provider["rate_per_s"]
+            limiter = ProviderLimiter(
+                rate_per_s / LIMIT_SHARES if rate_per_s else rate_per_s,
+                max(1, provider["burst"] // LIMIT_SHARES),
+                max(1, provider["max_concurrency"] // LIMIT_SHARES),
+            )
+            self._limiters[provider_key] = limiter
+        return limiter
+
+    def limiter_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {key: limiter.stats() for key, limiter in self._limiters.items()}
+
+
+_registry: Optional[ModelRegistry] = None
+
+
+def get_registry() -> ModelRegistry:
+    """The process-wide registry, loaded from CONFIG_PATH on first use"""
+    global _registry
+
+    if _registry is None:
+        _registry = ModelRegistry.load()
+    return _registry
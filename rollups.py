@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Pre-aggregated time-series rollups of the results table.
+
+Every insert updates 1-minute, 1-hour and 1-day buckets per model and
+prompt (count, min, max and sum of latency, TPS and cost, and of the
+streaming metrics, which only streamed probes record) in the same
+transaction, so /api/history can serve long ranges without scanning raw rows.
+Run via: python rollups.py --rebuild [--days N]   (backfill / compaction)
+"""
+
+import argparse
+import asyncio
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+import asyncpg
+
+from db import init_pool, close_pool, get_pool
+
+# Bucket name -> date_trunc unit and bucket width, finest first
+BUCKETS = {
+    "1m": ("minute", timedelta(minutes=1)),
+    "1h": ("hour", timedelta(hours=1)),
+    "1d": ("day", timedelta(days=1)),
+}
+
+# /api/history picks the coarsest bucket that still yields this many points
+MIN_HISTORY_POINTS = 100
+
+# Streaming-only metrics: null for non-streamed probes, so each keeps its own count
+STREAM_METRICS = ("ttft_s", "decode_tps", "itl_p50_s", "itl_p95_s", "itl_p99_s")
+
+_STREAM_SELECT = "".join(f"""
+           count(res.{m}) AS {m}_count,
+           min(res.{m}) AS {m}_min,
+           max(res.{m}) AS {m}_max,
+           sum(res.{m}) AS {m}_sum,""" for m in STREAM_METRICS)
+
+_STREAM_COLUMNS = ", ".join(
+    f"{m}_count, {m}_min, {m}_max, {m}_sum" for m in STREAM_METRICS
+)
+
+_STREAM_MERGE = "".join(f""",
+            {m}_count = r.{m}_count + EXCLUDED.{m}_count,
+            {m}_min = LEAST(r.{m}_min, EXCLUDED.{m}_min),
+            {m}_max = GREATEST(r.{m}_max, EXCLUDED.{m}_max),
+            {m}_sum = COALESCE(r.{m}_sum, 0) + COALESCE(EXCLUDED.{m}_sum, 0)""" for m in STREAM_METRICS)
+
+# Aggregates for a set of raw rows ("res"), grouped into every bucket size
+_AGGREGATE_SELECT = f"""
+    SELECT b.bucket,
+           date_trunc(b.unit, res.ts) AS bucket_ts,
+           res.model,
+           res.prompt_id,
+           min(res.provider) AS provider,
+           count(*) FILTER (WHERE res.error IS NULL) AS count,
+           count(*) FILTER (WHERE res.error IS NOT NULL) AS error_count,
+           min(res.latency_s) AS latency_min,
+           max(res.latency_s) AS latency_max,
+           sum(res.latency_s) AS latency_sum,
+           min(res.tps) AS tps_min,
+           max(res.tps) AS tps_max,
+           sum(res.tps) AS tps_sum,
+           min(res.cost_usd) AS cost_min,
+           max(res.cost_usd) AS cost_max,
+           sum(res.cost_usd) AS cost_sum,{_STREAM_SELECT}
+           sum(res.in_tokens) AS in_tokens_sum,
+           sum(res.out_tokens) AS out_tokens_sum
+    FROM results res
+    CROSS JOIN (VALUES ('1m', 'minute'), ('1h', 'hour'), ('1d', 'day')) AS b(bucket, unit)
+"""
+
+_GROUP_BY = "GROUP BY b.bucket, date_trunc(b.unit, res.ts), res.model, res.prompt_id"
+
+_COLUMNS = f"""
+    (bucket, bucket_ts, model, prompt_id, provider, count, error_count,
+     latency_min, latency_max, latency_sum, tps_min, tps_max, tps_sum,
+     cost_min, cost_max, cost_sum, {_STREAM_COLUMNS}, in_tokens_sum, out_tokens_sum)
+"""
+
+
+async def update_rollups(conn: asyncpg.Connection, result_ids: List[int]) -> None:
+    """Merge newly inserted results into every bucket (call inside the insert transaction)"""
+    if not result_ids:
+        return
+
+    await conn.execute(f"""
+        INSERT INTO results_rollups AS r {_COLUMNS}
+        {_AGGREGATE_SELECT}
+        WHERE res.id = ANY($1::integer[])
+        {_GROUP_BY}
+        ON CONFLICT (bucket, model, prompt_id, bucket_ts) DO UPDATE SET
+            count = r.count + EXCLUDED.count,
+            error_count = r.error_count + EXCLUDED.error_count,
+            latency_min = LEAST(r.latency_min, EXCLUDED.latency_min),
+            latency_max = GREATEST(r.latency_max, EXCLUDED.latency_max),
+            latency_sum = COALESCE(r.latency_sum, 0) + COALESCE(EXCLUDED.latency_sum, 0),
+            tps_min = LEAST(r.tps_min, EXCLUDED.tps_min),
+            tps_max = GREATEST(r.tps_max, EXCLUDED.tps_max),
+            tps_sum = COALESCE(r.tps_sum, 0) + COALESCE(EXCLUDED.tps_sum, 0),
+            cost_min = LEAST(r.cost_min, EXCLUDED.cost_min),
+            cost_max = GREATEST(r.cost_max, EXCLUDED.cost_max),
+            cost_sum = COALESCE(r.cost_sum, 0) + COALESCE(EXCLUDED.cost_sum, 0),
+            in_tokens_sum = COALESCE(r.in_tokens_sum, 0) + COALESCE(EXCLUDED.in_tokens_sum, 0),
+            out_tokens_sum = COALESCE(r.out_tokens_sum, 0) + COALESCE(EXCLUDED.out_tokens_sum, 0){_STREAM_MERGE}
+    """, result_ids)
+
+
+async def rebuild_rollups(since: Optional[timedelta] = None) -> int:
+    """
+    Recompute rollups from raw results (all history, or the last `since`).
+    Used to backfill rows written before rollups existed and to repair drift.
+    Returns the number of bucket rows written.
+    """
+    async with get_pool().acquire() as conn:
+        async with conn.transaction():
+            if since is None:
+                await conn.execute("DELETE FROM results_rollups")
+                status = await conn.execute(f"""
+                    INSERT INTO results_rollups {_COLUMNS}
+                    {_AGGREGATE_SELECT}
+                    {_GROUP_BY}
+                """)
+            else:
+                # Widen the start to whole days so no bucket is rebuilt from partial data
+                await conn.execute("""
+                    DELETE FROM results_rollups
+                    WHERE bucket_ts >= date_trunc('day', now() - $1::interval)
+                """, since)
+                status = await conn.execute(f"""
+                    INSERT INTO results_rollups {_COLUMNS}
+                    {_AGGREGATE_SELECT}
+                    WHERE res.ts >= date_trunc('day', now() - $1::interval)
+                    {_GROUP_BY}
+                """, since)
+
+    return int(status.split()[-1])
+
+
+def pick_bucket(window: timedelta) -> str:
+    """Coarsest bucket that still gives at least MIN_HISTORY_POINTS points per model"""
+    chosen = "1m"
+    for name, (_, width) in BUCKETS.items():
+        if window / width >= MIN_HISTORY_POINTS:
+            chosen = name
+    return chosen
+
+
+async def fetch_rollups(
+    model: Optional[str],
+    bucket: str,
+    window: timedelta,
+    prompt_id: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Return bucketed history rows (newest first) in the /api/history row shape,
+    one series per model and prompt unless prompt_id narrows it
+    """
+    rows = await get_pool().fetch(f"""
+        SELECT bucket_ts, provider, model, prompt_id, count, latency_min, latency_max, latency_sum,
+               tps_min, tps_max, tps_sum, cost_min, cost_max, cost_sum, {_STREAM_COLUMNS},
+               in_tokens_sum, out_tokens_sum
+        FROM results_rollups
+        WHERE bucket = $1
+          AND ($2::varchar IS NULL OR model = $2)
+          AND bucket_ts >= date_trunc($3, now() - $4::interval)
+          AND ($5::varchar IS NULL OR prompt_id = $5)
+          AND count > 0
+        ORDER BY bucket_ts DESC
+    """, bucket, model, BUCKETS[bucket][0], window, prompt_id)
+
+    def _float(value) -> Optional[float]:
+        return float(value) if value is not None else None
+
+    def _mean(total, count) -> Optional[float]:
+        return float(total) / count if total is not None and count else None
+
+    history = []
+    for row in rows:
+        count = row["count"]
+        point = {
+            "ts_ms": int(row["bucket_ts"].timestamp() * 1000),
+            "provider": row["provider"],
+            "model": row["model"],
+            "prompt_id": row["prompt_id"],
+            "latency_s": _mean(row["latency_sum"], count),
+            "tps": _mean(row["tps_sum"], count),
+            "cost_usd": _mean(row["cost_sum"], count),
+            "in_tokens": round(row["in_tokens_sum"] / count) if row["in_tokens_sum"] is not None else None,
+            "out_tokens": round(row["out_tokens_sum"] / count) if row["out_tokens_sum"] is not None else None,
+            "count": count,
+            "latency_min": _float(row["latency_min"]),
+            "latency_max": _float(row["latency_max"]),
+            "tps_min": _float(row["tps_min"]),
+            "tps_max": _float(row["tps_max"]),
+            "cost_min": _float(row["cost_min"]),
+            "cost_max": _float(row["cost_max"]),
+        }
+        # Means over the bucket's streamed probes (None when none streamed)
+        for metric in STREAM_METRICS:
+            point[metric] = _mean(row[f"{metric}_sum"], row[f"{metric}_count"])
+            point[f"{metric}_min"] = _float(row[f"{metric}_min"])
+            point[f"{metric}_max"] = _float(row[f"{metric}_max"])
+        history.append(point)
+    return history
+
+
+async def _main(days: Optional[int]) -> None:
+    await init_pool()
+    try:
+        written = await rebuild_rollups(timedelta(days=days) if days else None)
+        print(f"Rebuilt {written} rollup bucket(s)")
+    finally:
+        await close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Results rollup maintenance')
+    parser.add_argument('--rebuild', action='store_true', required=True,
+                        help='Recompute rollups from raw results')
+    parser.add_argument('--days', type=int, help='Only rebuild the last N days')
+    args = parser.parse_args()
+
+    asyncio.run(_main(args.days))
@@ -0,0 +1,187 @@
+"""
+Multi-sample probe runs with warm-up and robust per-run statistics.
+
+One request per model is noisy: a slow TLS handshake or a queueing blip
+looks like a regression. A run instead sends PROBE_WARMUP discarded calls
+and then PROBE_SAMPLES measured calls per model, PROBE_SPACING_S apart.
+Every sample is stored in results under a shared run_id, and each
+(run, model, prompt) gets one run_summaries row with the median, IQR and
+trimmed mean of its metrics.
+"""
+
+import asyncio
+import os
+import uuid
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import asyncpg
+
+from db import get_pool
+from prompts import DEFAULT_PROMPT_ID
+from stats import percentile
+
+PROBE_SAMPLES = max(1, int(os.environ.get("PROBE_SAMPLES", "1")))
+PROBE_WARMUP = max(0, int(os.environ.get("PROBE_WARMUP", "0")))
+PROBE_SPACING_S = max(0.0, float(os.environ.get("PROBE_SPACING_S", "0")))
+# Fraction of samples dropped from each end before averaging
+TRIM_FRACTION = min(0.49, max(0.0, float(os.environ.get("PROBE_TRIM_FRACTION", "0.2"))))
+
+# Per-sample metrics summarised for each run (cost_mtok is derived)
+SUMMARY_METRICS = ("latency_s", "tps", "cost_usd", "cost_mtok", "ttft_s")
+SUMMARY_STATS = ("median", "iqr", "trimmed_mean")
+
+
+def new_run_id() -> str:
+    """Identifier shared by every sample of one run"""
+    return uuid.uuid4().hex
+
+
+def robust_summary(values: List[float], trim: float = TRIM_FRACTION) -> Dict[str, Optional[float]]:
+    """Median, interquartile range and trimmed mean of a list of samples"""
+    if not values:
+        return {stat: None for stat in SUMMARY_STATS}
+
+    ordered = sorted(values)
+    cut = int(len(ordered) * trim)
+    kept = ordered[cut:len(ordered) - cut]
+
+    return {
+        "median": percentile(ordered, 50),
+        "iqr": percentile(ordered, 75) - percentile(ordered, 25),
+        "trimmed_mean": sum(kept) / len(kept),
+    }
+
+
+def _sample_value(sample: Dict[str, Any], metric: str) -> Optional[float]:
+    if metric == "cost_mtok":
+        tokens = (sample.get("in_tokens") or 0) + (sample.get("out_tokens") or 0)
+        cost = sample.get("cost_usd")
+        return cost / tokens * 1_000_000 if cost and tokens else None
+    return sample.get(metric)
+
+
+async def sample_model(
+    probe: Callable[[], Awaitable[Dict[str, Any]]],
+    run_id: str,
+    samples: int = PROBE_SAMPLES,
+    warmup: int = PROBE_WARMUP,
+    spacing_s: float = PROBE_SPACING_S,
+) -> List[Dict[str, Any]]:
+    """
+    Call probe() warmup + samples times in sequence, spacing_s apart.
+    Warm-up results are discarded; the rest are tagged with run_id and
+    sample_index and returned in order.
+    """
+    results = []
+    for i in range(warmup + samples):
+        if i and spacing_s:
+            await asyncio.sleep(spacing_s)
+
+        result = await probe()
+        if i < warmup:
+            continue
+
+        result["run_id"] = run_id
+        result["sample_index"] = i - warmup
+        results.append(result)
+
+    return results
+
+
+def summarize(samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Robust statistics over one model's samples of one prompt from a run"""
+    ok = [s for s in samples if not s.get("error")]
+    summary = {
+        "run_id": samples[0]["run_id"],
+        "model": samples[0]["model"],
+        "provider": samples[0]["provider"],
+        "display_name": samples[0].get("display_name"),
+        "prompt_id": samples[0].get("prompt_id", DEFAULT_PROMPT_ID),
+        "max_tokens": samples[0].get("max_tokens"),
+        "samples": len(samples),
+        "errors": len(samples) - len(ok),
+    }
+
+    for metric in SUMMARY_METRICS:
+        values = [v for v in (_sample_value(s, metric) for s in ok) if v is not None]
+        for stat, value in robust_summary(values).items():
+            summary[f"{metric}_{stat}"] = round(value, 6) if value is not None else None
+
+    return summary
+
+
+def _summary_columns() -> List[str]:
+    return [f"{metric}_{stat}" for metric in SUMMARY_METRICS for stat in SUMMARY_STATS]
+
+
+async def insert_run_summaries(conn: asyncpg.Connection, summaries: List[Dict[str, Any]]) -> None:
+    """Insert run summaries on conn (inside the caller's transaction)"""
+    if not summaries:
+        return
+
+    columns = _summary_columns()
+    placeholders = ", ".join(f"${i}::numeric[]" for i in range(8, 8 + len(columns)))
+    await conn.execute(f"""
+        INSERT INTO run_summaries
+            (run_id, model, provider, prompt_id, max_tokens, samples, errors, {", ".join(columns)})
+        SELECT * FROM unnest(
+            $1::varchar[], $2::varchar[], $3::varchar[], $4::varchar[], $5::integer[],
+            $6::integer[], $7::integer[], {placeholders}
+        )
+        ON CONFLICT (run_id, model, prompt_id) DO NOTHING
+    """,
+        [s["run_id"] for s in summaries],
+        [s["model"] for s in summaries],
+        [s["provider"] for s in summaries],
+        [s["prompt_id"] for s in summaries],
+        [s["max_tokens"] for s in summaries],
+        [s["samples"] for s in summaries],
+        [s["errors"] for s in summaries],
+        *([s[column] for s in summaries] for column in columns),
+    )
+
+
+async def fetch_run_summaries(
+    model: Optional[str],
+    window: timedelta,
+    prompt_id: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Per-run summaries in the window, newest first, shaped like history rows:
+    latency_s/tps/cost_usd/ttft_s carry the run median, with the IQR and
+    trimmed mean alongside.
+    """
+    rows = await get_pool().fetch(f"""
+        SELECT ts, run_id, provider, model, prompt_id, max_tokens, samples, errors,
+               {", ".join(_summary_columns())}
+        FROM run_summaries
+        WHERE ($1::varchar IS NULL OR model = $1)
+          AND ts >= now() - $2::interval
+          AND ($3::varchar IS NULL OR prompt_id = $3)
+          AND latency_s_median IS NOT NULL
+        ORDER BY ts DESC
+    """, model, window, prompt_id)
+
+    def _float(value) -> Optional[float]:
+        return float(value) if value is not None else None
+
+    history = []
+    for row in rows:
+        point = {
+            "ts_ms": int(row["ts"].timestamp() * 1000),
+            "run_id": row["run_id"],
+            "provider": row["provider"],
+            "model": row["model"],
+            "prompt_id": row["prompt_id"],
+            "max_tokens": row["max_tokens"],
+            "samples": row["samples"],
+            "errors": row["errors"],
+        }
+        for metric in SUMMARY_METRICS:
+            point[metric] = _float(row[f"{metric}_median"])
+            point[f"{metric}_iqr"] = _float(row[f"{metric}_iqr"])
+            point[f"{metric}_trimmed_mean"] = _float(row[f"{metric}_trimmed_mean"])
+        history.append(point)
+
+    return history
@@ -2,51 +2,100 @@
 """
 Scheduler script for running LLM performance tests periodically.
 This script is designed to be run by Replit's Scheduled Deployment feature.
+
+Each model is probed PROBE_SAMPLES times (after PROBE_WARMUP discarded
+calls, PROBE_SPACING_S apart) for every prompt in the PROBE_PROMPTS
+matrix; see sampling.py and prompts.py.
 """
 import asyncio
 import sys
+from db import init_pool, close_pool
+from clients import init_clients, close_clients
 from main import (
-    test_openai,
-    test_anthropic,
-    test_gemini,
-    test_deepseek,
-    insert_result,
+    probe_model,
+    select_models,
+    insert_results,
+    STREAM_PROBES,
+)
+from prompts import PROBE_PROMPTS, parse_matrix
+from sampling import (
+    PROBE_SAMPLES,
+    PROBE_WARMUP,
+    PROBE_SPACING_S,
+    new_run_id,
+    sample_model,
+    summarize,
 )
 
 
+async def sample_matrix(model: str, matrix: list, run_id: str) -> list:
+    """Sample one model on each prompt of the matrix in turn (one list per prompt)"""
+    per_prompt = []
+    for prompt_id, max_tokens in matrix:
+        per_prompt.append(await sample_model(
+            lambda: probe_model(model, STREAM_PROBES, prompt_id, max_tokens), run_id
+        ))
+    return per_prompt
+
+
 async def run_scheduled_tests():
     """Run all LLM tests and insert results into database"""
     print("Starting scheduled LLM performance tests...")
     
     try:
-        # Execute all tests concurrently
-        results = await asyncio.gather(
-            test_openai("gpt-4o-mini"),
-            test_anthropic("claude-3-5-haiku-20241022"),
-            test_gemini("gemini-2.0-flash-exp"),
-            test_deepseek("deepseek-chat"),
+        await init_pool()
+        await init_clients()
+        
+        run_id = new_run_id()
+        matrix = parse_matrix(PROBE_PROMPTS)
+        print(f"Run {run_id}: {PROBE_SAMPLES} sample(s) per model and prompt, "
+              f"{PROBE_WARMUP} warm-up, {PROBE_SPACING_S}s spacing, "
+              f"prompts {[f'{p}:{n}' for p, n in matrix]}")
+        
+        # Models are sampled concurrently (paced by the provider limiters);
+        # each model's prompts and samples run in sequence
+        model_samples = await asyncio.gather(
+            *(sample_matrix(model, matrix, run_id) for model in select_models(None)),
             return_exceptions=True
         )
         
-        # Process and insert results
+        # Process results
         success_count = 0
         error_count = 0
+        valid_results = []
+        summaries = []
         
-        for result in results:
-            if isinstance(result, dict):
+        prompt_samples = []
+        for per_prompt in model_samples:
+            if isinstance(per_prompt, list):
+                prompt_samples.extend(per_prompt)
+            else:
+                error_count += 1
+                print(f"Unexpected error: {per_prompt}")
+        
+        for samples in prompt_samples:
+            for result in samples:
                 if result.get("error"):
                     error_count += 1
-                    print(f"Error testing {result['display_name']}: {result['error']}")
+                    print(f"Error testing {result['display_name']} [{result['prompt_id']}]: {result['error']}")
                 else:
                     success_count += 1
-                    print(f"✓ {result['display_name']}: {result['latency_s']}s, "
-                          f"{result['tps']} tok/s, ${result['cost_usd']}")
+                    print(f"✓ {result['display_name']} [{result['prompt_id']}]: {result['latency_s']}s, "
+                          f"{result['in_tokens']} in, {result['tps']} tok/s, ${result['cost_usd']}")
                 
-                # Insert into database
-                await asyncio.to_thread(insert_result, result)
-            else:
-                error_count += 1
-                print(f"Unexpected error: {result}")
+                valid_results.append(result)
+            
+            if samples:
+                summary = summarize(samples)
+                summaries.append(summary)
+                if summary["latency_s_median"] is not None:
+                    print(f"  {summary['display_name']} [{summary['prompt_id']}] median: "
+                          f"{summary['latency_s_median']}s (IQR {summary['latency_s_iqr']}s), {summary['tps_median']} tok/s "
+                          f"over {summary['samples'] - summary['errors']}/{summary['samples']} sample(s)")
+        
+        # Insert the whole run in one transaction
+        ids = await insert_results(valid_results, summaries)
+        print(f"Stored {len(ids)} result(s)")
         
         print(f"\nCompleted: {success_count} successful, {error_count} errors")
         return success_count > 0
@@ -54,6 +103,9 @@ async def run_scheduled_tests():
     except Exception as e:
         print(f"Fatal error during scheduled tests: {e}")
         return False
+    finally:
+        await close_clients()
+        await close_pool()
 
 
 if __name__ == "__main__":
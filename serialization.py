@@ -0,0 +1,37 @@
+"""
+JSON encoding for API responses, event streams and shared state.
+
+Uses orjson, a declared dependency (several times faster on large history
+payloads); the standard library is only a fallback for environments where
+it failed to install. Values that are not JSON types (datetimes,
+Decimals) are encoded as strings.
+"""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # should not happen: orjson is in pyproject.toml
+    orjson = None
+
+HAS_ORJSON = orjson is not None
+
+
+def dumps(data: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(data, default=str)
+
+
+def dumps_bytes(data: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, default=str).encode()
+
+
+def loads(text: str) -> Any:
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
@@ -1,5 +1,5 @@
 import { sql } from 'drizzle-orm'
-import { pgTable, text, varchar, integer, timestamp, numeric, boolean, jsonb, pgEnum, index } from 'drizzle-orm/pg-core'
+import { pgTable, text, varchar, integer, bigint, timestamp, numeric, boolean, jsonb, pgEnum, index, primaryKey } from 'drizzle-orm/pg-core'
 import { relations } from 'drizzle-orm'
 
 // Session storage table
@@ -47,8 +47,185 @@ export const results = pgTable('results', {
   inTokens: integer('in_tokens'),
   outTokens: integer('out_tokens'),
   error: text('error'),
+  // Streaming probe metrics (null for non-streaming probes)
+  streamed: boolean('streamed').default(false).notNull(),
+  ttftS: numeric('ttft_s'),
+  decodeTps: numeric('decode_tps'),
+  itlP50S: numeric('itl_p50_s'),
+  itlP95S: numeric('itl_p95_s'),
+  itlP99S: numeric('itl_p99_s'),
+  // Multi-sample runs: samples of one scheduled run share a run_id
+  runId: varchar('run_id'),
+  sampleIndex: integer('sample_index'),
+  // Prompt corpus entry and output cap used by the probe (see prompts.py)
+  promptId: varchar('prompt_id').default('default').notNull(),
+  maxTokens: integer('max_tokens'),
+}, (table) => ({
+  // Range scans per model (history, stats, alert windows)
+  modelTsIdx: index('results_model_ts_idx').on(table.model, table.ts),
+  tsIdx: index('results_ts_idx').on(table.ts),
+  runIdIdx: index('results_run_id_idx').on(table.runId),
+}))
+
+// Robust per-run statistics for multi-sample runs, one row per run, model and prompt
+// (median, IQR and trimmed mean of each metric; see sampling.py)
+export const runSummaries = pgTable(
+  'run_summaries',
+  {
+    runId: varchar('run_id').notNull(),
+    model: varchar('model').notNull(),
+    provider: varchar('provider').notNull(),
+    promptId: varchar('prompt_id').default('default').notNull(),
+    maxTokens: integer('max_tokens'),
+    ts: timestamp('ts', { withTimezone: true }).defaultNow().notNull(),
+    samples: integer('samples').notNull(),
+    errors: integer('errors').default(0).notNull(),
+    latencySMedian: numeric('latency_s_median'),
+    latencySIqr: numeric('latency_s_iqr'),
+    latencySTrimmedMean: numeric('latency_s_trimmed_mean'),
+    tpsMedian: numeric('tps_median'),
+    tpsIqr: numeric('tps_iqr'),
+    tpsTrimmedMean: numeric('tps_trimmed_mean'),
+    costUsdMedian: numeric('cost_usd_median'),
+    costUsdIqr: numeric('cost_usd_iqr'),
+    costUsdTrimmedMean: numeric('cost_usd_trimmed_mean'),
+    costMtokMedian: numeric('cost_mtok_median'),
+    costMtokIqr: numeric('cost_mtok_iqr'),
+    costMtokTrimmedMean: numeric('cost_mtok_trimmed_mean'),
+    ttftSMedian: numeric('ttft_s_median'),
+    ttftSIqr: numeric('ttft_s_iqr'),
+    ttftSTrimmedMean: numeric('ttft_s_trimmed_mean'),
+  },
+  (table) => ({
+    pk: primaryKey({ columns: [table.runId, table.model, table.promptId] }),
+    modelTsIdx: index('run_summaries_model_ts_idx').on(table.model, table.ts),
+  })
+);
+
+// Pre-aggregated results per model, prompt and time bucket ('1m', '1h', '1d'),
+// maintained by the FastAPI backend on insert (see rollups.py)
+export const resultsRollups = pgTable(
+  'results_rollups',
+  {
+    bucket: varchar('bucket').notNull(),
+    bucketTs: timestamp('bucket_ts', { withTimezone: true }).notNull(),
+    model: varchar('model').notNull(),
+    promptId: varchar('prompt_id').default('default').notNull(),
+    provider: varchar('provider').notNull(),
+    count: integer('count').default(0).notNull(),
+    errorCount: integer('error_count').default(0).notNull(),
+    latencyMin: numeric('latency_min'),
+    latencyMax: numeric('latency_max'),
+    latencySum: numeric('latency_sum'),
+    tpsMin: numeric('tps_min'),
+    tpsMax: numeric('tps_max'),
+    tpsSum: numeric('tps_sum'),
+    costMin: numeric('cost_min'),
+    costMax: numeric('cost_max'),
+    costSum: numeric('cost_sum'),
+    // Streaming-only metrics (ttft, decode, inter-token latency): own counts, as they are null for non-streamed probes
+    ttftSCount: integer('ttft_s_count').default(0).notNull(),
+    ttftSMin: numeric('ttft_s_min'),
+    ttftSMax: numeric('ttft_s_max'),
+    ttftSSum: numeric('ttft_s_sum'),
+    decodeTpsCount: integer('decode_tps_count').default(0).notNull(),
+    decodeTpsMin: numeric('decode_tps_min'),
+    decodeTpsMax: numeric('decode_tps_max'),
+    decodeTpsSum: numeric('decode_tps_sum'),
+    itlP50SCount: integer('itl_p50_s_count').default(0).notNull(),
+    itlP50SMin: numeric('itl_p50_s_min'),
+    itlP50SMax: numeric('itl_p50_s_max'),
+    itlP50SSum: numeric('itl_p50_s_sum'),
+    itlP95SCount: integer('itl_p95_s_count').default(0).notNull(),
+    itlP95SMin: numeric('itl_p95_s_min'),
+    itlP95SMax: numeric('itl_p95_s_max'),
+    itlP95SSum: numeric('itl_p95_s_sum'),
+    itlP99SCount: integer('itl_p99_s_count').default(0).notNull(),
+    itlP99SMin: numeric('itl_p99_s_min'),
+    itlP99SMax: numeric('itl_p99_s_max'),
+    itlP99SSum: numeric('itl_p99_s_sum'),
+    inTokensSum: bigint('in_tokens_sum', { mode: 'number' }),
+    outTokensSum: bigint('out_tokens_sum', { mode: 'number' }),
+  },
+  (table) => ({
+    pk: primaryKey({ columns: [table.bucket, table.model, table.promptId, table.bucketTs] }),
+    bucketTsIdx: index('results_rollups_bucket_ts_idx').on(table.bucket, table.bucketTs),
+  })
+);
+
+// Hourly running aggregates per model for incremental alert evaluation,
+// maintained by alert_scheduler.py (see alert_state.py)
+export const alertMetricBuckets = pgTable(
+  'alert_metric_buckets',
+  {
+    model: varchar('model').notNull(),
+    bucketTs: timestamp('bucket_ts', { withTimezone: true }).notNull(),
+    count: integer('count').default(0).notNull(),
+    errorCount: integer('error_count').default(0).notNull(),
+    latencyMax: numeric('latency_max'),
+    tpsSum: numeric('tps_sum'),
+    tpsCount: integer('tps_count').default(0).notNull(),
+    tpsMin: numeric('tps_min'),
+    costMtokMax: numeric('cost_mtok_max'),
+  },
+  (table) => ({
+    pk: primaryKey({ columns: [table.model, table.bucketTs] }),
+    bucketTsIdx: index('alert_metric_buckets_bucket_ts_idx').on(table.bucketTs),
+  })
+);
+
+// Settled marks for incremental consumers: results stamped before settled_until
+// are final (see alert_state.py)
+export const alertWatermarks = pgTable('alert_watermarks', {
+  name: varchar('name').primaryKey(),
+  settledUntil: timestamp('settled_until', { withTimezone: true }),
+  updatedAt: timestamp('updated_at', { withTimezone: true }).defaultNow().notNull(),
 })
 
+// Concurrency-sweep load tests: one row per sweep, model and concurrency level
+// (saturation curves, written by loadtest.py)
+export const loadTestResults = pgTable(
+  'load_test_results',
+  {
+    id: integer('id').primaryKey().generatedAlwaysAsIdentity(),
+    sweepId: varchar('sweep_id').notNull(),
+    ts: timestamp('ts', { withTimezone: true }).defaultNow().notNull(),
+    model: varchar('model').notNull(),
+    provider: varchar('provider').notNull(),
+    streamed: boolean('streamed').default(false).notNull(),
+    concurrency: integer('concurrency').notNull(),
+    requests: integer('requests').notNull(),
+    successes: integer('successes').notNull(),
+    errors: integer('errors').notNull(),
+    rateLimited: integer('rate_limited').default(0).notNull(),
+    durationS: numeric('duration_s'),
+    rps: numeric('rps'),
+    tokensPerS: numeric('tokens_per_s'),
+    latencyP50S: numeric('latency_p50_s'),
+    latencyP95S: numeric('latency_p95_s'),
+    latencyP99S: numeric('latency_p99_s'),
+    ttftP50S: numeric('ttft_p50_s'),
+  },
+  (table) => ({
+    sweepIdx: index('load_test_results_sweep_idx').on(table.sweepId, table.model, table.concurrency),
+    modelTsIdx: index('load_test_results_model_ts_idx').on(table.model, table.ts),
+  })
+);
+
+// USD-based FX rates shared by every API worker and scheduler process (see fx.py)
+export const fxRates = pgTable(
+  'fx_rates',
+  {
+    base: varchar('base').notNull(),
+    currency: varchar('currency').notNull(),
+    rate: numeric('rate').notNull(),
+    fetchedAt: timestamp('fetched_at', { withTimezone: true }).notNull(),
+  },
+  (table) => ({
+    pk: primaryKey({ columns: [table.base, table.currency] }),
+  })
+);
+
 // Alert types enum
 export const alertTypeEnum = pgEnum('alert_type', [
   'latency',
@@ -99,7 +276,12 @@ export const emailEvents = pgTable('email_events', {
   sentAt: timestamp('sent_at').defaultNow().notNull(),
   status: text('status').notNull(),
   payload: jsonb('payload'),
-})
+}, (table) => ({
+  // Last-sent lookups per alert in the alert scheduler
+  alertSentAtIdx: index('email_events_alert_sent_at_idx').on(table.alertId, table.sentAt),
+  // Coalesced per-user emails list every covered alert in payload.alert_ids
+  alertIdsIdx: index('email_events_alert_ids_idx').using('gin', sql`(${table.payload} -> 'alert_ids')`),
+}))
 
 // Relations
 export const usersRelations = relations(users, ({ many, one }) => ({
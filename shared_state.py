@@ -0,0 +1,342 @@
+"""
+Pluggable key-value state shared by API workers (response cache, job
+queue).
+
+PULSE_STATE_BACKEND picks the implementation:
+- memory: per-process dicts, the default for a single worker.
+- sqlite: one WAL-mode SQLite file (PULSE_STATE_PATH) that every worker
+  process on the host opens.
+
+With several workers behind one port, every process must see the same
+cache generations, job snapshots and single-flight claims, so serving with
+PULSE_WORKERS > 1 selects sqlite unless told otherwise.
+
+Values are JSON. Keys are any JSON-encodable value (cache keys are tuples
+and come back as tuples). Entries expire after their TTL. Each namespace
+also has a generation counter: bumping it tells other processes to drop
+their in-memory copies, and set() can be made conditional on it so a load
+that raced with an invalidation is not stored.
+
+The interface is async. SQLite calls run on one dedicated thread per
+process, in order, so a write blocked on another process's lock waits
+there instead of stalling the event loop.
+"""
+
+import abc
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from serialization import dumps, loads
+
+try:
+    import fcntl
+except ImportError:  # not on Windows
+    fcntl = None
+
+STATE_BACKEND = os.environ.get("PULSE_STATE_BACKEND", "memory").lower()
+STATE_PATH = os.environ.get(
+    "PULSE_STATE_PATH", os.path.join(tempfile.gettempdir(), "pulse_state.sqlite3")
+)
+# Expired rows are swept every this many writes
+_PURGE_EVERY = 256
+
+# Lock on <state file>.lock held by the serving process (see reset_state_file)
+_holder_lock = None
+
+
+def _encode_key(key: Hashable) -> str:
+    return dumps(key)
+
+
+def _decode_key(text: str) -> Hashable:
+    key = loads(text)
+    return tuple(key) if isinstance(key, list) else key
+
+
+class StateBackend(abc.ABC):
+    """Interface for shared state; see the module docstring for semantics"""
+
+    name = "base"
+
+    @abc.abstractmethod
+    async def get(self, namespace: str, key: Hashable) -> Optional[Any]:
+        """Value for key, or None if missing or expired"""
+
+    @abc.abstractmethod
+    async def set(
+        self, namespace: str, key: Hashable, value: Any, ttl_s: float, generation: Optional[int] = None
+    ) -> bool:
+        """Store value; when generation is given, only if it is still current. Returns whether stored"""
+
+    @abc.abstractmethod
+    async def add(self, namespace: str, key: Hashable, value: Any, ttl_s: float) -> Any:
+        """Store value unless a live entry exists; returns the entry's value either way"""
+
+    @abc.abstractmethod
+    async def delete(self, namespace: str, key: Hashable, value: Optional[Any] = None) -> None:
+        """Remove key if present (when value is given, only while it still holds that value)"""
+
+    @abc.abstractmethod
+    async def delete_where(self, namespace: str, predicate: Optional[Callable[[Hashable], bool]] = None) -> int:
+        """Delete entries whose key matches predicate (all when None); returns the count"""
+
+    @abc.abstractmethod
+    async def generation(self, namespace: str) -> int:
+        """The namespace's current generation (0 until first bumped)"""
+
+    @abc.abstractmethod
+    async def bump_generation(self, namespace: str) -> int:
+        """Increment the namespace's generation; returns the new value"""
+
+
+class MemoryBackend(StateBackend):
+    """Per-process state: correct for one worker, not shared"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._entries: Dict[Tuple[str, Hashable], Tuple[float, Any]] = {}
+        self._generations: Dict[str, int] = {}
+
+    def _live(self, namespace: str, key: Hashable) -> Optional[Tuple[float, Any]]:
+        entry = self._entries.get((namespace, key))
+        if entry is not None and entry[0] < time.time():
+            del self._entries[(namespace, key)]
+            return None
+        return entry
+
+    async def get(self, namespace, key):
+        entry = self._live(namespace, key)
+        return entry[1] if entry is not None else None
+
+    async def set(self, namespace, key, value, ttl_s, generation=None):
+        if generation is not None and generation != self._generations.get(namespace, 0):
+            return False
+        self._entries[(namespace, key)] = (time.time() + ttl_s, value)
+        return True
+
+    async def add(self, namespace, key, value, ttl_s):
+        entry = self._live(namespace, key)
+        if entry is not None:
+            return entry[1]
+        self._entries[(namespace, key)] = (time.time() + ttl_s, value)
+        return value
+
+    async def delete(self, namespace, key, value=None):
+        entry = self._entries.get((namespace, key))
+        if entry is not None and (value is None or entry[1] == value):
+            del self._entries[(namespace, key)]
+
+    async def delete_where(self, namespace, predicate=None):
+        doomed = [
+            entry_key for entry_key in self._entries
+            if entry_key[0] == namespace and (predicate is None or predicate(entry_key[1]))
+        ]
+        for entry_key in doomed:
+            del self._entries[entry_key]
+        return len(doomed)
+
+    async def generation(self, namespace):
+        return self._generations.get(namespace, 0)
+
+    async def bump_generation(self, namespace):
+        self._generations[namespace] = self._generations.get(namespace, 0) + 1
+        return self._generations[namespace]
+
+
+class SQLiteBackend(StateBackend):
+    """State in one SQLite file shared by every process on the host"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = STATE_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._writes = 0
+
+    async def _run(self, fn: Callable, *args: Any) -> Any:
+        """Call fn on this process's state thread (recreated after a fork)"""
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pulse-state")
+            self._conn, self._pid = None, os.getpid()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _db(self) -> sqlite3.Connection:
+        """The state thread's connection"""
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS generations (
+                    namespace TEXT PRIMARY KEY,
+                    generation INTEGER NOT NULL
+                );
+            """)
+            self._conn = conn
+        return self._conn
+
+    def _wrote(self) -> None:
+        self._writes += 1
+        if self._writes % _PURGE_EVERY == 0:
+            self._db().execute("DELETE FROM entries WHERE expires_at < ?", (time.time(),))
+
+    async def get(self, namespace, key):
+        return await self._run(self._get, namespace, key)
+
+    def _get(self, namespace, key):
+        row = self._db().execute(
+            "SELECT value FROM entries WHERE namespace = ? AND key = ? AND expires_at >= ?",
+            (namespace, _encode_key(key), time.time()),
+        ).fetchone()
+        return loads(row[0]) if row else None
+
+    async def set(self, namespace, key, value, ttl_s, generation=None):
+        return await self._run(self._set, namespace, key, value, ttl_s, generation)
+
+    def _set(self, namespace, key, value, ttl_s, generation):
+        params = (namespace, _encode_key(key), dumps(value), time.time() + ttl_s)
+        if generation is None:
+            cursor = self._db().execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                params,
+            )
+        else:
+            # Check and write in one statement so an invalidation cannot slip in between
+            cursor = self._db().execute("""
+                INSERT OR REPLACE INTO entries (namespace, key, value, expires_at)
+                SELECT ?, ?, ?, ?
+                WHERE COALESCE((SELECT generation FROM generations WHERE namespace = ?), 0) = ?
+            """, (*params, namespace, generation))
+        self._wrote()
+        return cursor.rowcount > 0
+
+    async def add(self, namespace, key, value, ttl_s):
+        return await self._run(self._add, namespace, key, value, ttl_s)
+
+    def _add(self, namespace, key, value, ttl_s):
+        conn = self._db()
+        encoded = _encode_key(key)
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM entries WHERE namespace = ? AND key = ? AND expires_at < ?",
+                (namespace, encoded, now),
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, encoded, dumps(value), now + ttl_s),
+            )
+            row = conn.execute(
+                "SELECT value FROM entries WHERE namespace = ? AND key = ?", (namespace, encoded)
+            ).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._wrote()
+        return loads(row[0])
+
+    async def delete(self, namespace, key, value=None):
+        return await self._run(self._delete, namespace, key, value)
+
+    def _delete(self, namespace, key, value):
+        if value is None:
+            self._db().execute(
+                "DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, _encode_key(key))
+            )
+        else:
+            self._db().execute(
+                "DELETE FROM entries WHERE namespace = ? AND key = ? AND value = ?",
+                (namespace, _encode_key(key), dumps(value)),
+            )
+
+    async def delete_where(self, namespace, predicate=None):
+        return await self._run(self._delete_where, namespace, predicate)
+
+    def _delete_where(self, namespace, predicate):
+        conn = self._db()
+        if predicate is None:
+            return conn.execute("DELETE FROM entries WHERE namespace = ?", (namespace,)).rowcount
+
+        keys = [row[0] for row in conn.execute("SELECT key FROM entries WHERE namespace = ?", (namespace,))]
+        doomed = [(namespace, key) for key in keys if predicate(_decode_key(key))]
+        conn.executemany("DELETE FROM entries WHERE namespace = ? AND key = ?", doomed)
+        return len(doomed)
+
+    async def generation(self, namespace):
+        return await self._run(self._generation, namespace)
+
+    def _generation(self, namespace):
+        row = self._db().execute(
+            "SELECT generation FROM generations WHERE namespace = ?", (namespace,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    async def bump_generation(self, namespace):
+        return await self._run(self._bump_generation, namespace)
+
+    def _bump_generation(self, namespace):
+        return self._db().execute("""
+            INSERT INTO generations (namespace, generation) VALUES (?, 1)
+            ON CONFLICT (namespace) DO UPDATE SET generation = generation + 1
+            RETURNING generation
+        """, (namespace,)).fetchone()[0]
+
+
+BACKENDS = {"memory": MemoryBackend, "sqlite": SQLiteBackend}
+
+_backend: Optional[StateBackend] = None
+
+
+def get_state_backend() -> StateBackend:
+    """The process-wide backend named by PULSE_STATE_BACKEND"""
+    global _backend
+
+    if _backend is None:
+        if STATE_BACKEND not in BACKENDS:
+            raise ValueError(f"PULSE_STATE_BACKEND must be one of {', '.join(BACKENDS)}")
+        _backend = BACKENDS[STATE_BACKEND]()
+    return _backend
+
+
+def reset_state_file(path: str = STATE_PATH) -> bool:
+    """
+    Remove the SQLite state left by a previous server run (call before
+    starting workers). Takes an exclusive lock on path + ".lock" and keeps it
+    for the life of the process; if another server holds it, the file is in
+    use and is left alone. Returns whether the state was reset.
+    """
+    global _holder_lock
+
+    if fcntl is not None and _holder_lock is None:
+        lock_file = open(path + ".lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            print(f"State file {path} is in use by another server, keeping it")
+            return False
+        _holder_lock = lock_file
+
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+    return True
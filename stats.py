@@ -0,0 +1,87 @@
+"""
+Server-side percentile summaries of latency, TPS and cost per model and
+prompt. TTFT (prefill) and decode TPS are summarised separately, with mean
+input/output token counts, so prompt sizes can be compared per model.
+
+Percentiles are computed in Postgres with percentile_cont over the
+(model, ts) index, so only one row per model leaves the database.
+percentile() is the in-process equivalent for samples already in memory
+(stream timings, load-test levels, multi-sample runs).
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from db import get_pool
+
+PERCENTILES = (0.5, 0.9, 0.95, 0.99)
+METRICS = ("latency_s", "tps", "cost_usd", "ttft_s", "decode_tps")
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Linear-interpolated percentile (pct in 0-100) of an unsorted list, like percentile_cont"""
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+async def percentile_summary(
+    model: Optional[str],
+    window: timedelta,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    prompt_id: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    p50/p90/p95/p99 of latency, TPS, cost, TTFT and decode TPS per model and
+    prompt for successful runs.
+    The window is [start, end) when given, otherwise the last `window`.
+    """
+    rows = await get_pool().fetch("""
+        SELECT model,
+               prompt_id,
+               min(provider) AS provider,
+               count(*) AS samples,
+               avg(in_tokens)::float8 AS in_tokens_avg,
+               avg(out_tokens)::float8 AS out_tokens_avg,
+               percentile_cont($1::float8[]) WITHIN GROUP (ORDER BY latency_s::float8) AS latency_s,
+               percentile_cont($1::float8[]) WITHIN GROUP (ORDER BY tps::float8) AS tps,
+               percentile_cont($1::float8[]) WITHIN GROUP (ORDER BY cost_usd::float8) AS cost_usd,
+               percentile_cont($1::float8[]) WITHIN GROUP (ORDER BY ttft_s::float8) AS ttft_s,
+               percentile_cont($1::float8[]) WITHIN GROUP (ORDER BY decode_tps::float8) AS decode_tps
+        FROM results
+        WHERE ts >= COALESCE($2::timestamptz, now() - $3::interval)
+          AND ts < COALESCE($4::timestamptz, now())
+          AND ($5::varchar IS NULL OR model = $5)
+          AND ($6::varchar IS NULL OR prompt_id = $6)
+          AND error IS NULL
+        GROUP BY model, prompt_id
+        ORDER BY model, prompt_id
+    """, list(PERCENTILES), start, window, end, model, prompt_id)
+
+    def _label(pct: float) -> str:
+        return f"p{round(pct * 100)}"
+
+    summary = []
+    for row in rows:
+        entry = {
+            "model": row["model"],
+            "prompt_id": row["prompt_id"],
+            "provider": row["provider"],
+            "samples": row["samples"],
+            "in_tokens_avg": round(row["in_tokens_avg"], 1) if row["in_tokens_avg"] is not None else None,
+            "out_tokens_avg": round(row["out_tokens_avg"], 1) if row["out_tokens_avg"] is not None else None,
+        }
+        for metric in METRICS:
+            values = row[metric] or [None] * len(PERCENTILES)
+            entry[metric] = {
+                _label(pct): (round(value, 6) if value is not None else None)
+                for pct, value in zip(PERCENTILES, values)
+            }
+        summary.append(entry)
+    return summary
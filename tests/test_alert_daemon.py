@@ -0,0 +1,208 @@
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("sib_api_v3_sdk")
+
+import alert_daemon  # noqa: E402
+from alert_daemon import AlertDaemon  # noqa: E402
+
+
+def _alert(alert_id, model, cadence="1h", last_sent_at=None):
+    return {
+        "id": alert_id, "user_id": "u", "type": "latency", "model": model, "threshold": 1.0,
+        "window": "1h", "cadence": cadence, "last_sent_at": last_sent_at,
+    }
+
+
+def _definitions(alerts):
+    return {a["id"]: tuple(a[f] for f in alert_daemon.DEFINITION_FIELDS) for a in alerts}
+
+
+@pytest.fixture
+def alerts(monkeypatch):
+    """Alerts served by a stubbed get_active_alerts"""
+    rows = {}
+
+    async def get_active_alerts(alert_ids=None):
+        return [rows[i] for i in (alert_ids if alert_ids is not None else rows) if i in rows]
+
+    monkeypatch.setattr(alert_daemon, "get_active_alerts", get_active_alerts)
+    return rows
+
+
+def _notify(daemon, model):
+    daemon._on_results(None, 0, alert_daemon.RESULTS_CHANNEL, json.dumps({"model": model, "max_id": 1}))
+
+
+def test_notifications_are_debounced_into_one_evaluation(monkeypatch, alerts):
+    monkeypatch.setattr(alert_daemon, "DEBOUNCE_S", 0.05)
+    alerts.update({1: _alert(1, "a"), 2: _alert(2, "b"), 3: _alert(3, "c")})
+    evaluated = []
+
+    async def evaluate_alerts(batch):
+        evaluated.append(sorted(a["id"] for a in batch))
+        return []
+
+    monkeypatch.setattr(alert_daemon, "evaluate_alerts", evaluate_alerts)
+
+    async def run():
+        daemon = AlertDaemon(listen=True)
+        daemon._definitions = _definitions(alerts.values())
+        for model in ("a", "b", "a"):
+            _notify(daemon, model)
+            await asyncio.sleep(0.01)
+        await daemon._flush_task
+
+    asyncio.run(run())
+    assert evaluated == [[1, 2]]
+
+
+def test_notification_during_evaluation_is_not_dropped(monkeypatch, alerts):
+    monkeypatch.setattr(alert_daemon, "DEBOUNCE_S", 0.02)
+    alerts.update({1: _alert(1, "a"), 2: _alert(2, "b")})
+    evaluated = []
+
+    async def run():
+        daemon = AlertDaemon(listen=True)
+        daemon._definitions = _definitions(alerts.values())
+
+        async def evaluate_alerts(batch):
+            evaluated.append(sorted(a["id"] for a in batch))
+            if len(evaluated) == 1:
+                # Results for another model land while the first batch is evaluating
+                _notify(daemon, "b")
+                await asyncio.sleep(0.05)
+            return []
+
+        monkeypatch.setattr(alert_daemon, "evaluate_alerts", evaluate_alerts)
+        _notify(daemon, "a")
+        await asyncio.wait_for(daemon._flush_task, timeout=2)
+
+    asyncio.run(run())
+    assert evaluated == [[1], [2]]
+
+
+def test_alerts_for_all_models_follow_every_notification(monkeypatch, alerts):
+    monkeypatch.setattr(alert_daemon, "DEBOUNCE_S", 0.01)
+    alerts.update({1: _alert(1, None), 2: _alert(2, "b")})
+    evaluated = []
+
+    async def evaluate_alerts(batch):
+        evaluated.append(sorted(a["id"] for a in batch))
+        return []
+
+    monkeypatch.setattr(alert_daemon, "evaluate_alerts", evaluate_alerts)
+
+    async def run():
+        daemon = AlertDaemon(listen=True)
+        daemon._definitions = _definitions(alerts.values())
+        _notify(daemon, "a")
+        await daemon._flush_task
+
+    asyncio.run(run())
+    assert evaluated == [[1]]
+
+
+def _due(daemon):
+    """Live heap entries as {alert_id: due_ts}"""
+    return {
+        alert_id: due for due, alert_id, version in daemon._heap
+        if daemon._versions.get(alert_id) == version
+    }
+
+
+def test_reload_schedules_new_alerts_and_forgets_removed(monkeypatch, alerts):
+    sent = datetime.now() - timedelta(minutes=30)
+    alerts.update({1: _alert(1, "a"), 2: _alert(2, "b", cadence="1h", last_sent_at=sent)})
+
+    async def run():
+        daemon = AlertDaemon()
+        fingerprints = iter(["v1", "v1", "v2"])
+
+        async def fetch_fingerprint():
+            return next(fingerprints)
+
+        daemon._fetch_fingerprint = fetch_fingerprint
+        await daemon.reload()
+        first = _due(daemon)
+        await daemon.reload()  # unchanged fingerprint: nothing to do
+        del alerts[2]
+        await daemon.reload()
+        return first, _due(daemon), daemon._definitions
+
+    start = time.time()
+    first, after, definitions = asyncio.run(run())
+    assert first[1] == pytest.approx(start, abs=1)
+    # Not due until its cadence since the last email has passed
+    assert first[2] == pytest.approx(start + 30 * 60, abs=2)
+    assert list(after) == [1]
+    assert list(definitions) == [1]
+
+
+def test_failed_reload_is_retried(monkeypatch, alerts):
+    alerts.update({1: _alert(1, "a")})
+    real_get = alert_daemon.get_active_alerts
+    calls = 0
+
+    async def flaky_get(alert_ids=None):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise ConnectionError("database went away")
+        return await real_get(alert_ids)
+
+    monkeypatch.setattr(alert_daemon, "get_active_alerts", flaky_get)
+
+    async def run():
+        daemon = AlertDaemon()
+
+        async def fetch_fingerprint():
+            return "v1"
+
+        daemon._fetch_fingerprint = fetch_fingerprint
+        with pytest.raises(ConnectionError):
+            await daemon.reload()
+        await daemon.reload()
+        return daemon._definitions
+
+    assert list(asyncio.run(run())) == [1]
+
+
+def test_run_due_reschedules_at_the_evaluation_interval(monkeypatch, alerts):
+    monkeypatch.setattr(alert_daemon, "EVAL_INTERVAL_S", 300)
+    alerts.update({1: _alert(1, "a", cadence="24h"), 2: _alert(2, "b", cadence="4h")})
+
+    async def evaluate_alerts(batch):
+        # Only alert 2 fires and sends an email
+        return [(a, {}) for a in batch if a["id"] == 2]
+
+    monkeypatch.setattr(alert_daemon, "evaluate_alerts", evaluate_alerts)
+
+    async def run():
+        daemon = AlertDaemon()
+        daemon._definitions = _definitions(alerts.values())
+        await daemon.run_due([1, 2])
+        return _due(daemon)
+
+    start = time.time()
+    due = asyncio.run(run())
+    # Not fired: re-checked after the interval, not after its 24h cadence
+    assert due[1] == pytest.approx(start + 300, abs=2)
+    # Just sent: cannot send again before its cadence
+    assert due[2] == pytest.approx(start + 4 * 3600, abs=2)
+
+
+def test_pop_due_skips_superseded_entries():
+    daemon = AlertDaemon()
+    now = time.time()
+    daemon._schedule(1, now - 10)
+    daemon._schedule(1, now + 3600)  # rescheduled: the first entry is stale
+    daemon._schedule(2, now - 5)
+    daemon._schedule(3, now - 1)
+    daemon._forget(3)
+    assert daemon._pop_due() == [2]
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("sib_api_v3_sdk")
+
+import alert_scheduler  # noqa: E402
+from alert_scheduler import check_cadence, is_quiet_hours  # noqa: E402
+
+NOW = datetime(2026, 1, 15, 23, 30)
+
+
+def test_check_cadence_never_sent():
+    assert check_cadence({"cadence": "1h", "last_sent_at": None}, NOW)
+
+
+def test_check_cadence_elapsed():
+    alert = {"cadence": "1h", "last_sent_at": NOW - timedelta(minutes=61)}
+    assert check_cadence(alert, NOW)
+
+
+def test_check_cadence_not_elapsed():
+    alert = {"cadence": "4h", "last_sent_at": NOW - timedelta(hours=3)}
+    assert not check_cadence(alert, NOW)
+
+
+def test_check_cadence_unknown_defaults_to_an_hour():
+    assert not check_cadence({"cadence": "weird", "last_sent_at": NOW - timedelta(minutes=30)}, NOW)
+    assert check_cadence({"cadence": "weird", "last_sent_at": NOW - timedelta(minutes=90)}, NOW)
+
+
+@pytest.fixture
+def frozen_now(monkeypatch):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return NOW
+
+    monkeypatch.setattr(alert_scheduler, "datetime", FrozenDatetime)
+
+
+@pytest.mark.parametrize("quiet_hours, expected", [
+    (None, False),
+    ({}, False),
+    ({"start": "22:00"}, False),
+    ({"start": "22:00", "end": "23:59"}, True),
+    ({"start": "08:00", "end": "17:00"}, False),
+    ({"start": "22:00", "end": "08:00"}, True),  # overnight
+    ({"start": "23:45", "end": "08:00"}, False),
+    ({"start": "bad", "end": "08:00"}, False),
+])
+def test_is_quiet_hours(frozen_now, quiet_hours, expected):
+    assert is_quiet_hours(quiet_hours) is expected
@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from cache import TTLCache
+from shared_state import MemoryBackend, SQLiteBackend
+
+
+@pytest.fixture(params=["none", "memory", "sqlite"])
+def make_backend(request, tmp_path):
+    def make():
+        if request.param == "memory":
+            return MemoryBackend()
+        if request.param == "sqlite":
+            return SQLiteBackend(str(tmp_path / "state.sqlite3"))
+        return None
+    return make
+
+
+def test_concurrent_misses_share_one_load(make_backend):
+    async def run():
+        cache = TTLCache("t", backend=make_backend())
+        calls = 0
+
+        async def loader():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return {"value": calls}
+
+        values = await asyncio.gather(*(cache.get_or_load("k", loader) for _ in range(5)))
+        return cache, calls, values
+
+    cache, calls, values = asyncio.run(run())
+    assert calls == 1
+    assert values == [{"value": 1}] * 5
+    assert cache.misses == 1
+    assert cache.coalesced == 4
+
+
+def test_hit_after_load(make_backend):
+    async def run():
+        cache = TTLCache("t", backend=make_backend())
+
+        async def loader():
+            return [1, 2]
+
+        await cache.get_or_load("k", loader)
+        await cache.get_or_load("k", loader)
+        return cache
+
+    assert asyncio.run(run()).hits == 1
+
+
+def test_load_racing_an_invalidation_is_not_stored(make_backend):
+    async def run():
+        cache = TTLCache("t", backend=make_backend())
+        versions = iter(["old", "new"])
+
+        async def loader():
+            value = next(versions)
+            await asyncio.sleep(0.05)
+            return value
+
+        pending = asyncio.create_task(cache.get_or_load("k", loader))
+        await asyncio.sleep(0.01)
+        await cache.invalidate()
+        first = await pending
+        second = await cache.get_or_load("k", loader)
+        return first, second
+
+    # The load that started before the write still answers its caller but is not cached
+    assert asyncio.run(run()) == ("old", "new")
+
+
+def test_invalidation_is_seen_by_another_process(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+
+    async def run():
+        ours = TTLCache("t", backend=SQLiteBackend(path))
+        theirs = TTLCache("t", backend=SQLiteBackend(path))
+        values = iter(["old", "new"])
+
+        async def loader():
+            return next(values)
+
+        await ours.get_or_load("k", loader)
+        shared = await theirs.get_or_load("k", loader)
+        await theirs.invalidate()
+        return shared, await ours.get_or_load("k", loader)
+
+    assert asyncio.run(run()) == ("old", "new")
+
+
+def test_invalidate_with_predicate(make_backend):
+    async def run():
+        cache = TTLCache("t", backend=make_backend())
+
+        async def loader():
+            return 1
+
+        for key in (("a", 1), ("b", 1)):
+            await cache.get_or_load(key, loader)
+        return await cache.invalidate(lambda key: key[0] == "a"), cache.stats()["entries"]
+
+    assert asyncio.run(run()) == (1, 1)
@@ -0,0 +1,45 @@
+from downsample import downsample_history, lttb
+
+
+def _series(values):
+    return [{"ts_ms": i, "latency_s": v} for i, v in enumerate(values)]
+
+
+def test_lttb_returns_short_series_unchanged():
+    points = _series([1, 2, 3])
+    assert lttb(points, 10) == points
+    assert lttb(points, 10) is not points
+
+
+def test_lttb_keeps_endpoints_and_bounds_size():
+    points = _series([float(i % 7) for i in range(100)])
+    sampled = lttb(points, 10)
+    assert len(sampled) == 10
+    assert sampled[0] is points[0]
+    assert sampled[-1] is points[-1]
+    assert [p["ts_ms"] for p in sampled] == sorted(p["ts_ms"] for p in sampled)
+
+
+def test_lttb_keeps_a_spike():
+    values = [1.0] * 100
+    values[57] = 50.0
+    sampled = lttb(_series(values), 8)
+    assert any(p["latency_s"] == 50.0 for p in sampled)
+
+
+def test_lttb_tiny_budget():
+    points = _series([1, 2, 3, 4])
+    assert lttb(points, 2) == [points[0], points[-1]]
+    assert lttb(points, 1) == [points[0]]
+
+
+def test_downsample_history_per_series_newest_first():
+    history = [
+        {"model": model, "prompt_id": "default", "ts_ms": i, "latency_s": float(i % 5)}
+        for model in ("a", "b")
+        for i in range(50)
+    ]
+    result = downsample_history(history, 5)
+    assert len(result) == 10
+    assert sum(1 for r in result if r["model"] == "a") == 5
+    assert [r["ts_ms"] for r in result] == sorted((r["ts_ms"] for r in result), reverse=True)
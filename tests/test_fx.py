@@ -0,0 +1,97 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("httpx")
+pytest.importorskip("openai")
+pytest.importorskip("anthropic")
+
+import fx  # noqa: E402
+
+RATES = {"USD": 1.0, "GBP": 0.8, "EUR": 0.9, "JPY": 150.0}
+
+
+@pytest.fixture
+def rates(monkeypatch):
+    async def get_rates():
+        return RATES
+
+    monkeypatch.setattr(fx, "get_rates", get_rates)
+    monkeypatch.setattr(fx, "FX_CURRENCIES", ["GBP"])
+
+
+def test_convert_keeps_none_and_rounds():
+    assert fx.convert([1.0, None, 0.1234567], "gbp", RATES) == [0.8, None, 0.098765]
+
+
+def test_convert_unknown_currency_is_none():
+    assert fx.convert([1.0, 2.0], "XYZ", RATES) == [None, None]
+
+
+def test_add_costs_always_adds_gbp(rates):
+    results = asyncio.run(fx.add_costs([{"cost_usd": 2.0}, {"cost_usd": None}]))
+    assert results == [
+        {"cost_usd": 2.0, "cost_gbp": 1.6},
+        {"cost_usd": None, "cost_gbp": None},
+    ]
+
+
+def test_add_costs_configured_and_extra_currencies(monkeypatch, rates):
+    monkeypatch.setattr(fx, "FX_CURRENCIES", ["GBP", "EUR"])
+    [result] = asyncio.run(fx.add_costs([{"cost_usd": 1.0}], ["jpy", "usd", "EUR"]))
+    # USD is the base, so it gets no extra column
+    assert result == {"cost_usd": 1.0, "cost_gbp": 0.8, "cost_eur": 0.9, "cost_jpy": 150.0}
+
+
+def test_add_costs_looks_rates_up_once_per_batch(monkeypatch):
+    calls = []
+
+    async def get_rates():
+        calls.append(1)
+        return RATES
+
+    monkeypatch.setattr(fx, "get_rates", get_rates)
+    monkeypatch.setattr(fx, "FX_CURRENCIES", ["GBP", "EUR"])
+    asyncio.run(fx.add_costs([{"cost_usd": 1.0}] * 10, ["JPY"]))
+    assert len(calls) == 1
+
+
+@pytest.fixture
+def cached(monkeypatch):
+    """Rates loaded in memory `age` ago, with refreshes recorded instead of run"""
+    refreshes = []
+
+    async def refresh():
+        refreshes.append(1)
+
+    def load(age):
+        monkeypatch.setattr(fx, "_rates", {"USD": 1.0, "GBP": 0.75})
+        monkeypatch.setattr(fx, "_fetched_at", datetime.now(timezone.utc) - age)
+
+    monkeypatch.setattr(fx, "_loaded", True)
+    monkeypatch.setattr(fx, "_refresh_task", None)
+    monkeypatch.setattr(fx, "_retry_at", 0.0)
+    monkeypatch.setattr(fx, "_refresh", refresh)
+    return load, refreshes
+
+
+def test_fresh_rates_are_served_from_memory(cached):
+    load, refreshes = cached
+    load(timedelta(minutes=5))
+    assert asyncio.run(fx.get_rates())["GBP"] == 0.75
+    assert refreshes == []
+
+
+def test_stale_rates_are_served_while_refreshing(cached):
+    load, refreshes = cached
+    load(fx.FX_CACHE_TTL + timedelta(hours=1))
+
+    async def run():
+        rates = await fx.get_rates()
+        await fx._refresh_task
+        return rates
+
+    assert asyncio.run(run())["GBP"] == 0.75
+    assert refreshes == [1]
@@ -0,0 +1,199 @@
+import asyncio
+import time
+
+import pytest
+
+import jobs
+from jobs import JobQueue, QueueFull
+from shared_state import MemoryBackend, SQLiteBackend
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_backend(request, tmp_path):
+    def make():
+        if request.param == "sqlite":
+            return SQLiteBackend(str(tmp_path / "state.sqlite3"))
+        return MemoryBackend()
+    return make
+
+
+async def _runner(job):
+    await asyncio.sleep(0.05)
+    await job.publish("result", {"model": "m"})
+    return {"results": 1}
+
+
+def test_identical_submissions_share_one_job(make_backend):
+    async def run():
+        queue = JobQueue(backend=make_backend())
+        try:
+            submitted = await asyncio.gather(*(queue.submit("k", {}, _runner) for _ in range(3)))
+            job = await queue.wait(submitted[0][0])
+        finally:
+            await queue.stop()
+        return submitted, job
+
+    submitted, job = asyncio.run(run())
+    assert len({job_id for job_id, _ in submitted}) == 1
+    assert [joined for _, joined in submitted] == [False, True, True]
+    assert job["status"] == "completed"
+    assert job["submitters"] == 3
+    assert len(job["results"]) == 1
+
+
+def test_finished_job_is_not_joined(make_backend):
+    async def run():
+        queue = JobQueue(backend=make_backend())
+        try:
+            first, _ = await queue.submit("k", {}, _runner)
+            await queue.wait(first)
+            second, joined = await queue.submit("k", {}, _runner)
+            await queue.wait(second)
+        finally:
+            await queue.stop()
+        return first, second, joined
+
+    first, second, joined = asyncio.run(run())
+    assert first != second
+    assert not joined
+
+
+def test_other_worker_joins_and_follows(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+
+    async def run():
+        owner = JobQueue(backend=SQLiteBackend(path))
+        other = JobQueue(backend=SQLiteBackend(path))
+        try:
+            job_id, _ = await owner.submit("k", {}, _runner)
+            joined = await other.submit("k", {}, _runner)
+            events = [event async for event, _ in other.follow(job_id)]
+            final = await other.wait(job_id)
+        finally:
+            await owner.stop()
+            await other.stop()
+        return job_id, joined, events, final
+
+    job_id, joined, events, final = asyncio.run(run())
+    assert joined == (job_id, True)
+    assert events[-2:] == ["result", "done"]
+    assert final["status"] == "completed"
+    assert len(final["results"]) == 1
+
+
+def test_queue_full(make_backend):
+    async def run():
+        queue = JobQueue(workers=1, max_queued=1, backend=make_backend())
+        try:
+            await queue.submit("a", {}, _runner)
+            await asyncio.sleep(0)  # the worker takes "a"
+            await queue.submit("b", {}, _runner)
+            with pytest.raises(QueueFull):
+                await queue.submit("c", {}, _runner)
+        finally:
+            await queue.stop()
+
+    asyncio.run(run())
+
+
+def test_remote_snapshot_carries_results(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+
+    async def run():
+        owner = JobQueue(backend=SQLiteBackend(path))
+        other = JobQueue(backend=SQLiteBackend(path))
+        try:
+            job_id, _ = await owner.submit("k", {"models": ["m"]}, _runner)
+            await owner.wait(job_id)
+            return await other.snapshot(job_id)
+        finally:
+            await owner.stop()
+
+    snapshot = asyncio.run(run())
+    assert snapshot["status"] == "completed"
+    assert snapshot["models"] == ["m"]
+    assert snapshot["results"] == [{"model": "m"}]
+
+
+def test_unknown_remote_job(tmp_path):
+    async def run():
+        queue = JobQueue(backend=SQLiteBackend(str(tmp_path / "state.sqlite3")))
+        return await queue.snapshot("missing"), [event async for event, _ in queue.follow("missing")]
+
+    assert asyncio.run(run()) == (None, ["failed"])
+
+
+class _SlowDeleteBackend(MemoryBackend):
+    async def delete(self, namespace, key, value=None):
+        await asyncio.sleep(0.05)
+        await super().delete(namespace, key, value)
+
+
+def test_follower_gets_the_terminal_event_despite_a_slow_claim_release():
+    async def run():
+        queue = JobQueue(backend=_SlowDeleteBackend())
+        try:
+            job_id, _ = await queue.submit("k", {}, _runner)
+            return [event async for event, _ in queue.follow(job_id)]
+        finally:
+            await queue.stop()
+
+    assert asyncio.run(run()) == ["queued", "start", "result", "done"]
+
+
+def test_claim_without_status_is_live_until_stale(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+
+    async def run():
+        backend = SQLiteBackend(path)
+        queue = JobQueue(backend=backend)
+        try:
+            # Another worker has claimed the key but not published its status yet
+            await backend.add(jobs._CLAIMS, "fresh", {"job_id": "other", "claimed_at": time.time()}, 60)
+            fresh = await queue.submit("fresh", {}, _runner)
+            await backend.add(jobs._CLAIMS, "stale", {"job_id": "gone", "claimed_at": time.time() - 3600}, 60)
+            stale = await queue.submit("stale", {}, _runner)
+            await queue.wait(stale[0])
+            return fresh, stale
+        finally:
+            await queue.stop()
+
+    fresh, stale = asyncio.run(run())
+    assert fresh == ("other", True)
+    assert stale[0] != "gone" and not stale[1]
+
+
+def test_concurrent_submits_from_two_workers_run_once(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+
+    async def run():
+        queues = [JobQueue(backend=SQLiteBackend(path)) for _ in range(2)]
+        try:
+            submitted = await asyncio.gather(*(queue.submit("k", {}, _runner) for queue in queues))
+            await queues[0].wait(submitted[0][0])
+        finally:
+            for queue in queues:
+                await queue.stop()
+        return submitted, [queue.stats()["completed"] for queue in queues]
+
+    submitted, completed = asyncio.run(run())
+    assert submitted[0][0] == submitted[1][0]
+    assert sorted(joined for _, joined in submitted) == [False, True]
+    assert sum(completed) == 1
+
+
+def test_finished_owner_does_not_release_a_taken_over_claim(tmp_path):
+    async def run():
+        backend = SQLiteBackend(str(tmp_path / "state.sqlite3"))
+        queue = JobQueue(backend=backend)
+        try:
+            job_id, _ = await queue.submit("k", {}, _runner)
+            # Another worker took the key over while the job was running
+            await backend.set(jobs._CLAIMS, "k", {"job_id": "other", "claimed_at": time.time()}, 60)
+            await queue.wait(job_id)
+            await asyncio.sleep(0.05)
+            return await backend.get(jobs._CLAIMS, "k")
+        finally:
+            await queue.stop()
+
+    assert asyncio.run(run())["job_id"] == "other"
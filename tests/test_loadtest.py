@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("asyncpg")
+
+import loadtest  # noqa: E402
+
+
+def test_parse_levels_clamps_and_deduplicates(monkeypatch):
+    monkeypatch.setattr(loadtest, "MAX_CONCURRENCY", 8)
+    assert loadtest.parse_levels([4, 0, 4, 100, 2]) == [1, 2, 4, 8]
+
+
+def test_total_requests():
+    assert loadtest.total_requests(3, [1, 2, 4], 5) == 105
+
+
+def test_run_level_counts_errors_and_rate_limits():
+    outcomes = iter([{"latency_s": 1.0, "out_tokens": 10}, {"error": "boom", "status_code": 429}] * 3)
+
+    async def probe():
+        return next(outcomes)
+
+    level = asyncio.run(loadtest.run_level(probe, concurrency=2, total=6))
+    assert level["requests"] == 6
+    assert level["successes"] == 3
+    assert level["errors"] == 3
+
+
+def test_finished_sweeps_are_pruned(monkeypatch):
+    monkeypatch.setattr(loadtest, "SWEEP_RETENTION_S", 0.05)
+    monkeypatch.setattr(loadtest, "insert_level", _no_insert)
+
+    async def probe():
+        return {"latency_s": 0.01, "out_tokens": 1}
+
+    async def run():
+        sweep_id = loadtest.start_sweep({"m": ("p", probe)}, [1], 1)
+        while loadtest.running_sweep():
+            await asyncio.sleep(0.01)
+        kept = loadtest.sweep_status(sweep_id)
+        await asyncio.sleep(0.1)
+        return kept, loadtest.sweep_status(sweep_id)
+
+    kept, pruned = asyncio.run(run())
+    assert kept["status"] == "completed"
+    assert pruned is None
+
+
+async def _no_insert(level):
+    pass
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("asyncpg")
+
+import main  # noqa: E402
+from providers import ProviderLimiter  # noqa: E402
+
+
+@pytest.fixture
+def openai_model(monkeypatch):
+    """An OpenAI-adapter model whose probe sleeps for `delays[model]` seconds"""
+    registry = main.get_registry()
+    model = next(m for m in registry.model_ids() if registry.provider_for(m)["adapter"] == "openai")
+    delays = {}
+
+    async def probe(provider_key, model, api_model, stream, prompt, max_tokens):
+        await asyncio.sleep(delays.get(model, 0))
+        return main._success_result(model, delays.get(model, 0), 10, 20)
+
+    async def no_costs(results, currencies=()):
+        return results
+
+    monkeypatch.setitem(main.PROBE_ADAPTERS, "openai", probe)
+    monkeypatch.setattr(main, "add_costs", no_costs)
+    # One request at a time, no rate limit
+    monkeypatch.setitem(registry._limiters, registry.provider_for(model)["key"], ProviderLimiter(None, 1, 1))
+    return model, delays
+
+
+def _collect(plan, stream=False):
+    async def run():
+        return [result async for result in main._run_as_completed(plan, stream)]
+    return asyncio.run(run())
+
+
+def test_queueing_for_the_limiter_is_not_a_timeout(monkeypatch, openai_model):
+    model, delays = openai_model
+    delays[model] = 0.15
+    monkeypatch.setattr(main, "RUN_TEST_MODEL_TIMEOUT_S", 0.25)
+    monkeypatch.setattr(main, "RUN_TEST_TOTAL_TIMEOUT_S", 5)
+
+    # The second probe waits ~0.15s for the slot, then takes 0.15s itself
+    results = _collect([(model, "default", None), (model, "in_100", None)])
+    assert len(results) == 2
+    assert not any(r.get("timed_out") for r in results)
+
+
+def test_slow_probe_times_out(monkeypatch, openai_model):
+    model, delays = openai_model
+    delays[model] = 1.0
+    monkeypatch.setattr(main, "RUN_TEST_MODEL_TIMEOUT_S", 0.05)
+    monkeypatch.setattr(main, "RUN_TEST_TOTAL_TIMEOUT_S", 5)
+
+    [result] = _collect([(model, "in_1k", 20)])
+    assert result["timed_out"]
+    assert result["prompt_id"] == "in_1k"
+    assert result["max_tokens"] == 20
+    assert "0.05s" in result["error"]
+
+
+def test_run_deadline_cancels_stragglers(monkeypatch, openai_model):
+    model, delays = openai_model
+    delays[model] = 1.0
+    monkeypatch.setattr(main, "RUN_TEST_MODEL_TIMEOUT_S", 5)
+    monkeypatch.setattr(main, "RUN_TEST_TOTAL_TIMEOUT_S", 0.05)
+
+    [result] = _collect([(model, "default", None)])
+    assert result["timed_out"]
+    assert "run deadline" in result["error"]
+
+
+def test_stream_metrics_split_ttft_from_decode():
+    metrics = main._stream_metrics(10.0, [10.5, 10.6, 10.8, 11.5], 11.5, 31)
+    assert metrics["ttft_s"] == 0.5
+    # 30 tokens after the first chunk over the 1s between it and the end
+    assert metrics["decode_tps"] == 30.0
+    # Gaps of 0.1, 0.2 and 0.7s
+    assert metrics["itl_p50_s"] == 0.2
+    assert metrics["itl_p95_s"] == 0.65
+    assert metrics["itl_p99_s"] == 0.69
+
+
+def test_stream_metrics_without_content_chunks():
+    assert main._stream_metrics(10.0, [], 11.0, 0) == {
+        "ttft_s": None,
+        "decode_tps": None,
+        "itl_p50_s": None,
+        "itl_p95_s": None,
+        "itl_p99_s": None,
+    }
+
+
+def test_stream_metrics_single_chunk():
+    metrics = main._stream_metrics(10.0, [10.25], 10.25, 1)
+    assert metrics["ttft_s"] == 0.25
+    assert metrics["decode_tps"] == 0
+    assert metrics["itl_p50_s"] is None
+
+
+def test_success_result_carries_stream_metrics():
+    stream_stats = main._stream_metrics(10.0, [10.5, 11.5], 11.5, 11)
+    result = main._success_result("gpt-4o-mini", 1.5, 10, 11, stream_stats)
+    assert result["ttft_s"] == 0.5
+    assert result["decode_tps"] == 10.0
+    assert main._success_result("gpt-4o-mini", 1.5, 10, 11)["ttft_s"] is None
@@ -0,0 +1,41 @@
+import pytest
+
+from prompts import DEFAULT_PROMPT_ID, MAX_OUTPUT_CAP, PROMPTS, output_cap, parse_matrix
+
+
+def test_output_cap_defaults_to_prompt():
+    assert output_cap("out_1k") == PROMPTS["out_1k"]["max_tokens"]
+
+
+def test_output_cap_clamps_override():
+    assert output_cap("in_1k", 0) == 1
+    assert output_cap("in_1k", MAX_OUTPUT_CAP + 1) == MAX_OUTPUT_CAP
+    assert output_cap("in_1k", "50") == 50
+
+
+def test_parse_matrix_empty_is_default():
+    assert parse_matrix(None) == [(DEFAULT_PROMPT_ID, PROMPTS[DEFAULT_PROMPT_ID]["max_tokens"])]
+    assert parse_matrix("") == parse_matrix([])
+
+
+def test_parse_matrix_string_and_list():
+    expected = [("in_1k", PROMPTS["in_1k"]["max_tokens"]), ("in_8k", 50)]
+    assert parse_matrix("in_1k, in_8k:50") == expected
+    assert parse_matrix(["in_1k", "in_8k:50"]) == expected
+
+
+def test_parse_matrix_deduplicates():
+    assert parse_matrix("in_1k,in_1k,in_1k:7") == [
+        ("in_1k", PROMPTS["in_1k"]["max_tokens"]),
+        ("in_1k", 7),
+    ]
+
+
+def test_parse_matrix_rejects_unknown_id():
+    with pytest.raises(ValueError, match="Unknown prompt id"):
+        parse_matrix("in_1k,nope")
+
+
+def test_parse_matrix_rejects_bad_cap():
+    with pytest.raises(ValueError, match="Invalid max_tokens"):
+        parse_matrix("in_1k:lots")
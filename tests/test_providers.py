@@ -0,0 +1,37 @@
+import asyncio
+import time
+
+from providers import TokenBucket
+
+
+def test_token_bucket_burst_is_immediate():
+    async def run():
+        bucket = TokenBucket(rate_per_s=1, burst=3)
+        return [await bucket.acquire() for _ in range(3)]
+
+    assert all(waited < 0.05 for waited in asyncio.run(run()))
+
+
+def test_token_bucket_waits_for_refill():
+    async def run():
+        bucket = TokenBucket(rate_per_s=20, burst=1)
+        await bucket.acquire()
+        return await bucket.acquire()
+
+    waited = asyncio.run(run())
+    assert 0.03 <= waited < 0.2
+
+
+def test_token_bucket_sustained_rate():
+    async def run():
+        bucket = TokenBucket(rate_per_s=50, burst=1)
+        start = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(6)))
+        return time.monotonic() - start
+
+    # First token is free, the other five arrive at 50/s
+    assert 0.08 <= asyncio.run(run()) < 0.4
+
+
+def test_token_bucket_burst_floor():
+    assert TokenBucket(rate_per_s=1, burst=0).burst == 1
@@ -0,0 +1,28 @@
+import pytest
+
+pytest.importorskip("asyncpg")
+
+from sampling import robust_summary  # noqa: E402
+
+
+def test_robust_summary_empty():
+    assert robust_summary([]) == {"median": None, "iqr": None, "trimmed_mean": None}
+
+
+def test_robust_summary_odd_and_even():
+    assert robust_summary([3.0, 1.0, 2.0], trim=0)["median"] == 2.0
+    assert robust_summary([4.0, 1.0, 3.0, 2.0], trim=0)["median"] == 2.5
+
+
+def test_robust_summary_iqr():
+    assert robust_summary([1.0, 2.0, 3.0, 4.0, 5.0], trim=0)["iqr"] == 2.0
+
+
+def test_robust_summary_trimmed_mean_ignores_outliers():
+    values = [1.0] + [10.0] * 8 + [1000.0]
+    assert robust_summary(values, trim=0.1)["trimmed_mean"] == 10.0
+    assert robust_summary(values, trim=0)["trimmed_mean"] == pytest.approx(108.1)
+
+
+def test_robust_summary_single_value():
+    assert robust_summary([7.0], trim=0.4) == {"median": 7.0, "iqr": 0.0, "trimmed_mean": 7.0}
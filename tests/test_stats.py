@@ -0,0 +1,21 @@
+import pytest
+
+pytest.importorskip("asyncpg")
+
+from stats import percentile  # noqa: E402
+
+
+def test_percentile_empty():
+    assert percentile([], 50) is None
+
+
+def test_percentile_interpolates_unsorted_input():
+    values = [4.0, 1.0, 3.0, 2.0]
+    assert percentile(values, 0) == 1.0
+    assert percentile(values, 50) == 2.5
+    assert percentile(values, 100) == 4.0
+    assert percentile(values, 25) == pytest.approx(1.75)
+
+
+def test_percentile_single_value():
+    assert percentile([7.0], 99) == 7.0